@@ -0,0 +1,90 @@
+import json
+import time
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+class BenchmarkRunner:
+    """ 收集各項基準測試的耗時並輸出為 JSON，可與先前的結果比較 """
+
+    def __init__(self, iterations=5, warmup=1, name_filter=None):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.name_filter = name_filter
+        self.results = []
+
+    def enabled(self, name):
+        return not self.name_filter or self.name_filter in name
+
+    async def measure(self, name, params, fn, setup=None, iterations=None):
+        """
+        執行 fn(*setup()) 並計時 (setup 不計入)
+        fn / setup 皆為 async 函數；setup 回傳 fn 的參數 tuple
+        """
+        if not self.enabled(name):
+            return None
+        iterations = iterations or self.iterations
+        samples = []
+        for i in range(self.warmup + iterations):
+            args = await setup() if setup else ()
+            start = time.perf_counter()
+            await fn(*args)
+            elapsed = time.perf_counter() - start
+            if i >= self.warmup:
+                samples.append(elapsed * 1000)
+
+        samples.sort()
+        result = {
+            "name": name,
+            "params": params,
+            "iterations": iterations,
+            "mean_ms": round(statistics.fmean(samples), 4),
+            "median_ms": round(statistics.median(samples), 4),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+            "min_ms": round(samples[0], 4),
+            "max_ms": round(samples[-1], 4),
+        }
+        self.results.append(result)
+        print(f"{name:<32} {json.dumps(params):<28} median {result['median_ms']:>10.3f} ms  p95 {result['p95_ms']:>10.3f} ms")
+        return result
+
+    def report(self, config=None):
+        return {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": config or {},
+            },
+            "results": self.results,
+        }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def _key(result):
+    return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+def compare(baseline, current, threshold):
+    """ 以 median 比較兩次結果，回傳超過 threshold 倍數的退化項目 """
+    base = {_key(r): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'benchmark':<32} {'params':<28} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    for result in current['results']:
+        old = base.get(_key(result))
+        if old is None or not old['median_ms']:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{result['name']:<32} {json.dumps(result['params']):<28} "
+              f"{old['median_ms']:>10.3f} {result['median_ms']:>10.3f} {ratio:>7.2f}{flag}")
+        if ratio > threshold:
+            regressions.append((result, ratio))
+    return regressions
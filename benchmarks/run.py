@@ -0,0 +1,239 @@
+"""
+合約生命週期熱路徑的基準測試
+
+Supabase 與 mempool.space 分別以進程內的 SQLite 與模擬鏈取代，不需網路。
+
+    python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --compare bench.json --threshold 1.25
+    python benchmarks/run.py --filter build_ --iterations 20
+    python benchmarks/run.py --full     # 較大的輸入數 / 合約數 (純 Python 簽名，耗時較長)
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import secrets
+
+# 必須在匯入 service 之前設定: 使用進程內後端與固定金鑰
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = ":memory:"
+os.environ["CHAIN_BACKEND"] = "fake"
+os.environ.setdefault("HOUSE_KEY_SECRET", "1122334455667788990011223344556677889900")
+os.environ.setdefault("ORACLE_KEY_SECRET", "9988776655443322110099887766554433221100")
+os.environ.setdefault("UTXO_CACHE_TTL", "0")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bitcoinutils.setup import setup
+setup('testnet')
+
+from bitcoinutils.keys import PrivateKey, PublicKey
+from harness import BenchmarkRunner, compare
+from service.chain_backend import chain
+from service.bitcoin_service import (
+    create_2of3_address, get_spend_context, get_house_address, utxo_cache, HOUSE_PUB_KEY
+)
+from service.database import db_create_contract, db_get_contract
+from service.house_wallet import house_wallet
+from service.signing_service import signer, SIGNING_WORKERS
+from service.transaction_service import (
+    build_win_path_partial_tx, build_multisig_spend, build_refund_tx,
+    build_batch_multisig_spend, send_funds_from_house_batch
+)
+from service.settlement_service import execute_settlement
+from service.websocket_manager import ConnectionManager, manager
+from router.contract_router import settle_all_contracts, SettleAllRequest
+
+USER_PUBKEY = PrivateKey(secret_exponent=424242).get_public_key().to_hex()
+AMOUNT = 10000
+LOSING_DIFFICULTY = 0.1     # LONG 獲勝 / SHORT 落敗
+
+# 各項目的規模 (預設 / --full)
+SIZES = {
+    "default": {
+        "inputs": [1, 5], "payments": [1, 10, 50], "batch": [10, 25],
+        "book": [10, 50], "connections": [10, 100, 1000],
+    },
+    "full": {
+        "inputs": [1, 5, 20], "payments": [1, 10, 50, 100], "batch": [10, 50, 100],
+        "book": [10, 50, 200], "connections": [10, 100, 1000, 5000],
+    },
+}
+
+def new_contract(n_inputs=1, direction='SHORT'):
+    """ 建立內存合約 (不寫入資料庫) 並在模擬鏈上注入 n 筆 UTXO """
+    nonce = secrets.token_hex(4)
+    address, _ = create_2of3_address(USER_PUBKEY, nonce)
+    for _ in range(n_inputs):
+        chain.fund(address, AMOUNT * 2 // n_inputs)
+    return {
+        "id": 0, "user_pubkey": USER_PUBKEY, "deposit_address": address,
+        "amount": AMOUNT, "direction": direction, "nonce": nonce, "status": "PENDING",
+    }
+
+async def new_db_contract(direction='SHORT'):
+    """ 建立已注資的 PENDING 合約 (寫入資料庫) """
+    nonce = secrets.token_hex(4)
+    address, script_hex = create_2of3_address(USER_PUBKEY, nonce)
+    contract_id = await db_create_contract(USER_PUBKEY, address, script_hex, AMOUNT, direction, nonce)
+    chain.fund(address, AMOUNT * 2)
+    return await db_get_contract(contract_id)
+
+async def bench_addresses(runner):
+    async def cold():
+        get_spend_context.cache_clear()
+        create_2of3_address(USER_PUBKEY, secrets.token_hex(4))
+
+    nonce = secrets.token_hex(4)
+    async def warm():
+        create_2of3_address(USER_PUBKEY, nonce)
+
+    await runner.measure("create_2of3_address", {"cache": "cold"}, cold)
+    await runner.measure("create_2of3_address", {"cache": "warm"}, warm)
+
+def heavy(runner):
+    """ 多合約項目 (每輪數十個簽名) 的迭代次數 """
+    return max(1, runner.iterations // 5)
+
+async def bench_builders(runner, sizes):
+    house_addr = HOUSE_PUB_KEY.get_segwit_address()
+    user_addr = PublicKey(USER_PUBKEY).get_segwit_address()
+
+    for n in sizes['inputs']:
+        contract = new_contract(n)
+        await runner.measure("build_win_path_partial_tx", {"inputs": n},
+                             lambda: build_win_path_partial_tx(contract, user_addr))
+        await runner.measure("build_multisig_spend", {"inputs": n},
+                             lambda: build_multisig_spend(contract, house_addr))
+        await runner.measure("build_refund_tx", {"inputs": n},
+                             lambda: build_refund_tx(contract))
+
+    for n in sizes['batch']:
+        entries = []
+        for _ in range(n):
+            contract = new_contract()
+            entries.append((contract, await chain.get_utxos(contract['deposit_address'])))
+        await runner.measure("build_batch_multisig_spend", {"contracts": n},
+                             lambda: build_batch_multisig_spend(entries, house_addr),
+                             iterations=heavy(runner))
+
+    for _ in range(50):
+        chain.fund(get_house_address(), 10_000_000)
+    await house_wallet.refresh()
+    for n in sizes['payments']:
+        payments = [(get_spend_context(USER_PUBKEY, secrets.token_hex(4)).address, AMOUNT)
+                    for _ in range(n)]
+
+        async def fund_batch():
+            # 不廣播: 釋放保留讓下一輪可重複選幣
+            house_wallet.release_tx(await send_funds_from_house_batch(payments))
+
+        await runner.measure("send_funds_from_house_batch", {"payments": n}, fund_batch)
+
+async def bench_settlement(runner, sizes):
+    for direction in ('LONG', 'SHORT'):
+        async def setup():
+            return (await new_db_contract(direction),)
+
+        await runner.measure("execute_settlement", {"path": "win" if direction == 'LONG' else "loss"},
+                             lambda contract: execute_settlement(contract, LOSING_DIFFICULTY, manager),
+                             setup=setup)
+
+    for n in sizes['book']:
+        for batch_losses in (False, True):
+            async def setup():
+                for i in range(n):
+                    await new_db_contract('LONG' if i % 2 else 'SHORT')
+                return ()
+
+            await runner.measure(
+                "settle_all_contracts", {"contracts": n, "batch_losses": batch_losses},
+                lambda: settle_all_contracts(SettleAllRequest(
+                    current_difficulty=LOSING_DIFFICULTY, batch_losses=batch_losses, wait=True
+                )),
+                setup=setup, iterations=heavy(runner)
+            )
+
+class NullWebSocket:
+    """ 立即完成送出的 WebSocket """
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+async def bench_websocket(runner, sizes):
+    message = {"type": "MATCHED", "contract_id": 1, "user_pubkey": USER_PUBKEY, "tx_hex": "00" * 200}
+
+    for n in sizes['connections']:
+        ws_manager = ConnectionManager()
+        for _ in range(n):
+            await ws_manager.connect(NullWebSocket())
+        queues = [conn.queue for conn in ws_manager.active_connections.values()]
+
+        async def drain():
+            while any(not q.empty() for q in queues):
+                await asyncio.sleep(0)
+            return ()
+
+        async def broadcast():
+            await ws_manager.broadcast(message)
+
+        async def delivered():
+            await ws_manager.broadcast(message)
+            await drain()
+
+        await runner.measure("ws_broadcast_enqueue", {"connections": n}, broadcast, setup=drain)
+        await runner.measure("ws_broadcast_delivered", {"connections": n}, delivered, setup=drain)
+
+        for ws in list(ws_manager.active_connections):
+            ws_manager.disconnect(ws)
+
+async def main(args):
+    runner = BenchmarkRunner(iterations=args.iterations, warmup=args.warmup, name_filter=args.filter)
+    await chain.start()
+    signer.start()
+    try:
+        sizes = SIZES["full" if args.full else "default"]
+        await bench_addresses(runner)
+        await bench_builders(runner, sizes)
+        await bench_settlement(runner, sizes)
+        await bench_websocket(runner, sizes)
+    finally:
+        signer.close()
+        await chain.close()
+
+    report = runner.report({
+        "signing_workers": SIGNING_WORKERS, "utxo_cache_ttl": utxo_cache.ttl, "full": args.full
+    })
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than {args.threshold}x baseline")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HashHedge hot path benchmarks")
+    parser.add_argument("--output", help="寫入 JSON 結果的路徑 (未指定則輸出至 stdout)")
+    parser.add_argument("--compare", help="與先前的 JSON 結果比較")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median 退化倍數門檻")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--full", action="store_true", help="使用較大的規模")
+    parser.add_argument("--filter", help="只執行名稱包含此字串的項目")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -4,8 +4,23 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from bitcoinutils.setup import setup
 
-from service.database import init_db
-from router import contract_router, websocket_router
+from service.database import init_db, db_get_exposure_rows, db_get_exposure_totals, db_get_exposure_row
+from service.bitcoin_service import init_chain, close_chain
+from service.chain_backend import chain, FakeChainBackend
+from service.match_batcher import match_batcher
+from service.house_wallet import house_wallet
+from service.deposit_watcher import deposit_watcher, DEPOSIT_WATCHER_ENABLED
+from service.websocket_manager import manager
+from service.event_bus import event_bus
+from service.signing_service import signer
+from service.fee_service import fee_rates
+from service.stats_service import stats_service
+from service.job_queue import job_queue
+from service.maturity_scheduler import maturity_scheduler, MATURITY_SCHEDULER_ENABLED
+from service.exposure_book import exposure_book
+from service.metrics import MetricsMiddleware
+from service.profiler import ProfilingMiddleware, PROFILE_ENABLED
+from router import contract_router, websocket_router, job_router, dev_router, metrics_router, profile_router
 
 # 設定比特幣環境
 setup('testnet') 
@@ -13,9 +28,31 @@ setup('testnet')
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    signer.start()
     init_db()
+    await event_bus.start(manager.deliver)
+    await init_chain()
+    await fee_rates.start()
+    await house_wallet.refresh()
+    await stats_service.start()
+    await exposure_book.start(manager, db_get_exposure_rows, db_get_exposure_totals, db_get_exposure_row)
+    if DEPOSIT_WATCHER_ENABLED:
+        await deposit_watcher.start(manager)
+    await job_queue.start(manager)
+    if MATURITY_SCHEDULER_ENABLED:
+        await maturity_scheduler.start(manager)
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    await maturity_scheduler.stop()
+    await job_queue.stop()
+    await deposit_watcher.stop()
+    await exposure_book.stop()
+    await event_bus.close()
+    await stats_service.stop()
+    await match_batcher.close()
+    await fee_rates.stop()
+    await close_chain()
+    signer.close()
 
 app = FastAPI(title="HashHedge Trust-Minimized Oracle", lifespan=lifespan)
 
@@ -27,9 +64,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 路由延遲 / 依賴耗時指標
+app.add_middleware(MetricsMiddleware)
+
+# 按需取樣分析 (X-Profile: 1)，未啟用時不註冊
+if PROFILE_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # 註冊路由
 app.include_router(contract_router.router)
 app.include_router(websocket_router.router)
+app.include_router(job_router.router)
+app.include_router(metrics_router.router)
+if isinstance(chain, FakeChainBackend):
+    app.include_router(dev_router.router)
+if PROFILE_ENABLED:
+    app.include_router(profile_router.router)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,24 +1,28 @@
+import json
+import hashlib
 import secrets
 import traceback
-from fastapi import APIRouter, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from bitcoinutils.keys import PublicKey, P2trAddress
-from bitcoinutils.script import Script
-from bitcoinutils.utils import tapleaf_tagged_hash, tweak_taproot_pubkey
 
 from service.database import (
-    db_create_contract, db_get_contract, db_delete_contract, 
-    db_update_status, db_get_pending_contracts, db_get_user_contracts,
-    db_get_contracts_by_status, db_get_waiting_signature_contracts
+    db_create_contract, db_create_contracts, db_get_contract, db_delete_contract, 
+    db_reap_expired_leases, db_get_pending_contracts, db_get_user_contracts,
+    db_get_contracts_by_status, db_get_waiting_signature_contracts, CONTRACT_BULK_MAX
 )
-from service.bitcoin_service import (
-    create_2of3_address, get_utxos, broadcast_tx, 
-    get_house_address, to_x_only, NUMS_PUBKEY_HEX,
-    HOUSE_PRIV_KEY, ORACLE_PRIV_KEY
-)
-from service.transaction_service import send_funds_from_house, build_refund_tx
-from service.settlement_service import execute_settlement
+from service.bitcoin_service import derive_addresses
+from service.signing_service import signer
+from service.match_service import execute_match
+from service.refund_service import execute_refund
+from service.settlement_service import execute_settlement, settle_contracts
 from service.websocket_manager import manager
+from service.deposit_watcher import deposit_watcher, DEPOSIT_WATCHER_ENABLED
+from service.stats_service import stats_service
+from service.job_queue import job_queue
+from service.maturity_scheduler import maturity_scheduler
+from service.exposure_book import exposure_book
 
 router = APIRouter(prefix="/api", tags=["contract"])
 
@@ -26,131 +30,206 @@ class ContractRequest(BaseModel):
     user_pubkey: str
     amount: int
     direction: str
+    # 到期自動結算: 小於 500000000 為區塊高度，否則為 Unix 時間 (同 nLockTime)
+    maturity: Optional[int] = None
+
+class BulkContractRequest(BaseModel):
+    contracts: List[ContractRequest]
+
+# wait=False (預設) 時排入工作佇列並立即回傳 job_id；wait=True 時於請求內直接執行
 
 class SettleRequest(BaseModel):
     contract_id: int
-    current_difficulty: float
+    current_difficulty: Optional[float] = None
+    wait: bool = False
 
 class MatchRequest(BaseModel):
     contract_id: int
+    wait: bool = False
 
 class RefundRequest(BaseModel):
     contract_id: int
+    wait: bool = False
 
 class CancelRequest(BaseModel):
     contract_id: int
 
 class SettleAllRequest(BaseModel):
-    current_difficulty: float
+    current_difficulty: Optional[float] = None
+    concurrency: Optional[int] = None
+    timeout: Optional[float] = None
+    stream: bool = False
+    batch_losses: Optional[bool] = None
+    wait: bool = False
 
 @router.get("/stats")
-def stats():
-    house_addr = get_house_address()
-    return {
-        "difficulty": 0.047, 
-        "hashprice_sats": 220000.0,
-        "house_address": house_addr
+async def stats(request: Request):
+    """網路狀態快照 (背景更新，支援 If-None-Match)"""
+    headers = {
+        "ETag": stats_service.etag,
+        "Cache-Control": f"public, max-age={int(stats_service.refresh_seconds)}"
     }
+    if request.headers.get("if-none-match") == stats_service.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=stats_service.body, media_type="application/json", headers=headers)
+
+@router.get("/exposure")
+async def exposure(request: Request):
+    """House 曝險快照 (記憶體內增量維護，支援 If-None-Match)"""
+    headers = {"ETag": exposure_book.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == exposure_book.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=exposure_book.body, media_type="application/json", headers=headers)
+
+@router.get("/stats/history")
+async def stats_history(limit: Optional[int] = None):
+    history = stats_service.recent(limit)
+    return {"history": history, "count": len(history)}
+
+def _difficulty(req):
+    """ 未指定 current_difficulty 時使用背景更新的網路難度 """
+    if req.current_difficulty is not None:
+        return req.current_difficulty
+    if stats_service.difficulty is None:
+        raise HTTPException(503, "Network difficulty unavailable")
+    return stats_service.difficulty
+
+def _conditional_json(request: Request, payload):
+    """ 以內容雜湊作為 ETag，If-None-Match 相符時回傳 304 (輪詢時狀態未變不需重送) """
+    body = json.dumps(payload, default=str).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/contract/{contract_id}")
-def get_contract_api(contract_id: int):
-    contract = db_get_contract(contract_id)
+async def get_contract_api(contract_id: int, request: Request):
+    contract = await db_get_contract(contract_id)
     if not contract:
         raise HTTPException(status_code=404, detail="Contract not found")
-    return contract
+    return _conditional_json(request, contract)
+
+def _page(request, result):
+    contracts, next_cursor = result
+    return _conditional_json(request, {"contracts": contracts, "count": len(contracts), "next_cursor": next_cursor})
 
 @router.get("/contracts/user/{user_pubkey}")
-def get_user_contracts(user_pubkey: str):
-    """獲取特定用戶的所有合約"""
-    contracts = db_get_user_contracts(user_pubkey)
-    return {"contracts": contracts, "count": len(contracts)}
+async def get_user_contracts(user_pubkey: str, request: Request, fields: Optional[str] = None,
+                             limit: Optional[int] = None, cursor: Optional[str] = None):
+    """獲取特定用戶的合約 (keyset 分頁，fields= 指定欄位)"""
+    try:
+        return _page(request, await db_get_user_contracts(user_pubkey, fields, limit, cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/contracts/status/{status}")
-def get_contracts_by_status(status: str):
-    """獲取特定狀態的所有合約"""
-    contracts = db_get_contracts_by_status(status)
-    return {"contracts": contracts, "count": len(contracts)}
+async def get_contracts_by_status(status: str, request: Request, fields: Optional[str] = None,
+                                  limit: Optional[int] = None, cursor: Optional[str] = None):
+    """獲取特定狀態的合約 (keyset 分頁，fields= 指定欄位)"""
+    try:
+        return _page(request, await db_get_contracts_by_status(status, fields, limit, cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/contracts/waiting-signature")
-def get_waiting_signature_contracts():
-    """獲取所有等待用戶簽名的合約"""
-    contracts = db_get_waiting_signature_contracts()
-    return {"contracts": contracts, "count": len(contracts)}
+async def get_waiting_signature_contracts(request: Request, fields: Optional[str] = None,
+                                          limit: Optional[int] = None, cursor: Optional[str] = None):
+    """獲取等待用戶簽名的合約 (keyset 分頁，fields= 指定欄位)"""
+    try:
+        return _page(request, await db_get_waiting_signature_contracts(fields, limit, cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/create_contract")
-def create_contract(req: ContractRequest):
+async def create_contract(req: ContractRequest):
     nonce_hex = secrets.token_hex(4)
-    address, script_hex = create_2of3_address(req.user_pubkey, nonce_hex)
+    # Taproot 推導 (EC 運算) 於進程池執行，不阻塞事件迴圈
+    derived, = await signer.map(derive_addresses, [(req.user_pubkey, nonce_hex)])
+    if isinstance(derived, Exception):
+        raise HTTPException(400, str(derived))
+    address, script_hex = derived
     
-    contract_id = db_create_contract(req.user_pubkey, address, script_hex, req.amount, req.direction, nonce_hex)
+    contract_id = await db_create_contract(
+        req.user_pubkey, address, script_hex, req.amount, req.direction, nonce_hex, req.maturity
+    )
+    if DEPOSIT_WATCHER_ENABLED:
+        deposit_watcher.track({
+            'id': contract_id, 'user_pubkey': req.user_pubkey, 'deposit_address': address,
+            'amount': req.amount, 'nonce': nonce_hex
+        })
+    maturity_scheduler.schedule({'id': contract_id, 'maturity': req.maturity})
     
     return {
         "status": "success",
         "contract_id": contract_id,
         "deposit_address": address,
         "amount": req.amount,
+        "maturity": req.maturity,
         "message": f"Please deposit {req.amount} sats to this address. House will match 1:1."
     }
 
+@router.post("/create_contracts")
+async def create_contracts(req: BulkContractRequest):
+    """批次建立合約: 地址於進程池平行推導，單次插入資料庫；結果與請求同序，個別失敗以 error 回報"""
+    if len(req.contracts) > CONTRACT_BULK_MAX:
+        raise HTTPException(400, f"At most {CONTRACT_BULK_MAX} contracts per request")
+
+    nonces = [secrets.token_hex(4) for _ in req.contracts]
+    derived = await signer.map(derive_addresses, [(c.user_pubkey, n) for c, n in zip(req.contracts, nonces)])
+
+    valid = [i for i, d in enumerate(derived) if not isinstance(d, Exception)]
+    ids = await db_create_contracts([
+        (req.contracts[i].user_pubkey, derived[i][0], derived[i][1],
+         req.contracts[i].amount, req.contracts[i].direction, nonces[i], req.contracts[i].maturity)
+        for i in valid
+    ])
+
+    results = [{"status": "error", "error": str(d)} for d in derived]
+    for i, contract_id in zip(valid, ids):
+        c = req.contracts[i]
+        address = derived[i][0]
+        if DEPOSIT_WATCHER_ENABLED:
+            deposit_watcher.track({
+                'id': contract_id, 'user_pubkey': c.user_pubkey, 'deposit_address': address,
+                'amount': c.amount, 'nonce': nonces[i]
+            })
+        maturity_scheduler.schedule({'id': contract_id, 'maturity': c.maturity})
+        results[i] = {
+            "status": "success",
+            "contract_id": contract_id,
+            "deposit_address": address,
+            "amount": c.amount,
+            "maturity": c.maturity
+        }
+
+    return {
+        "status": "success",
+        "created": len(ids),
+        "failed": len(results) - len(ids),
+        "results": results
+    }
+
+async def _enqueue(action, contract_id=None, payload=None):
+    """ 排入工作佇列，202 回傳工作資訊 (同一合約 + 動作已有進行中的工作時回傳該工作) """
+    job, created = await job_queue.enqueue(action, contract_id, payload)
+    return JSONResponse(status_code=202, headers={"Location": f"/api/jobs/{job['id']}"}, content={
+        "status": "queued" if created else "already_queued",
+        "job_id": job['id'],
+        "job_status": job['status'],
+        "action": action,
+        "contract_id": contract_id
+    })
+
 @router.post("/match")
 async def match_contract(req: MatchRequest):
     try:
-        contract = db_get_contract(req.contract_id)
+        contract = await db_get_contract(req.contract_id)
         if not contract: raise HTTPException(404, "Contract not found")
+        if not req.wait:
+            return await _enqueue('match', req.contract_id)
         
-        utxos = await get_utxos(contract['deposit_address'])
-        current_balance = sum(u['value'] for u in utxos)
-        
-        if current_balance < contract['amount']:
-            return {"status": "waiting_for_user", "message": "User deposit not detected yet."}
-            
-        if current_balance >= contract['amount'] * 2:
-            return {"status": "already_matched", "message": "Contract is already fully funded."}
-
-        user_x = to_x_only(contract['user_pubkey'])
-        house_x = to_x_only(HOUSE_PRIV_KEY.get_public_key().to_hex())
-        oracle_x = to_x_only(ORACLE_PRIV_KEY.get_public_key().to_hex())
-        
-        pubkeys = sorted([user_x, house_x, oracle_x])
-        nonce_hex = contract['nonce']
-        
-        script_elements = [
-            nonce_hex, 'OP_DROP',
-            pubkeys[0], 'OP_CHECKSIG',
-            pubkeys[1], 'OP_CHECKSIGADD',
-            pubkeys[2], 'OP_CHECKSIGADD',
-            'OP_2', 'OP_NUMEQUAL'
-        ]
-        tapleaf_script = Script(script_elements)
-        
-        leaf_hash = tapleaf_tagged_hash(tapleaf_script)
-        internal_pub = PublicKey(NUMS_PUBKEY_HEX)
-        internal_pub_bytes = internal_pub.to_bytes()
-        tweak = int.from_bytes(leaf_hash, 'big')
-        tweaked_pubkey, _ = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-        
-        multisig_addr = P2trAddress(witness_program=tweaked_pubkey[:32].hex())
-        
-        match_amount = contract['amount'] 
-        
-        tx_hex = await send_funds_from_house(multisig_addr, match_amount)
-        txid = await broadcast_tx(tx_hex)
-        
-        if len(txid) != 64:
-             return {"status": "error", "error": "Broadcast failed", "details": txid}
-
-        await manager.broadcast({
-            "type": "MATCHED",
-            "contract_id": req.contract_id,
-            "txid": txid,
-            "message": f"House matched {match_amount} sats."
-        })
-
-        return {
-            "status": "matched", 
-            "txid": txid, 
-            "message": f"House matched {match_amount} sats (1:1 Odds). Contract is now live!"
-        }
+        return await execute_match(contract, manager)
     except Exception as e:
         print(traceback.format_exc())
         return {"status": "error", "error": str(e), "traceback": traceback.format_exc()}
@@ -158,44 +237,61 @@ async def match_contract(req: MatchRequest):
 @router.post("/refund")
 async def refund_contract(req: RefundRequest):
     try:
-        contract = db_get_contract(req.contract_id)
+        contract = await db_get_contract(req.contract_id)
         if not contract: raise HTTPException(404, "Contract not found")
-        
-        if contract['status'] != 'PENDING':
-             return {"result": "ALREADY_SETTLED", "message": f"Contract is {contract['status']}"}
+        if not req.wait:
+            return await _enqueue('refund', req.contract_id)
 
-        tx_hex, msg = await build_refund_tx(contract)
-        
-        status = "WAITING_USER_SIG_REFUND"
-        db_update_status(req.contract_id, status, tx_hex)
-        
-        return {
-            "status": "waiting_user_sig",
-            "tx_hex": tx_hex,
-            "message": msg + ". Waiting for User signature."
-        }
+        return await execute_refund(contract)
     except Exception as e:
         print(traceback.format_exc())
         return {"status": "error", "error": str(e), "traceback": traceback.format_exc()}
 
 @router.post("/cancel_contract")
-def cancel_contract(req: CancelRequest):
-    db_delete_contract(req.contract_id)
+async def cancel_contract(req: CancelRequest):
+    await db_delete_contract(req.contract_id)
+    deposit_watcher.untrack(req.contract_id)
+    maturity_scheduler.unschedule(req.contract_id)
     return {"status": "cancelled", "contract_id": req.contract_id}
 
 @router.post("/settle")
 async def settle_contract(req: SettleRequest):
-    contract = db_get_contract(req.contract_id)
+    contract = await db_get_contract(req.contract_id)
     if not contract: raise HTTPException(404, "Contract not found")
-    return await execute_settlement(contract, req.current_difficulty, manager)
+    if not req.wait:
+        # 未指定難度時由 worker 於執行當下取用
+        return await _enqueue('settle', req.contract_id, {"current_difficulty": req.current_difficulty})
+    return await execute_settlement(contract, _difficulty(req), manager)
 
 @router.post("/settle_all")
 async def settle_all_contracts(req: SettleAllRequest):
-    contracts = db_get_pending_contracts()
-
-    results = []
-    for contract in contracts:
-        res = await execute_settlement(contract, req.current_difficulty, manager)
-        results.append({"id": contract['id'], "result": res})
-            
-    return {"summary": results, "count": len(results)}
+    if not req.wait and not req.stream:
+        return await _enqueue('settle_all', payload={
+            "current_difficulty": req.current_difficulty,
+            "concurrency": req.concurrency,
+            "timeout": req.timeout,
+            "batch_losses": req.batch_losses
+        })
+
+    difficulty = _difficulty(req)
+    await db_reap_expired_leases()
+    contracts = await db_get_pending_contracts()
+    results = settle_contracts(
+        contracts, difficulty, manager, req.concurrency, req.timeout, req.batch_losses
+    )
+
+    if req.stream:
+        # NDJSON: 每完成一筆輸出一行，最後一行為統計
+        async def ndjson():
+            count = 0
+            async for item in results:
+                count += 1
+                yield json.dumps(item) + "\n"
+            await manager.broadcast({"type": "SETTLE_ALL_DONE", "count": count})
+            yield json.dumps({"type": "summary", "count": count}) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    by_id = {item['id']: item async for item in results}
+    summary = [by_id[c['id']] for c in contracts]
+    await manager.broadcast({"type": "SETTLE_ALL_DONE", "count": len(summary)})
+    return {"summary": summary, "count": len(summary)}
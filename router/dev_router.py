@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+from pydantic import BaseModel
+
+from service.chain_backend import chain
+from service.bitcoin_service import utxo_cache
+
+# 僅在 CHAIN_BACKEND=fake 時註冊，用於離線模擬入金 / 出塊
+router = APIRouter(prefix="/api/dev", tags=["dev"])
+
+class FundRequest(BaseModel):
+    address: str
+    amount: int
+
+@router.post("/fund")
+async def fund_address(req: FundRequest):
+    txid = chain.fund(req.address, req.amount)
+    utxo_cache.invalidate(req.address)
+    return {"status": "funded", "txid": txid, "address": req.address, "amount": req.amount}
+
+@router.post("/mine")
+async def mine_block():
+    chain.mine()
+    return {"status": "mined", "height": chain.height}
@@ -0,0 +1,19 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+
+from service.database import db_get_job, db_list_jobs
+
+router = APIRouter(prefix="/api", tags=["job"])
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    job = await db_get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs")
+async def list_jobs(status: Optional[str] = None, contract_id: Optional[int] = None, limit: Optional[int] = None):
+    """最近的工作 (可依狀態 / 合約篩選)"""
+    jobs = await db_list_jobs(status, contract_id, limit)
+    return {"jobs": jobs, "count": len(jobs)}
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from service.metrics import registry
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 指標 (路由延遲 / 進行中請求 / 外部依賴耗時)"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,46 @@
+import os
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from service.profiler import ProfileSession, authorized, PROFILE_DIR, PROFILE_MAX_SECONDS
+
+# 僅在 PROFILE_ENABLED=1 且設定 PROFILE_ADMIN_TOKEN 時註冊，需帶 X-Profile-Token
+router = APIRouter(prefix="/api/admin/profile", tags=["admin"])
+
+def _check(request: Request):
+    if not authorized(request.headers):
+        raise HTTPException(403, "Invalid profile token")
+
+@router.post("", response_class=PlainTextResponse)
+async def profile_window(request: Request, seconds: float = 10, save: bool = True):
+    """以取樣分析記錄一段時間內事件迴圈與簽名 worker 的堆疊，回傳 collapsed stacks"""
+    _check(request)
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    session = ProfileSession(f"window-{seconds:g}s")
+    with session:
+        await asyncio.sleep(seconds)
+    headers = {"X-Profile-Id": await asyncio.to_thread(session.save)} if save else {}
+    return PlainTextResponse(session.collapsed(), headers=headers)
+
+@router.get("s")
+async def list_profiles(request: Request, limit: Optional[int] = 50):
+    """已儲存的分析結果 (新到舊)"""
+    _check(request)
+    if not os.path.isdir(PROFILE_DIR):
+        return {"profiles": []}
+    names = sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(".collapsed")), reverse=True)
+    return {"profiles": names[:limit]}
+
+@router.get("s/{name}", response_class=PlainTextResponse)
+async def get_profile(request: Request, name: str):
+    _check(request)
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not name.endswith(".collapsed") or not os.path.isfile(path):
+        raise HTTPException(404, "Profile not found")
+    return PlainTextResponse(await asyncio.to_thread(_read, path))
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
@@ -1,13 +1,46 @@
+import json
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from service.websocket_manager import manager
 
 router = APIRouter(tags=["websocket"])
 
+def _topics_from(params):
+    """ 由 contract_id / user_pubkey / topic 參數組出訂閱主題 """
+    topics = [f"contract:{cid}" for cid in params.get('contract_id', [])]
+    topics += [f"user:{pk}" for pk in params.get('user_pubkey', [])]
+    topics += params.get('topic', [])
+    return topics
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    """
+    可選訂閱: /ws?contract_id=1&user_pubkey=02..，或連線後送出
+    {"action": "subscribe" | "unsubscribe", "contract_id": ..., "user_pubkey": ..., "topic": ...}
+    未訂閱時接收所有事件；訂閱後只接收所訂閱的合約 / 用戶事件，global 事件 (無 contract_id / user_pubkey) 一律送達
+    """
+    query = websocket.query_params
+    await manager.connect(websocket, _topics_from({k: query.getlist(k) for k in query.keys()}))
     try:
         while True:
-            await websocket.receive_text()
+            text = await websocket.receive_text()
+            try:
+                msg = json.loads(text)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            topics = _topics_from({k: [str(v) for v in _as_list(msg.get(k))] for k in ('contract_id', 'user_pubkey', 'topic')})
+            if msg.get('action') == 'subscribe':
+                manager.subscribe(websocket, topics)
+            elif msg.get('action') == 'unsubscribe':
+                manager.unsubscribe(websocket, topics)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # 也涵蓋被判定為慢速客戶端而關閉的連線
         manager.disconnect(websocket)
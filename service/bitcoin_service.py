@@ -1,10 +1,13 @@
 import os
-import httpx
+from functools import lru_cache
 from bitcoinutils.keys import PrivateKey, PublicKey, P2trAddress
 from bitcoinutils.transactions import Transaction, TxInput, TxOutput, TxWitnessInput
 from bitcoinutils.script import Script
 from bitcoinutils.utils import tapleaf_tagged_hash, tweak_taproot_pubkey, ControlBlock, get_tag_hashed_merkle_root
 from dotenv import load_dotenv
+from .chain_backend import chain, FakeChainBackend
+from .utxo_cache import UtxoCache
+from .metrics import timed
 
 load_dotenv()
 
@@ -16,13 +19,21 @@ if not HOUSE_SECRET or not ORACLE_SECRET:
     raise ValueError("Please set HOUSE_KEY_SECRET and ORACLE_KEY_SECRET in .env file")
 
 HOUSE_PRIV_KEY = PrivateKey(secret_exponent=HOUSE_SECRET)
-HOUSE_PUB_KEY_HEX = HOUSE_PRIV_KEY.get_public_key().to_hex()
+HOUSE_PUB_KEY = HOUSE_PRIV_KEY.get_public_key()
+HOUSE_PUB_KEY_HEX = HOUSE_PUB_KEY.to_hex()
 
 ORACLE_PRIV_KEY = PrivateKey(secret_exponent=ORACLE_SECRET)
 ORACLE_PUB_KEY_HEX = ORACLE_PRIV_KEY.get_public_key().to_hex()
 
+# 模擬鏈啟動時注入 House 的初始資金 (僅 CHAIN_BACKEND=fake)
+FAKE_HOUSE_BALANCE_SATS = int(os.getenv("FAKE_HOUSE_BALANCE_SATS", "0"))
+
+# 合約花費上下文 LRU 容量
+CONTRACT_CONTEXT_CACHE_SIZE = int(os.getenv("CONTRACT_CONTEXT_CACHE_SIZE", "4096"))
+
 # BIP341 NUMS point
 NUMS_PUBKEY_HEX = "50929b74c1a04954b78b4b6035e97a5e078a5a0f28ec96d547bfee9ace803ac0"
+NUMS_PUB_KEY = PublicKey(NUMS_PUBKEY_HEX)
 
 def to_x_only(pubkey_hex):
     if len(pubkey_hex) == 130 and pubkey_hex.startswith('04'):
@@ -31,6 +42,9 @@ def to_x_only(pubkey_hex):
         return pubkey_hex[2:]
     return pubkey_hex
 
+HOUSE_X_ONLY = to_x_only(HOUSE_PUB_KEY_HEX)
+ORACLE_X_ONLY = to_x_only(ORACLE_PUB_KEY_HEX)
+
 def create_contract_tree(user_pub, house_pub, oracle_pub, nonce_hex):
     """
     建立 MAST 樹狀結構 (Win, Loss, Refund)
@@ -59,39 +73,99 @@ def create_contract_tree(user_pub, house_pub, oracle_pub, nonce_hex):
     tree = [[script_win, script_loss], script_refund]
     return tree, script_win, script_loss, script_refund
 
+class ContractSpendContext:
+    """ 合約的預先計算資料: MAST 樹、葉腳本、tweaked key、scriptPubKey 與三條路徑的控制區塊 """
+
+    LEAF_INDEX = {'win': 0, 'loss': 1, 'refund': 2}
+
+    def __init__(self, user_pubkey_hex, nonce_hex):
+        tree, script_win, script_loss, script_refund = create_contract_tree(
+            user_pubkey_hex, HOUSE_PUB_KEY_HEX, ORACLE_PUB_KEY_HEX, nonce_hex
+        )
+        self.tree = tree
+        self.user_x = to_x_only(user_pubkey_hex)
+        self.scripts = {'win': script_win, 'loss': script_loss, 'refund': script_refund}
+
+        root_hash = get_tag_hashed_merkle_root(tree)
+        tweak = int.from_bytes(root_hash, 'big')
+        tweaked_pubkey, parity = tweak_taproot_pubkey(NUMS_PUB_KEY.to_bytes(), tweak)
+
+        self.tweaked_pubkey_hex = tweaked_pubkey[:32].hex()
+        self.parity = parity
+        self.address = P2trAddress(witness_program=self.tweaked_pubkey_hex)
+        self.script_pubkey = self.address.to_script_pub_key()
+        self._leaves = {}
+        for name, script in self.scripts.items():
+            cb = ControlBlock(NUMS_PUB_KEY, tree, self.LEAF_INDEX[name], is_odd=(parity == 1))
+            self._leaves[name] = (script, script.to_hex(), cb.to_hex())
+
+    def leaf(self, name):
+        """ 回傳 (葉腳本, 葉腳本 hex, 控制區塊 hex)，name 為 win / loss / refund """
+        return self._leaves[name]
+
+@lru_cache(maxsize=CONTRACT_CONTEXT_CACHE_SIZE)
+def get_spend_context(user_pubkey_hex, nonce_hex):
+    return ContractSpendContext(user_pubkey_hex, nonce_hex)
+
 def create_2of3_address(user_pubkey_hex, nonce_hex):
     """ 建立基於 MAST 的 Taproot 地址 """
-    tree, _, _, _ = create_contract_tree(user_pubkey_hex, HOUSE_PUB_KEY_HEX, ORACLE_PUB_KEY_HEX, nonce_hex)
-    
-    internal_pub = PublicKey(NUMS_PUBKEY_HEX)
-    internal_pub_bytes = internal_pub.to_bytes()
-    
-    root_hash = get_tag_hashed_merkle_root(tree)
-    tweak = int.from_bytes(root_hash, 'big')
-    
-    tweaked_pubkey, _ = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    
-    addr = P2trAddress(witness_program=tweaked_pubkey[:32].hex())
-    return addr.to_string(), ""
+    ctx = get_spend_context(user_pubkey_hex, nonce_hex)
+    return ctx.address.to_string(), ""
 
-async def get_utxos(address):
-    base_url = "https://mempool.space/signet/api"
-    async with httpx.AsyncClient() as client:
+def derive_addresses(items):
+    """
+    批次推導合約地址 (於簽名進程池 worker 中執行)
+    items 為 [(user_pubkey_hex, nonce_hex)]，回傳同序的 (address, script_hex) 或 ValueError
+    """
+    results = []
+    for user_pubkey_hex, nonce_hex in items:
         try:
-            resp = await client.get(f"{base_url}/address/{address}/utxo")
-            if resp.status_code != 200: return []
-            return resp.json()
-        except:
-            return []
+            results.append(create_2of3_address(user_pubkey_hex, nonce_hex))
+        except Exception as e:
+            results.append(ValueError(f"Invalid user_pubkey: {e}"))
+    return results
+
+# 快取未命中時的實際鏈上查詢另計為 chain/fetch_utxos
+utxo_cache = UtxoCache(timed("chain", "fetch_utxos")(chain.get_utxos))
+
+# 廣播成功後的回呼 (tx_hex, txid)，例如 House UTXO 帳本
+_broadcast_hooks = []
+
+def add_broadcast_hook(hook):
+    _broadcast_hooks.append(hook)
+
+async def init_chain():
+    """ 建立鏈上 API 連線池 (於 lifespan 啟動時呼叫) """
+    await chain.start()
+    if isinstance(chain, FakeChainBackend) and FAKE_HOUSE_BALANCE_SATS > 0:
+        chain.fund(get_house_address(), FAKE_HOUSE_BALANCE_SATS)
+
+async def close_chain():
+    utxo_cache.clear()
+    await chain.close()
+
+@timed("chain")
+async def get_utxos(address):
+    try:
+        return await utxo_cache.get(address)
+    except Exception as e:
+        print(f"Error getting utxos for {address}: {e}")
+        return []
 
+@timed("chain")
 async def broadcast_tx(tx_hex):
-    url = "https://mempool.space/signet/api/tx"
-    async with httpx.AsyncClient() as client:
+    txid = await chain.broadcast_tx(tx_hex)
+    if len(txid) == 64:
         try:
-            resp = await client.post(url, data=tx_hex)
-            return resp.text 
+            utxo_cache.invalidate_tx(tx_hex)
         except Exception as e:
-            return str(e)
+            print(f"Error invalidating utxo cache: {e}")
+        for hook in _broadcast_hooks:
+            try:
+                hook(tx_hex, txid)
+            except Exception as e:
+                print(f"Error in broadcast hook: {e}")
+    return txid
 
 def get_house_address():
-    return HOUSE_PRIV_KEY.get_public_key().get_segwit_address().to_string()
+    return HOUSE_PUB_KEY.get_segwit_address().to_string()
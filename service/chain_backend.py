@@ -0,0 +1,279 @@
+import os
+import asyncio
+import secrets
+import httpx
+from bitcoinutils import bech32
+from bitcoinutils.keys import P2pkhAddress, P2shAddress
+from bitcoinutils.transactions import Transaction
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 鏈上 API 後端配置
+CHAIN_BACKEND = os.getenv("CHAIN_BACKEND", "mempool").lower()
+MEMPOOL_API_URL = os.getenv("MEMPOOL_API_URL", "https://mempool.space/signet/api")
+
+# 連線池 / 逾時配置
+CHAIN_HTTP2 = os.getenv("CHAIN_HTTP2", "1") == "1"
+CHAIN_MAX_CONNECTIONS = int(os.getenv("CHAIN_MAX_CONNECTIONS", "20"))
+CHAIN_MAX_KEEPALIVE = int(os.getenv("CHAIN_MAX_KEEPALIVE", "10"))
+CHAIN_KEEPALIVE_EXPIRY = float(os.getenv("CHAIN_KEEPALIVE_EXPIRY", "30"))
+CHAIN_TIMEOUT = float(os.getenv("CHAIN_TIMEOUT", "10"))
+CHAIN_CONNECT_TIMEOUT = float(os.getenv("CHAIN_CONNECT_TIMEOUT", "5"))
+
+# 模擬鏈回報的建議費率 (sat/vB)
+FAKE_FEE_RATE = float(os.getenv("FAKE_FEE_RATE", "2"))
+# 模擬鏈回報的網路難度
+FAKE_DIFFICULTY = float(os.getenv("FAKE_DIFFICULTY", "0.047"))
+# 模擬鏈的起始區塊高度 (每次 mine 加 1)
+FAKE_START_HEIGHT = int(os.getenv("FAKE_START_HEIGHT", "100"))
+
+def address_to_script_hex(address):
+    """ 將地址轉為 scriptPubKey hex (支援 bech32/bech32m 與 base58) """
+    sep = address.rfind('1')
+    if sep > 0:
+        hrp = address[:sep].lower()
+        version, program = bech32.decode(hrp, address.lower())
+        if version is not None:
+            op_version = 0 if version == 0 else 0x50 + version
+            return bytes([op_version, len(program)] + list(program)).hex()
+    try:
+        return P2pkhAddress(address).to_script_pub_key().to_hex()
+    except Exception:
+        return P2shAddress(address).to_script_pub_key().to_hex()
+
+class ChainBackendError(Exception):
+    pass
+
+class ChainBackend:
+    """
+    鏈上資料後端介面 (UTXO 查詢 / 廣播)
+    get_utxos 失敗時拋出 ChainBackendError，以免錯誤被當成空地址快取
+    """
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_utxos(self, address):
+        raise NotImplementedError
+
+    async def broadcast_tx(self, tx_hex):
+        raise NotImplementedError
+
+    async def get_fee_rates(self):
+        """ 建議費率 (sat/vB)，格式同 mempool.space /v1/fees/recommended """
+        raise NotImplementedError
+
+    async def get_tip_height(self):
+        """ 目前最新區塊高度 """
+        raise NotImplementedError
+
+    async def get_network_stats(self):
+        """
+        網路狀態: difficulty, hashrate (H/s), reward_sats_144 (最近 144 區塊總獎勵),
+        以及下次難度調整估計 adjustment {progress_percent, difficulty_change, remaining_blocks, estimated_retarget_ms}
+        """
+        raise NotImplementedError
+
+class MempoolBackend(ChainBackend):
+    """ mempool.space REST API，使用長連線的 httpx 連線池 """
+
+    def __init__(self, base_url=MEMPOOL_API_URL):
+        self.base_url = base_url.rstrip('/')
+        self._client = None
+
+    def _build_client(self):
+        http2 = CHAIN_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=CHAIN_MAX_CONNECTIONS,
+                max_keepalive_connections=CHAIN_MAX_KEEPALIVE,
+                keepalive_expiry=CHAIN_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(CHAIN_TIMEOUT, connect=CHAIN_CONNECT_TIMEOUT),
+        )
+
+    @property
+    def client(self):
+        # 未經 lifespan 啟動時 (例如腳本) 延遲建立
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self):
+        self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_utxos(self, address):
+        try:
+            resp = await self.client.get(f"/address/{address}/utxo")
+        except httpx.HTTPError as e:
+            raise ChainBackendError(str(e)) from e
+        if resp.status_code != 200:
+            raise ChainBackendError(f"UTXO lookup failed ({resp.status_code}): {resp.text}")
+        return resp.json()
+
+    async def broadcast_tx(self, tx_hex):
+        try:
+            resp = await self.client.post("/tx", content=tx_hex)
+            return resp.text
+        except Exception as e:
+            return str(e)
+
+    async def get_fee_rates(self):
+        try:
+            resp = await self.client.get("/v1/fees/recommended")
+        except httpx.HTTPError as e:
+            raise ChainBackendError(str(e)) from e
+        if resp.status_code != 200:
+            raise ChainBackendError(f"Fee lookup failed ({resp.status_code}): {resp.text}")
+        return resp.json()
+
+    async def get_tip_height(self):
+        try:
+            resp = await self.client.get("/blocks/tip/height")
+        except httpx.HTTPError as e:
+            raise ChainBackendError(str(e)) from e
+        if resp.status_code != 200:
+            raise ChainBackendError(f"Tip height lookup failed ({resp.status_code}): {resp.text}")
+        return int(resp.text)
+
+    async def _get_json(self, path):
+        try:
+            resp = await self.client.get(path)
+        except httpx.HTTPError as e:
+            raise ChainBackendError(str(e)) from e
+        if resp.status_code != 200:
+            raise ChainBackendError(f"GET {path} failed ({resp.status_code}): {resp.text}")
+        return resp.json()
+
+    async def get_network_stats(self):
+        hashrate, rewards, adjustment = await asyncio.gather(
+            self._get_json("/v1/mining/hashrate/3d"),
+            self._get_json("/v1/mining/reward-stats/144"),
+            self._get_json("/v1/difficulty-adjustment"),
+        )
+        return {
+            "difficulty": float(hashrate["currentDifficulty"]),
+            "hashrate": float(hashrate["currentHashrate"]),
+            "reward_sats_144": int(rewards["totalReward"]),
+            "adjustment": {
+                "progress_percent": adjustment.get("progressPercent"),
+                "difficulty_change": adjustment.get("difficultyChange"),
+                "remaining_blocks": adjustment.get("remainingBlocks"),
+                "estimated_retarget_ms": adjustment.get("estimatedRetargetDate"),
+            },
+        }
+
+class FakeChainBackend(ChainBackend):
+    """
+    進程內的模擬鏈 (regtest 風格)，供離線壓測使用
+    - UTXO 以 scriptPubKey 為索引
+    - 廣播時移除已花費輸入並加入新輸出 (不驗證簽名)
+    """
+
+    def __init__(self):
+        self.utxos = {}
+        self.transactions = {}
+        self.height = FAKE_START_HEIGHT
+
+    def fund(self, address, value, confirmed=True):
+        """ 直接對地址注入一筆 UTXO，回傳虛構 txid """
+        txid = secrets.token_hex(32)
+        script_hex = address_to_script_hex(address)
+        self.utxos.setdefault(script_hex, {})[(txid, 0)] = {
+            "txid": txid,
+            "vout": 0,
+            "value": value,
+            "status": {"confirmed": confirmed},
+        }
+        return txid
+
+    def mine(self):
+        """ 出一個區塊: 高度加 1，所有未確認 UTXO 標記為已確認 """
+        self.height += 1
+        for entries in self.utxos.values():
+            for utxo in entries.values():
+                utxo["status"]["confirmed"] = True
+
+    async def get_utxos(self, address):
+        try:
+            script_hex = address_to_script_hex(address)
+        except Exception as e:
+            raise ChainBackendError(f"Invalid address: {address}") from e
+        return [dict(u, status=dict(u["status"])) for u in self.utxos.get(script_hex, {}).values()]
+
+    async def broadcast_tx(self, tx_hex):
+        try:
+            tx = Transaction.from_raw(tx_hex)
+        except Exception as e:
+            return f"TX decode failed: {e}"
+
+        spent = []
+        for txin in tx.inputs:
+            outpoint = (txin.txid, txin.txout_index)
+            owner = next((s for s, entries in self.utxos.items() if outpoint in entries), None)
+            if owner is None:
+                return 'sendrawtransaction RPC error: {"code":-25,"message":"bad-txns-inputs-missingorspent"}'
+            spent.append((owner, outpoint))
+
+        for owner, outpoint in spent:
+            del self.utxos[owner][outpoint]
+
+        txid = tx.get_txid()
+        for vout, txout in enumerate(tx.outputs):
+            self.utxos.setdefault(txout.script_pubkey.to_hex(), {})[(txid, vout)] = {
+                "txid": txid,
+                "vout": vout,
+                "value": txout.amount,
+                "status": {"confirmed": False},
+            }
+        self.transactions[txid] = tx_hex
+        return txid
+
+    async def get_fee_rates(self):
+        rate = FAKE_FEE_RATE
+        return {
+            "fastestFee": rate, "halfHourFee": rate, "hourFee": rate,
+            "economyFee": rate, "minimumFee": 1,
+        }
+
+    async def get_tip_height(self):
+        return self.height
+
+    async def get_network_stats(self):
+        # 假設出塊時間 600 秒: hashrate = difficulty * 2^32 / 600
+        return {
+            "difficulty": FAKE_DIFFICULTY,
+            "hashrate": FAKE_DIFFICULTY * 2**32 / 600,
+            "reward_sats_144": 144 * 5_000_000_000,
+            "adjustment": {
+                "progress_percent": 0.0,
+                "difficulty_change": 0.0,
+                "remaining_blocks": 2016,
+                "estimated_retarget_ms": None,
+            },
+        }
+
+def create_backend(name=CHAIN_BACKEND):
+    if name == "fake":
+        return FakeChainBackend()
+    if name == "mempool":
+        return MempoolBackend()
+    raise ValueError(f"Unknown CHAIN_BACKEND: {name}")
+
+chain = create_backend()
@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 合約快取: 單筆合約容量與存活時間 (秒)、列表查詢結果容量與存活時間 (秒)
+# 本進程的寫入會立即反映；多個 worker 時，其他 worker 寫入的可見延遲以存活時間為上限
+CONTRACT_CACHE_SIZE = int(os.getenv("CONTRACT_CACHE_SIZE", "10000"))
+CONTRACT_CACHE_TTL = float(os.getenv("CONTRACT_CACHE_TTL", "30"))
+CONTRACT_LIST_CACHE_SIZE = int(os.getenv("CONTRACT_LIST_CACHE_SIZE", "1000"))
+CONTRACT_LIST_CACHE_TTL = float(os.getenv("CONTRACT_LIST_CACHE_TTL", "5"))
+
+class ContractCache:
+    """
+    資料庫前的合約 read-through LRU 快取
+    - 單筆合約以 id 為鍵；建立 / 狀態更新直接寫入快取 (write-through)，刪除時移除
+    - 列表查詢結果以查詢參數為鍵；任何寫入都會清空列表快取
+    - 同一鍵的並發查詢合併為一次資料庫請求；查詢期間發生寫入時不寫回過期結果
+    - 回傳的皆為副本，呼叫端修改不影響快取
+    """
+
+    def __init__(self, size=CONTRACT_CACHE_SIZE, ttl=CONTRACT_CACHE_TTL,
+                 list_size=CONTRACT_LIST_CACHE_SIZE, list_ttl=CONTRACT_LIST_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.list_size = list_size
+        self.list_ttl = list_ttl
+        self._rows = OrderedDict()      # id -> (expires_at, row)
+        self._lists = OrderedDict()     # key -> (expires_at, rows, next_cursor)
+        self._inflight = {}             # key -> Future
+        self._generation = {}           # id -> 查詢期間的寫入次數，防止寫回過期結果
+        self._version = 0               # 任何寫入遞增，用於列表快取
+
+    async def _single_flight(self, key, loader):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def get(self, contract_id, fetch):
+        entry = self._rows.get(contract_id)
+        if entry and entry[0] > time.monotonic():
+            self._rows.move_to_end(contract_id)
+            return dict(entry[1])
+
+        async def load():
+            self._generation[contract_id] = 0
+            try:
+                row = await fetch(contract_id)
+            finally:
+                stale = self._generation.pop(contract_id, 0) != 0
+            if row is not None and not stale:
+                self._store(contract_id, row)
+            return row
+
+        row = await self._single_flight(('contract', contract_id), load)
+        return dict(row) if row is not None else None
+
+    async def get_list(self, key, fetch):
+        """ fetch() 回傳 (rows, next_cursor) """
+        entry = self._lists.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._lists.move_to_end(key)
+            return [dict(r) for r in entry[1]], entry[2]
+
+        async def load():
+            version = self._version
+            rows, next_cursor = await fetch()
+            if self.list_ttl > 0 and self._version == version:
+                self._lists[key] = (time.monotonic() + self.list_ttl, rows, next_cursor)
+                while len(self._lists) > self.list_size:
+                    self._lists.popitem(last=False)
+            return rows, next_cursor
+
+        rows, next_cursor = await self._single_flight(('list', key), load)
+        return [dict(r) for r in rows], next_cursor
+
+    def _store(self, contract_id, row):
+        if self.ttl <= 0:
+            return
+        self._rows[contract_id] = (time.monotonic() + self.ttl, dict(row))
+        self._rows.move_to_end(contract_id)
+        while len(self._rows) > self.size:
+            self._rows.popitem(last=False)
+
+    def _written(self, contract_id):
+        if contract_id in self._generation:
+            self._generation[contract_id] += 1
+        self._version += 1
+        self._lists.clear()
+
+    def put(self, row):
+        """ 新建立的合約 (資料庫回傳的完整資料列) """
+        self._written(row['id'])
+        self._store(row['id'], row)
+
+    def update(self, contract_id, update_data):
+        self._written(contract_id)
+        entry = self._rows.get(contract_id)
+        if entry:
+            self._store(contract_id, {**entry[1], **update_data})
+
+    def invalidate(self, contract_id):
+        self._written(contract_id)
+        self._rows.pop(contract_id, None)
+
+    def clear(self):
+        self._version += 1
+        self._rows.clear()
+        self._lists.clear()
+        for contract_id in self._generation:
+            self._generation[contract_id] += 1
+
+contract_cache = ContractCache()
@@ -1,22 +1,412 @@
 import os
+import json
+import base64
+import asyncio
+import sqlite3
+import time
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from .metrics import timed
+from .contract_cache import contract_cache
+from .exposure_book import exposure_book
 
 load_dotenv()
 
+# 資料庫後端 (supabase | sqlite)，sqlite 供離線測試 (SQLITE_PATH 預設為記憶體資料庫)
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", ":memory:")
+
+# Supabase 同步呼叫使用的專用執行緒池大小
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
 # Supabase 配置
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Please set SUPABASE_URL and SUPABASE_KEY in environment variables")
+WAITING_SIGNATURE_STATUSES = ['WAITING_USER_SIG', 'WAITING_USER_SIG_REFUND']
+
+# 合約狀態機: 各狀態允許的條件式轉移
+# SETTLING 為結算租約 (settle_owner / settle_lease_until)，結束時轉為結果狀態或還原為 settle_prev_status
+CONTRACT_TRANSITIONS = {
+    'PENDING': {'SETTLING', 'WAITING_USER_SIG_REFUND'},
+    'WAITING_USER_SIG': {'SETTLING'},
+    'SETTLING': {'PENDING', 'WAITING_USER_SIG', 'SETTLED_LOSS'},
+}
+
+# 結算租約時間 (秒)，到期未完成的合約由 db_reap_expired_leases 還原
+SETTLEMENT_LEASE_SECONDS = float(os.getenv("SETTLEMENT_LEASE_SECONDS", "300"))
+# 配對認領時間 (秒): 認領後逾期仍未記錄 match_txid 的合約 (進程中斷) 可由其他 worker 重新認領
+MATCH_CLAIM_SECONDS = float(os.getenv("MATCH_CLAIM_SECONDS", "300"))
+
+# 工作佇列: 同一 idempotency key 同時只允許一筆 queued / running 的工作
+JOB_ACTIVE_STATUSES = ['queued', 'running']
+# 每次取得工作時檢查的候選數 (多個 worker 競爭時避免全部搶同一筆)
+JOB_CLAIM_CANDIDATES = 8
+
+# 列表 API 分頁: 預設 / 最大每頁筆數
+CONTRACT_PAGE_SIZE = int(os.getenv("CONTRACT_PAGE_SIZE", "50"))
+CONTRACT_PAGE_SIZE_MAX = int(os.getenv("CONTRACT_PAGE_SIZE_MAX", "500"))
+
+# 曝險帳本載入時每頁筆數 (不超過 PostgREST 的 max-rows 上限)
+EXPOSURE_PAGE_SIZE = int(os.getenv("EXPOSURE_PAGE_SIZE", "1000"))
+
+# 批次建立合約: 單次請求的最大筆數
+CONTRACT_BULK_MAX = int(os.getenv("CONTRACT_BULK_MAX", "100"))
+
+CONTRACT_COLUMNS = [
+    'id', 'user_pubkey', 'deposit_address', 'redeem_script_hex', 'amount',
+    'direction', 'status', 'tx_hex', 'nonce', 'created_at', 'maturity', 'matched_at',
+    'match_txid', 'settle_owner', 'settle_lease_until', 'settle_prev_status'
+]
+# 列表預設只回傳摘要欄位 (不含 tx_hex / redeem_script_hex)
+CONTRACT_SUMMARY_COLUMNS = [
+    'id', 'user_pubkey', 'deposit_address', 'amount', 'direction', 'status', 'nonce', 'created_at', 'maturity',
+    'matched_at'
+]
+
+def parse_fields(fields):
+    """ 解析 fields= 參數: 空值為摘要欄位，* / all 為全部欄位；id 與 created_at 必定包含 (分頁游標) """
+    if not fields:
+        return list(CONTRACT_SUMMARY_COLUMNS)
+    if fields in ('*', 'all'):
+        return list(CONTRACT_COLUMNS)
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in CONTRACT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [c for c in CONTRACT_COLUMNS if c in requested or c in ('id', 'created_at')]
+
+def encode_cursor(row):
+    raw = json.dumps([row['created_at'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+class SupabaseRepository:
+    """ Supabase (PostgREST) 實作，所有方法皆為同步呼叫 """
+
+    def __init__(self, url, key):
+        if not url or not key:
+            raise ValueError("Please set SUPABASE_URL and SUPABASE_KEY in environment variables")
+        self.client: Client = create_client(url, key)
+
+    def create_contract(self, row):
+        result = self.client.table('contracts').insert(row).execute()
+        return result.data[0] if result.data else None
+
+    def create_contracts(self, rows):
+        # 單次 PostgREST 批次插入，回傳的資料與 rows 同序
+        result = self.client.table('contracts').insert(rows).execute()
+        return result.data or []
+
+    def get_contract(self, order_id):
+        result = self.client.table('contracts').select('*').eq('id', order_id).execute()
+        return result.data[0] if result.data else None
+
+    def update_status(self, order_id, update_data):
+        self.client.table('contracts').update(update_data).eq('id', order_id).execute()
+
+    def compare_and_set(self, order_id, expected, update_data, table='contracts'):
+        # PostgREST 的 PATCH 帶條件過濾為單一 UPDATE ... WHERE，回傳實際更新的資料列
+        query = self.client.table(table).update(update_data).eq('id', order_id)
+        for column, value in expected.items():
+            if isinstance(value, list):
+                query = query.in_(column, value)
+            elif value is None:
+                query = query.is_(column, 'null')
+            else:
+                query = query.eq(column, value)
+        result = query.execute()
+        return result.data[0] if result.data else None
+
+    def get_maturing_contracts(self):
+        result = self.client.table('contracts').select('*').eq('status', 'PENDING').not_.is_('maturity', 'null').execute()
+        return result.data or []
+
+    def get_exposure_rows(self, statuses, after_id, limit):
+        result = (self.client.table('contracts').select('id,status,direction,amount,matched_at')
+                  .in_('status', list(statuses)).gt('id', after_id).order('id').limit(limit).execute())
+        return result.data or []
+
+    def get_exposure_totals(self, exclude_statuses):
+        result = self.client.rpc('contract_exposure_totals', {'exclude_statuses': list(exclude_statuses)}).execute()
+        return result.data or []
+
+    def get_expired_leases(self, now):
+        result = self.client.table('contracts').select('*').eq('status', 'SETTLING').lt('settle_lease_until', now).execute()
+        return result.data or []
+
+    def create_job(self, row):
+        try:
+            result = self.client.table('jobs').insert(row).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            # 23505: 同一 idempotency key 已有進行中的工作 (partial unique index)
+            if getattr(e, 'code', None) == '23505':
+                return None
+            raise
+
+    def get_active_job(self, key):
+        result = self.client.table('jobs').select('*').eq('idempotency_key', key).in_('status', JOB_ACTIVE_STATUSES).execute()
+        return result.data[0] if result.data else None
+
+    def get_job(self, job_id):
+        result = self.client.table('jobs').select('*').eq('id', job_id).execute()
+        return result.data[0] if result.data else None
+
+    def get_claimable_jobs(self, now, limit):
+        result = self.client.table('jobs').select('*').or_(
+            f'and(status.eq.queued,run_after.lte.{now}),and(status.eq.running,locked_until.lt.{now})'
+        ).order('run_after').order('id').limit(limit).execute()
+        return result.data or []
+
+    def list_jobs(self, filters, limit):
+        query = self.client.table('jobs').select('*')
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        result = query.order('id', desc=True).limit(limit).execute()
+        return result.data or []
+
+    def delete_contract(self, order_id):
+        result = self.client.table('contracts').delete().eq('id', order_id).execute()
+        return result.data[0] if result.data else None
+
+    def get_contracts_by_status(self, status):
+        result = self.client.table('contracts').select('*').eq('status', status).order('created_at', desc=True).execute()
+        return result.data or []
+
+    def list_contracts(self, filters, columns, limit, cursor=None):
+        query = self.client.table('contracts').select(','.join(columns))
+        for column, value in filters.items():
+            query = query.in_(column, value) if isinstance(value, list) else query.eq(column, value)
+        if cursor:
+            created_at, row_id = cursor
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})')
+        result = query.order('created_at', desc=True).order('id', desc=True).limit(limit).execute()
+        return result.data or []
+
+class SQLiteRepository:
+    """ SQLite 實作 (與 Supabase 相同的資料表結構)，供離線測試與壓測 """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS contracts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_pubkey TEXT NOT NULL,
+        deposit_address TEXT NOT NULL,
+        redeem_script_hex TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        direction TEXT NOT NULL,
+        status TEXT DEFAULT 'PENDING',
+        tx_hex TEXT,
+        nonce TEXT,
+        created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+        maturity INTEGER,
+        matched_at REAL,
+        match_txid TEXT,
+        settle_owner TEXT,
+        settle_lease_until REAL,
+        settle_prev_status TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_contracts_status ON contracts(status);
+    CREATE INDEX IF NOT EXISTS idx_contracts_user_created ON contracts(user_pubkey, created_at DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_contracts_status_created ON contracts(status, created_at DESC, id DESC);
+
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        action TEXT NOT NULL,
+        contract_id INTEGER,
+        idempotency_key TEXT NOT NULL,
+        payload TEXT,
+        status TEXT DEFAULT 'queued',
+        attempts INTEGER DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_after REAL NOT NULL,
+        locked_by TEXT,
+        locked_until REAL,
+        result TEXT,
+        error TEXT,
+        created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+        updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key ON jobs(idempotency_key) WHERE status IN ('queued', 'running');
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after);
+    CREATE INDEX IF NOT EXISTS idx_jobs_contract ON jobs(contract_id, id DESC);
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+        self.lock = threading.Lock()
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    def _migrate(self):
+        # 既有資料庫檔補上後續新增的欄位
+        existing = {r['name'] for r in self.conn.execute("PRAGMA table_info(contracts)")}
+        for column, kind in (('settle_owner', 'TEXT'), ('settle_lease_until', 'REAL'), ('settle_prev_status', 'TEXT'),
+                             ('maturity', 'INTEGER'), ('matched_at', 'REAL'),
+                             ('match_txid', 'TEXT')):
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE contracts ADD COLUMN {column} {kind}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_contracts_maturity ON contracts(status, maturity)")
+        self.conn.commit()
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
+
+    def _execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params)
+
+    def _insert(self, row):
+        columns = ', '.join(row)
+        placeholders = ', '.join('?' for _ in row)
+        sql = f"INSERT INTO contracts ({columns}) VALUES ({placeholders}) RETURNING *"
+        return dict(self.conn.execute(sql, tuple(row.values())).fetchone())
+
+    def create_contract(self, row):
+        with self.lock, self.conn:
+            return self._insert(row)
+
+    def create_contracts(self, rows):
+        # 同一交易內逐筆插入以保持順序
+        with self.lock, self.conn:
+            return [self._insert(row) for row in rows]
+
+    def get_contract(self, order_id):
+        rows = self._query("SELECT * FROM contracts WHERE id = ?", (order_id,))
+        return rows[0] if rows else None
+
+    def update_status(self, order_id, update_data):
+        assignments = ', '.join(f"{k} = ?" for k in update_data)
+        self._execute(f"UPDATE contracts SET {assignments} WHERE id = ?", (*update_data.values(), order_id))
+
+    def compare_and_set(self, order_id, expected, update_data, table='contracts'):
+        assignments = ', '.join(f"{k} = ?" for k in update_data)
+        clauses, params = ["id = ?"], [order_id]
+        for column, value in expected.items():
+            if isinstance(value, list):
+                clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+                params.extend(value)
+            elif value is None:
+                clauses.append(f"{column} IS NULL")
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = f"UPDATE {table} SET {assignments} WHERE {' AND '.join(clauses)} RETURNING *"
+        with self.lock, self.conn:
+            row = self.conn.execute(sql, (*update_data.values(), *params)).fetchone()
+            return dict(row) if row else None
+
+    def get_maturing_contracts(self):
+        return self._query("SELECT * FROM contracts WHERE status = 'PENDING' AND maturity IS NOT NULL")
+
+    def get_exposure_rows(self, statuses, after_id, limit):
+        return self._query(
+            f"SELECT id, status, direction, amount, matched_at FROM contracts "
+            f"WHERE status IN ({', '.join('?' for _ in statuses)}) AND id > ? ORDER BY id LIMIT ?",
+            (*statuses, after_id, limit)
+        )
+
+    def get_exposure_totals(self, exclude_statuses):
+        return self._query(
+            f"SELECT status, direction, matched_at IS NOT NULL AS matched, COUNT(*) AS count, SUM(amount) AS sats "
+            f"FROM contracts WHERE status NOT IN ({', '.join('?' for _ in exclude_statuses)}) "
+            f"GROUP BY status, direction, matched_at IS NOT NULL",
+            tuple(exclude_statuses)
+        )
+
+    def get_expired_leases(self, now):
+        return self._query("SELECT * FROM contracts WHERE status = 'SETTLING' AND settle_lease_until < ?", (now,))
+
+    def create_job(self, row):
+        columns = ', '.join(row)
+        placeholders = ', '.join('?' for _ in row)
+        try:
+            with self.lock, self.conn:
+                cursor = self.conn.execute(f"INSERT INTO jobs ({columns}) VALUES ({placeholders}) RETURNING *", tuple(row.values()))
+                return dict(cursor.fetchone())
+        except sqlite3.IntegrityError:
+            return None
+
+    def get_active_job(self, key):
+        rows = self._query(
+            f"SELECT * FROM jobs WHERE idempotency_key = ? AND status IN ({', '.join('?' for _ in JOB_ACTIVE_STATUSES)})",
+            (key, *JOB_ACTIVE_STATUSES)
+        )
+        return rows[0] if rows else None
+
+    def get_job(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def get_claimable_jobs(self, now, limit):
+        return self._query(
+            "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND locked_until < ?) "
+            "ORDER BY run_after, id LIMIT ?", (now, now, limit)
+        )
+
+    def list_jobs(self, filters, limit):
+        where = ' AND '.join(f"{column} = ?" for column in filters)
+        return self._query(
+            f"SELECT * FROM jobs {'WHERE ' + where if where else ''} ORDER BY id DESC LIMIT ?", (*filters.values(), limit)
+        )
+
+    def delete_contract(self, order_id):
+        with self.lock, self.conn:
+            row = self.conn.execute("DELETE FROM contracts WHERE id = ? RETURNING *", (order_id,)).fetchone()
+            return dict(row) if row else None
+
+    def get_contracts_by_status(self, status):
+        return self._query("SELECT * FROM contracts WHERE status = ? ORDER BY created_at DESC, id DESC", (status,))
+
+    def list_contracts(self, filters, columns, limit, cursor=None):
+        clauses, params = [], []
+        for column, value in filters.items():
+            if isinstance(value, list):
+                clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+                params.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if cursor:
+            created_at, row_id = cursor
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, row_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(
+            f"SELECT {', '.join(columns)} FROM contracts {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            (*params, limit)
+        )
+
+def create_repository(name=DB_BACKEND):
+    if name == "sqlite":
+        return SQLiteRepository()
+    if name == "supabase":
+        return SupabaseRepository(SUPABASE_URL, SUPABASE_KEY)
+    raise ValueError(f"Unknown DB_BACKEND: {name}")
+
+repository = create_repository()
+
+# 同步的資料庫呼叫一律在專用執行緒池執行，避免阻塞事件迴圈
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
 
 def init_db():
     """
     初始化資料庫表格 (在 Supabase SQL Editor 中執行)
-    
+
     CREATE TABLE IF NOT EXISTS contracts (
         id BIGSERIAL PRIMARY KEY,
         user_pubkey TEXT NOT NULL,
@@ -27,94 +417,517 @@ def init_db():
         status TEXT DEFAULT 'PENDING',
         tx_hex TEXT,
         nonce TEXT,
-        created_at TIMESTAMPTZ DEFAULT NOW()
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        maturity BIGINT,
+        matched_at DOUBLE PRECISION,
+        match_txid TEXT,
+        settle_owner TEXT,
+        settle_lease_until DOUBLE PRECISION,
+        settle_prev_status TEXT
+    );
+
+    -- 既有資料表補上結算租約欄位
+    ALTER TABLE contracts ADD COLUMN IF NOT EXISTS settle_owner TEXT;
+    ALTER TABLE contracts ADD COLUMN IF NOT EXISTS settle_lease_until DOUBLE PRECISION;
+    ALTER TABLE contracts ADD COLUMN IF NOT EXISTS settle_prev_status TEXT;
+
+    -- 到期 (區塊高度或 Unix 時間)，自動結算排程啟動時載入
+    ALTER TABLE contracts ADD COLUMN IF NOT EXISTS maturity BIGINT;
+    CREATE INDEX IF NOT EXISTS idx_contracts_maturity ON contracts(status, maturity);
+
+    -- House 配對: 認領 / 完成的時間 (曝險帳本啟動時載入) 與注資交易
+    ALTER TABLE contracts ADD COLUMN IF NOT EXISTS matched_at DOUBLE PRECISION;
+    ALTER TABLE contracts ADD COLUMN IF NOT EXISTS match_txid TEXT;
+
+    -- 結算 / 廣播工作佇列
+    CREATE TABLE IF NOT EXISTS jobs (
+        id BIGSERIAL PRIMARY KEY,
+        action TEXT NOT NULL,
+        contract_id BIGINT,
+        idempotency_key TEXT NOT NULL,
+        payload TEXT,
+        status TEXT DEFAULT 'queued',
+        attempts INT DEFAULT 0,
+        max_attempts INT NOT NULL,
+        run_after DOUBLE PRECISION NOT NULL,
+        locked_by TEXT,
+        locked_until DOUBLE PRECISION,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        updated_at TIMESTAMPTZ DEFAULT NOW()
     );
-    
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key ON jobs(idempotency_key) WHERE status IN ('queued', 'running');
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after);
+    CREATE INDEX IF NOT EXISTS idx_jobs_contract ON jobs(contract_id, id DESC);
+
     CREATE INDEX IF NOT EXISTS idx_contracts_status ON contracts(status);
+
+    -- 列表 API 的 keyset 分頁 (ORDER BY created_at DESC, id DESC)
+    CREATE INDEX IF NOT EXISTS idx_contracts_user_created ON contracts(user_pubkey, created_at DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_contracts_status_created ON contracts(status, created_at DESC, id DESC);
+
+    -- 曝險帳本: 已結束合約的彙總 (伺服器端 GROUP BY，不需逐筆讀取)
+    CREATE OR REPLACE FUNCTION contract_exposure_totals(exclude_statuses TEXT[])
+    RETURNS TABLE (status TEXT, direction TEXT, matched BOOLEAN, count BIGINT, sats BIGINT)
+    LANGUAGE sql STABLE AS $$
+        SELECT status, direction, matched_at IS NOT NULL, COUNT(*), SUM(amount)::BIGINT
+        FROM contracts WHERE status <> ALL(exclude_statuses)
+        GROUP BY status, direction, matched_at IS NOT NULL;
+    $$;
     """
-    # Supabase 自動管理表格，此函數僅作為文檔說明
-    print("Database initialized (using Supabase)")
+    # Supabase 自動管理表格，此函數僅作為文檔說明；SQLite 於建立時自動建表
+    print(f"Database initialized (using {DB_BACKEND})")
 
-def db_create_contract(user_pub, address, script_hex, amount, direction, nonce):
+@timed("database")
+async def db_create_contract(user_pub, address, script_hex, amount, direction, nonce, maturity=None):
     try:
-        result = supabase.table('contracts').insert({
+        row = await _run(repository.create_contract, {
             'user_pubkey': user_pub,
             'deposit_address': address,
             'redeem_script_hex': script_hex,
             'amount': amount,
             'direction': direction,
             'nonce': nonce,
+            'maturity': maturity,
             'status': 'PENDING'
-        }).execute()
-        
-        if result.data and len(result.data) > 0:
-            return result.data[0]['id']
+        })
+
+        if row is not None:
+            contract_cache.put(row)
+            exposure_book.put(row)
+            return row['id']
         else:
             raise ValueError("Failed to create contract")
     except Exception as e:
         print(f"Error creating contract: {e}")
         raise
 
-def db_get_contract(order_id):
+@timed("database")
+async def db_create_contracts(contracts):
+    """
+    批次建立合約 (單次插入)，contracts 為
+    [(user_pub, address, script_hex, amount, direction, nonce, maturity)]，回傳同序的合約 id
+    """
     try:
-        result = supabase.table('contracts').select('*').eq('id', order_id).execute()
-        
-        if result.data and len(result.data) > 0:
-            return result.data[0]
-        return None
+        rows = [{
+            'user_pubkey': user_pub,
+            'deposit_address': address,
+            'redeem_script_hex': script_hex,
+            'amount': amount,
+            'direction': direction,
+            'nonce': nonce,
+            'maturity': maturity,
+            'status': 'PENDING'
+        } for user_pub, address, script_hex, amount, direction, nonce, maturity in contracts]
+
+        created = await _run(repository.create_contracts, rows) if rows else []
+        if len(created) != len(rows):
+            raise ValueError("Failed to create contracts")
+        for row in created:
+            contract_cache.put(row)
+            exposure_book.put(row)
+        return [row['id'] for row in created]
+    except Exception as e:
+        print(f"Error creating contracts: {e}")
+        raise
+
+# 只計入快取未命中時的實際查詢 (database/fetch_contract)，命中快取不記錄資料庫耗時
+@timed("database", "fetch_contract")
+async def _load_contract(order_id):
+    return await _run(repository.get_contract, order_id)
+
+async def db_get_contract(order_id):
+    try:
+        return await contract_cache.get(order_id, _load_contract)
     except Exception as e:
         print(f"Error getting contract: {e}")
         return None
 
-def db_update_status(order_id, status, tx_hex=None):
+@timed("database")
+async def db_update_status(order_id, status, tx_hex=None):
     try:
         update_data = {'status': status}
         if tx_hex:
             update_data['tx_hex'] = tx_hex
-        
-        supabase.table('contracts').update(update_data).eq('id', order_id).execute()
+
+        await _run(repository.update_status, order_id, update_data)
+        contract_cache.update(order_id, update_data)
+        exposure_book.update(order_id, update_data)
     except Exception as e:
         print(f"Error updating status: {e}")
         raise
 
-def db_delete_contract(order_id):
+@timed("database")
+async def db_mark_matched(order_id, txid=None):
+    """ 記錄 House 已完成配對 (注資交易 txid，已足額但無紀錄時只記錄時間) """
+    try:
+        update_data = {'match_txid': txid} if txid else {'matched_at': time.time()}
+        await _run(repository.update_status, order_id, update_data)
+        contract_cache.update(order_id, update_data)
+        exposure_book.update(order_id, update_data)
+    except Exception as e:
+        print(f"Error marking contract matched: {e}")
+        raise
+
+@timed("database")
+async def db_claim_match(order_id):
+    """
+    注資前認領配對 (條件式設定 matched_at)，多個 worker / 進程同時配對同一合約時只有一方成功；
+    成功回傳合約，已被認領、已配對或非 PENDING 時回傳 None
+    """
+    try:
+        latest = await _run(repository.get_contract, order_id)
+        if not latest or latest['status'] != 'PENDING' or latest.get('match_txid'):
+            return None
+        now = time.time()
+        if latest.get('matched_at') is not None and latest['matched_at'] > now - MATCH_CLAIM_SECONDS:
+            return None
+        return await _compare_and_set(
+            order_id,
+            {'status': 'PENDING', 'matched_at': latest.get('matched_at'), 'match_txid': None},
+            {'matched_at': now}
+        )
+    except Exception as e:
+        print(f"Error claiming match: {e}")
+        raise
+
+@timed("database")
+async def db_release_match(order_id, claimed_at):
+    """ 注資失敗時釋放認領 """
+    try:
+        return await _compare_and_set(order_id, {'matched_at': claimed_at, 'match_txid': None}, {'matched_at': None})
+    except Exception as e:
+        print(f"Error releasing match: {e}")
+        raise
+
+async def _compare_and_set(order_id, expected, update_data):
+    row = await _run(repository.compare_and_set, order_id, expected, update_data)
+    if row is not None:
+        contract_cache.put(row)
+        exposure_book.put(row)
+    else:
+        # 條件不成立代表本地所見已過期，只重新讀取該筆合約校正曝險帳本
+        contract_cache.invalidate(order_id)
+        latest = await _run(repository.get_contract, order_id)
+        if latest is None:
+            exposure_book.remove(order_id)
+        else:
+            exposure_book.put(latest)
+    return row
+
+@timed("database")
+async def db_transition(order_id, expected_status, status, tx_hex=None, owner=None):
+    """
+    條件式狀態轉移 (UPDATE ... WHERE status = expected_status)，回傳更新後的合約；
+    狀態已被他人改變 (或 SETTLING 租約不屬於 owner) 時回傳 None
+    """
+    if status not in CONTRACT_TRANSITIONS.get(expected_status, ()):
+        raise ValueError(f"Invalid transition {expected_status} -> {status}")
+    expected = {'status': expected_status}
+    update_data = {'status': status}
+    if tx_hex:
+        update_data['tx_hex'] = tx_hex
+    if expected_status == 'SETTLING':
+        expected['settle_owner'] = owner
+        update_data.update(settle_owner=None, settle_lease_until=None, settle_prev_status=None)
+    try:
+        return await _compare_and_set(order_id, expected, update_data)
+    except Exception as e:
+        print(f"Error updating status: {e}")
+        raise
+
+@timed("database")
+async def db_claim_settlement(order_id, expected_status, owner, lease_seconds=None):
+    """ 取得結算租約: expected_status -> SETTLING，成功回傳合約 (含 settle_prev_status)，否則 None """
+    if 'SETTLING' not in CONTRACT_TRANSITIONS.get(expected_status, ()):
+        return None
+    try:
+        return await _compare_and_set(order_id, {'status': expected_status}, {
+            'status': 'SETTLING',
+            'settle_owner': owner,
+            'settle_lease_until': time.time() + (lease_seconds or SETTLEMENT_LEASE_SECONDS),
+            'settle_prev_status': expected_status,
+        })
+    except Exception as e:
+        print(f"Error claiming contract: {e}")
+        raise
+
+@timed("database")
+async def db_get_maturing_contracts():
+    """ 設有到期的 PENDING 合約 (排程啟動時載入一次) """
+    try:
+        return await _run(repository.get_maturing_contracts)
+    except Exception as e:
+        print(f"Error getting maturing contracts: {e}")
+        return []
+
+@timed("database")
+async def db_get_exposure_rows(statuses):
+    """ 指定狀態合約的曝險欄位 (依 id 分頁讀取)；失敗時拋出，避免以不完整的資料更新帳本 """
+    rows, after_id = [], 0
+    try:
+        while True:
+            page = await _run(repository.get_exposure_rows, statuses, after_id, EXPOSURE_PAGE_SIZE)
+            rows.extend(page)
+            if len(page) < EXPOSURE_PAGE_SIZE:
+                return rows
+            after_id = page[-1]['id']
+    except Exception as e:
+        print(f"Error getting exposure rows: {e}")
+        raise
+
+@timed("database")
+async def db_get_exposure_totals(exclude_statuses):
+    """ 其餘狀態合約的彙總 (status, direction, matched, count, sats)；失敗時拋出 """
+    try:
+        return await _run(repository.get_exposure_totals, exclude_statuses)
+    except Exception as e:
+        print(f"Error getting exposure totals: {e}")
+        raise
+
+@timed("database")
+async def db_get_exposure_row(order_id):
+    """ 直接讀取單筆合約 (不經快取)，曝險帳本重新同步時比對用；失敗時拋出 """
+    try:
+        return await _run(repository.get_contract, order_id)
+    except Exception as e:
+        print(f"Error getting exposure row: {e}")
+        raise
+
+async def _reap(row):
+    """ 條件式還原單筆租約到期的 SETTLING 合約 (租約期間被他人更新時不動作)，回傳還原後的合約 """
+    restored = await _compare_and_set(row['id'], {
+        'status': 'SETTLING',
+        'settle_owner': row['settle_owner'],
+        'settle_lease_until': row['settle_lease_until'],
+    }, {
+        'status': row['settle_prev_status'] or 'PENDING',
+        'settle_owner': None, 'settle_lease_until': None, 'settle_prev_status': None,
+    })
+    if restored is not None:
+        print(f"Settlement lease of contract {row['id']} ({row['settle_owner']}) expired, restored")
+    return restored
+
+@timed("database")
+async def db_reap_expired_lease(order_id):
+    """ 單筆合約: 仍為 SETTLING 且租約已到期時還原並回傳最新合約，否則回傳 None """
+    try:
+        row = await _run(repository.get_contract, order_id)
+        if not row or row['status'] != 'SETTLING' or (row['settle_lease_until'] or 0) >= time.time():
+            return None
+        return await _reap(row)
+    except Exception as e:
+        print(f"Error reaping settlement lease: {e}")
+        return None
+
+@timed("database")
+async def db_reap_expired_leases():
+    """ 將租約到期的 SETTLING 合約還原為結算前的狀態，回傳還原的合約 id """
+    try:
+        reaped = []
+        for row in await _run(repository.get_expired_leases, time.time()):
+            if await _reap(row) is not None:
+                reaped.append(row['id'])
+        return reaped
+    except Exception as e:
+        print(f"Error reaping settlement leases: {e}")
+        return []
+
+@timed("database")
+async def db_delete_contract(order_id):
     try:
-        supabase.table('contracts').delete().eq('id', order_id).execute()
+        row = await _run(repository.delete_contract, order_id)
+        contract_cache.invalidate(order_id)
+        exposure_book.remove(order_id, row)
     except Exception as e:
         print(f"Error deleting contract: {e}")
         raise
 
-def db_get_pending_contracts():
+@timed("database")
+async def db_get_pending_contracts():
     try:
-        result = supabase.table('contracts').select('*').eq('status', 'PENDING').execute()
-        return result.data if result.data else []
+        return await _run(repository.get_contracts_by_status, 'PENDING')
     except Exception as e:
         print(f"Error getting pending contracts: {e}")
         return []
 
-def db_get_user_contracts(user_pubkey):
-    """獲取特定用戶的所有合約"""
+async def _db_list_contracts(filters, fields=None, limit=None, cursor=None):
+    """ keyset 分頁查詢，回傳 (rows, next_cursor)；fields / cursor 格式錯誤時拋出 ValueError """
+    columns = parse_fields(fields)
+    limit = max(1, min(limit or CONTRACT_PAGE_SIZE, CONTRACT_PAGE_SIZE_MAX))
+    after = decode_cursor(cursor) if cursor else None
+
+    async def fetch():
+        rows = await _run(repository.list_contracts, filters, columns, limit + 1, after)
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    key = (json.dumps(filters, sort_keys=True), tuple(columns), limit, after)
+    return await contract_cache.get_list(key, fetch)
+
+@timed("database")
+async def db_get_user_contracts(user_pubkey, fields=None, limit=None, cursor=None):
+    """獲取特定用戶的合約 (分頁)"""
     try:
-        result = supabase.table('contracts').select('*').eq('user_pubkey', user_pubkey).order('created_at', desc=True).execute()
-        return result.data if result.data else []
+        return await _db_list_contracts({'user_pubkey': user_pubkey}, fields, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         print(f"Error getting user contracts: {e}")
-        return []
+        return [], None
 
-def db_get_contracts_by_status(status):
-    """獲取特定狀態的所有合約"""
+@timed("database")
+async def db_get_contracts_by_status(status, fields=None, limit=None, cursor=None):
+    """獲取特定狀態的合約 (分頁)"""
     try:
-        result = supabase.table('contracts').select('*').eq('status', status).order('created_at', desc=True).execute()
-        return result.data if result.data else []
+        return await _db_list_contracts({'status': status}, fields, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         print(f"Error getting contracts by status: {e}")
-        return []
+        return [], None
 
-def db_get_waiting_signature_contracts():
-    """獲取所有等待簽名的合約"""
+@timed("database")
+async def db_get_waiting_signature_contracts(fields=None, limit=None, cursor=None):
+    """獲取等待簽名的合約 (分頁)"""
     try:
-        result = supabase.table('contracts').select('*').in_('status', ['WAITING_USER_SIG', 'WAITING_USER_SIG_REFUND']).order('created_at', desc=True).execute()
-        return result.data if result.data else []
+        return await _db_list_contracts({'status': WAITING_SIGNATURE_STATUSES}, fields, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         print(f"Error getting waiting signature contracts: {e}")
+        return [], None
+
+def job_key(action, contract_id=None):
+    """ idempotency key: 每個合約 + 動作一筆 (不屬於單一合約的動作只有動作名稱) """
+    return f"{action}:{contract_id}" if contract_id is not None else action
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def _decode_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    for column in ('payload', 'result'):
+        if isinstance(job.get(column), str):
+            job[column] = json.loads(job[column])
+    return job
+
+async def _update_job(job, expected, update_data):
+    update_data['updated_at'] = _now_iso()
+    return _decode_job(await _run(repository.compare_and_set, job['id'], expected, update_data, 'jobs'))
+
+@timed("database")
+async def db_enqueue_job(action, contract_id=None, payload=None, max_attempts=1):
+    """ 建立工作，回傳 (job, created)；同一 key 已有 queued / running 的工作時回傳該工作 """
+    key = job_key(action, contract_id)
+    row = {
+        'action': action,
+        'contract_id': contract_id,
+        'idempotency_key': key,
+        'payload': json.dumps(payload or {}),
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': max_attempts,
+        'run_after': time.time(),
+    }
+    try:
+        # 插入與查詢之間既有工作可能剛好結束，重試一次
+        for _ in range(2):
+            job = await _run(repository.create_job, row)
+            if job is not None:
+                return _decode_job(job), True
+            job = await _run(repository.get_active_job, key)
+            if job is not None:
+                return _decode_job(job), False
+        raise ValueError("Failed to enqueue job")
+    except Exception as e:
+        print(f"Error enqueuing job: {e}")
+        raise
+
+@timed("database")
+async def db_claim_job(worker_id, lease_seconds):
+    """
+    取得一筆可執行的工作 (到期的 queued，或租約過期的 running)，以條件式更新避免多個 worker 重複取得
+    已用盡重試次數且租約過期的工作直接標記為 failed
+    """
+    try:
+        now = time.time()
+        for job in await _run(repository.get_claimable_jobs, now, JOB_CLAIM_CANDIDATES):
+            expected = {'status': job['status'], 'attempts': job['attempts'], 'locked_until': job['locked_until']}
+            if job['status'] == 'running' and job['attempts'] >= job['max_attempts']:
+                await _update_job(job, expected, {
+                    'status': 'failed', 'error': 'Worker lease expired', 'locked_by': None, 'locked_until': None
+                })
+                continue
+            claimed = await _update_job(job, expected, {
+                'status': 'running',
+                'attempts': job['attempts'] + 1,
+                'locked_by': worker_id,
+                'locked_until': now + lease_seconds,
+            })
+            if claimed is not None:
+                return claimed
+        return None
+    except Exception as e:
+        print(f"Error claiming job: {e}")
+        return None
+
+@timed("database")
+async def db_extend_job(job, worker_id, lease_seconds):
+    """ 執行中延長租約 (heartbeat)；租約已被他人取得時回傳 None """
+    return await _update_job(job, {'status': 'running', 'locked_by': worker_id}, {
+        'locked_until': time.time() + lease_seconds,
+    })
+
+@timed("database")
+async def db_complete_job(job, worker_id, result):
+    """ running -> succeeded；租約已被他人取得時回傳 None """
+    return await _update_job(job, {'status': 'running', 'locked_by': worker_id}, {
+        'status': 'succeeded', 'result': json.dumps(result, default=str), 'error': None,
+        'locked_by': None, 'locked_until': None,
+    })
+
+@timed("database")
+async def db_fail_job(job, worker_id, error, retry_delay=None):
+    """ 尚有重試次數時延後 retry_delay 秒重新排入，否則 (或 retry_delay 為 None) 標記為 failed """
+    if retry_delay is not None and job['attempts'] < job['max_attempts']:
+        update_data = {'status': 'queued', 'run_after': time.time() + retry_delay}
+    else:
+        update_data = {'status': 'failed'}
+    update_data.update(error=error, locked_by=None, locked_until=None)
+    return await _update_job(job, {'status': 'running', 'locked_by': worker_id}, update_data)
+
+@timed("database")
+async def db_release_job(job, worker_id):
+    """ worker 關閉時歸還執行中的工作 (不計入重試次數) """
+    return await _update_job(job, {'status': 'running', 'locked_by': worker_id}, {
+        'status': 'queued', 'attempts': max(0, job['attempts'] - 1), 'run_after': time.time(),
+        'locked_by': None, 'locked_until': None,
+    })
+
+@timed("database")
+async def db_get_job(job_id):
+    try:
+        return _decode_job(await _run(repository.get_job, job_id))
+    except Exception as e:
+        print(f"Error getting job: {e}")
+        return None
+
+@timed("database")
+async def db_list_jobs(status=None, contract_id=None, limit=None):
+    """ 最近的工作 (依 id 由新到舊) """
+    filters = {}
+    if status:
+        filters['status'] = status
+    if contract_id is not None:
+        filters['contract_id'] = contract_id
+    limit = max(1, min(limit or CONTRACT_PAGE_SIZE, CONTRACT_PAGE_SIZE_MAX))
+    try:
+        return [_decode_job(r) for r in await _run(repository.list_jobs, filters, limit)]
+    except Exception as e:
+        print(f"Error listing jobs: {e}")
         return []
@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+import traceback
+from dotenv import load_dotenv
+from .database import db_get_pending_contracts, db_get_contract
+from .bitcoin_service import get_utxos
+from .match_service import execute_match
+
+load_dotenv()
+
+# 入金監聽配置: 輪詢間隔、並發查詢數、與資料庫重新同步的間隔 (秒)
+DEPOSIT_WATCHER_ENABLED = os.getenv("DEPOSIT_WATCHER_ENABLED", "1") == "1"
+DEPOSIT_WATCH_INTERVAL = float(os.getenv("DEPOSIT_WATCH_INTERVAL", "10"))
+DEPOSIT_WATCH_CONCURRENCY = int(os.getenv("DEPOSIT_WATCH_CONCURRENCY", "20"))
+DEPOSIT_WATCH_RESYNC_SECONDS = float(os.getenv("DEPOSIT_WATCH_RESYNC_SECONDS", "300"))
+# 尚未入金的地址逐次加倍查詢間隔的上限 (秒)，追蹤超過 DEPOSIT_WATCH_EXPIRE_SECONDS 仍未入金即停止追蹤 (0 為不過期)
+DEPOSIT_WATCH_MAX_BACKOFF_SECONDS = float(os.getenv("DEPOSIT_WATCH_MAX_BACKOFF_SECONDS", "300"))
+DEPOSIT_WATCH_EXPIRE_SECONDS = float(os.getenv("DEPOSIT_WATCH_EXPIRE_SECONDS", "86400"))
+
+class DepositWatcher:
+    """
+    背景入金監聽: 追蹤所有 PENDING 合約的存款地址 (address -> contract)，
+    偵測到用戶入金時推送 DEPOSIT_SEEN 並自動觸發 House 配對，完成配對後停止追蹤
+    - 尚未入金的地址以指數退避降低查詢頻率，超過期限仍未入金則停止追蹤 (此進程內不再重新加入)
+    """
+
+    def __init__(self, interval=DEPOSIT_WATCH_INTERVAL, concurrency=DEPOSIT_WATCH_CONCURRENCY,
+                 max_backoff=DEPOSIT_WATCH_MAX_BACKOFF_SECONDS, expire_seconds=DEPOSIT_WATCH_EXPIRE_SECONDS):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+        self.expire_seconds = expire_seconds
+        self.index = {}         # deposit_address -> contract
+        self._by_id = {}        # contract_id -> deposit_address
+        self._seen = set()      # 已推送 DEPOSIT_SEEN 的地址
+        self._added = {}        # deposit_address -> 開始追蹤時間
+        self._backoff = {}      # deposit_address -> (查詢間隔, 下次查詢時間)
+        self._expired = set()   # 逾期未入金而停止追蹤的 contract_id
+        self._manager = None
+        self._task = None
+        self._synced_at = 0
+
+    def track(self, contract):
+        address = contract['deposit_address']
+        self.index[address] = contract
+        self._by_id[contract['id']] = address
+        self._added.setdefault(address, time.monotonic())
+
+    def untrack(self, contract_id):
+        address = self._by_id.pop(contract_id, None)
+        if address is not None:
+            self.index.pop(address, None)
+            self._seen.discard(address)
+            self._added.pop(address, None)
+            self._backoff.pop(address, None)
+
+    async def sync(self):
+        """ 由資料庫重建索引 (排除已注資 (有 match_txid) 與逾期未入金的合約) """
+        contracts = await db_get_pending_contracts()
+        pending = {c['id'] for c in contracts}
+        self._expired &= pending
+        contracts = [c for c in contracts if not c.get('match_txid') and c['id'] not in self._expired]
+        self.index = {c['deposit_address']: c for c in contracts}
+        self._by_id = {c['id']: c['deposit_address'] for c in contracts}
+        self._seen &= set(self.index)
+        now = time.monotonic()
+        self._added = {a: self._added.get(a, now) for a in self.index}
+        self._backoff = {a: b for a, b in self._backoff.items() if a in self.index}
+        self._synced_at = now
+
+    async def start(self, manager):
+        self._manager = manager
+        await self.sync()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if time.monotonic() - self._synced_at > DEPOSIT_WATCH_RESYNC_SECONDS:
+                    await self.sync()
+                await self.poll_once()
+            except Exception:
+                print(traceback.format_exc())
+            await asyncio.sleep(self.interval)
+
+    def _due(self, address, now):
+        backoff = self._backoff.get(address)
+        return backoff is None or backoff[1] <= now
+
+    def _defer(self, address, contract):
+        """ 尚未入金: 加倍下次查詢間隔，逾期則停止追蹤 """
+        now = time.monotonic()
+        if self.expire_seconds and now - self._added.get(address, now) > self.expire_seconds:
+            self.untrack(contract['id'])
+            self._expired.add(contract['id'])
+            return
+        delay = self._backoff.get(address, (self.interval / 2, 0))[0] * 2
+        delay = min(delay, max(self.max_backoff, self.interval))
+        self._backoff[address] = (delay, now + delay)
+
+    async def poll_once(self):
+        """ 以有限並發檢查到期的追蹤地址 """
+        sem = asyncio.Semaphore(self.concurrency)
+        now = time.monotonic()
+
+        async def check(address, contract):
+            async with sem:
+                try:
+                    await self._check(address, contract)
+                except Exception as e:
+                    print(f"Error watching deposit for contract {contract['id']}: {e}")
+
+        await asyncio.gather(*[check(a, c) for a, c in list(self.index.items()) if self._due(a, now)])
+
+    async def _check(self, address, contract):
+        utxos = await get_utxos(address)
+        balance = sum(u['value'] for u in utxos)
+
+        if balance >= contract['amount'] * 2:
+            self.untrack(contract['id'])
+            return
+        if balance < contract['amount']:
+            self._defer(address, contract)
+            return
+        self._backoff.pop(address, None)
+
+        if address not in self._seen:
+            self._seen.add(address)
+            await self._manager.broadcast({
+                "type": "DEPOSIT_SEEN",
+                "contract_id": contract['id'],
+                "user_pubkey": contract['user_pubkey'],
+                "balance": balance
+            })
+
+        # 以最新狀態確認仍為 PENDING (可能已退款 / 取消)
+        latest = await db_get_contract(contract['id'])
+        if not latest or latest['status'] != 'PENDING':
+            self.untrack(contract['id'])
+            return
+
+        # 每個 worker 各自監聽；execute_match 注資前於資料庫認領，同一入金只會注資一次
+        result = await execute_match(latest, self._manager)
+        if result['status'] in ('matched', 'already_matched'):
+            self.untrack(contract['id'])
+
+deposit_watcher = DepositWatcher()
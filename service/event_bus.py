@@ -0,0 +1,219 @@
+import os
+import fcntl
+import asyncio
+import secrets
+import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 跨 worker 事件匯流排 (memory | unix | redis)
+# memory: 單一進程；unix: 同機多個 uvicorn worker 經 Unix socket 中繼；redis: 經 Redis PUBLISH/SUBSCRIBE
+EVENT_BUS = os.getenv("EVENT_BUS", "memory").lower()
+EVENT_BUS_SOCKET = os.getenv("EVENT_BUS_SOCKET", "/tmp/hashhedge-events.sock")
+EVENT_BUS_REDIS_URL = os.getenv("EVENT_BUS_REDIS_URL", "redis://localhost:6379/0")
+EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "hashhedge:events")
+EVENT_BUS_RECONNECT_SECONDS = float(os.getenv("EVENT_BUS_RECONNECT_SECONDS", "1"))
+# 中繼端對單一 worker 的待送上限 (bytes)，超過即斷開該 worker (其會自動重連)
+EVENT_BUS_MAX_BUFFER = int(os.getenv("EVENT_BUS_MAX_BUFFER", str(8 * 1024 * 1024)))
+
+class EventBus:
+    """
+    事件匯流排介面
+    - publish(text): 將已編碼的事件送往其他 worker (本 worker 由呼叫端直接分發)
+    - start(handler): 開始接收其他 worker 的事件，handler(text) 於事件迴圈中呼叫
+    """
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def publish(self, text):
+        pass
+
+    async def close(self):
+        pass
+
+class MemoryEventBus(EventBus):
+    """ 單一進程: 不需轉送 """
+
+class UnixSocketEventBus(EventBus):
+    """
+    同機多 worker 的本地中繼
+    - 取得 <socket>.lock 檔案鎖的 worker 擔任中繼，其餘 worker 以客戶端連線
+    - 中繼將每行事件轉送給來源以外的所有連線
+    - 中繼所在 worker 結束時鎖自動釋放，其他 worker 重連時接手
+    """
+
+    def __init__(self, path=EVENT_BUS_SOCKET):
+        self.path = path
+        self.handler = None
+        self._lock_fd = None
+        self._server = None
+        self._peers = set()
+        self._writer = None
+        self._task = None
+
+    async def start(self, handler):
+        self.handler = handler
+        self._task = asyncio.ensure_future(self._run())
+
+    def _try_become_broker(self):
+        if self._lock_fd is not None:
+            return False
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                for peer in list(self._peers):
+                    if peer is writer:
+                        continue
+                    if peer.transport.get_write_buffer_size() > EVENT_BUS_MAX_BUFFER:
+                        self._peers.discard(peer)
+                        peer.close()
+                        continue
+                    peer.write(line)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _run(self):
+        while True:
+            try:
+                if self._try_become_broker():
+                    # 持有鎖即可安全移除前一個中繼留下的 socket 檔
+                    if os.path.exists(self.path):
+                        os.unlink(self.path)
+                    self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+                    print(f"Event bus broker listening on {self.path}")
+
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                self._writer = writer
+                while line := await reader.readline():
+                    try:
+                        self.handler(line.decode().rstrip("\n"))
+                    except Exception:
+                        print(traceback.format_exc())
+            except asyncio.CancelledError:
+                raise
+            except OSError:
+                pass
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+            await asyncio.sleep(EVENT_BUS_RECONNECT_SECONDS)
+
+    async def publish(self, text):
+        writer = self._writer
+        if writer is None:
+            return
+        if writer.transport.get_write_buffer_size() > EVENT_BUS_MAX_BUFFER:
+            print("Event bus backlog full, dropping event")
+            return
+        writer.write(text.encode() + b"\n")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+class RedisEventBus(EventBus):
+    """
+    經 Redis (或相容服務) PUBLISH/SUBSCRIBE 轉送，可跨主機
+    需安裝 redis>=5 (redis.asyncio)；事件附帶來源節點 id，收到自己發出的事件時略過
+    """
+
+    def __init__(self, url=EVENT_BUS_REDIS_URL, channel=EVENT_BUS_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self.node_id = secrets.token_hex(8)
+        self.handler = None
+        self._client = None
+        self._task = None
+
+    async def start(self, handler):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("EVENT_BUS=redis requires the 'redis' package (pip install 'redis>=5')") from e
+        self.handler = handler
+        self._client = aioredis.from_url(self.url)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    node_id, _, text = message["data"].decode().partition(" ")
+                    if node_id == self.node_id:
+                        continue
+                    try:
+                        self.handler(text)
+                    except Exception:
+                        print(traceback.format_exc())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event bus subscription error: {e}")
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(EVENT_BUS_RECONNECT_SECONDS)
+
+    async def publish(self, text):
+        try:
+            await self._client.publish(self.channel, f"{self.node_id} {text}")
+        except Exception as e:
+            print(f"Event bus publish error: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def create_event_bus(name=EVENT_BUS):
+    if name == "memory":
+        return MemoryEventBus()
+    if name == "unix":
+        return UnixSocketEventBus()
+    if name == "redis":
+        return RedisEventBus()
+    raise ValueError(f"Unknown EVENT_BUS: {name}")
+
+event_bus = create_event_bus()
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import traceback
+from collections import defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配對風控上限 (sats，0 為不限制): 未結算且已配對合約的 LONG / SHORT 淨額、已配對總額 (House 已投入的資金)
+EXPOSURE_MAX_NET_SATS = int(os.getenv("EXPOSURE_MAX_NET_SATS", "0"))
+EXPOSURE_MAX_MATCHED_SATS = int(os.getenv("EXPOSURE_MAX_MATCHED_SATS", "0"))
+# 變動後合併推送 EXPOSURE 事件的間隔 (秒)
+EXPOSURE_PUSH_SECONDS = float(os.getenv("EXPOSURE_PUSH_SECONDS", "1"))
+# 與資料庫重新同步的間隔 (秒，0 為不同步)；多個 worker 時校正其他 worker 對未結算合約的寫入，只讀取追蹤中的狀態
+EXPOSURE_RESYNC_SECONDS = float(os.getenv("EXPOSURE_RESYNC_SECONDS", "0"))
+
+# 結果未定的合約 (計入曝險)
+OPEN_STATUSES = ('PENDING', 'SETTLING')
+# 逐筆保存於記憶體的狀態 (之後仍可能轉移，例如 WAITING_USER_SIG -> SETTLING)；其餘狀態只保留彙總
+TRACKED_STATUSES = OPEN_STATUSES + ('WAITING_USER_SIG',)
+DIRECTIONS = ('LONG', 'SHORT')
+
+def _entry(row):
+    return (row['status'], row['direction'], row.get('matched_at') is not None, row['amount'])
+
+class ExposureBook:
+    """
+    House 曝險帳本 (記憶體內增量維護)
+    - 啟動時分頁載入追蹤中狀態的合約，其餘 (已結束) 狀態由資料庫彙總 (GROUP BY) 一次載入
+    - 之後由合約寫入 (建立 / 狀態轉移 / 配對 / 刪除) 直接增減，增量更新為準，不需掃描資料表
+    - 以 (status, direction, matched) 為鍵累計筆數與金額，快照只與狀態數量相關；已結束的合約不保留逐筆資料
+    - 配對前的風控以此檢查，配對進行中的金額先保留，避免並發配對同時通過
+    - 變動後合併推送 EXPOSURE 事件
+    """
+
+    def __init__(self, max_net_sats=EXPOSURE_MAX_NET_SATS, max_matched_sats=EXPOSURE_MAX_MATCHED_SATS,
+                 push_seconds=EXPOSURE_PUSH_SECONDS, resync_seconds=EXPOSURE_RESYNC_SECONDS):
+        self.max_net_sats = max_net_sats
+        self.max_matched_sats = max_matched_sats
+        self.push_seconds = push_seconds
+        self.resync_seconds = resync_seconds
+        self.version = 0
+        self._rows = {}                         # contract_id -> (status, direction, matched, amount)，僅追蹤中的狀態
+        self._totals = defaultdict(lambda: [0, 0])  # (status, direction, matched) -> [count, sats]
+        self._reserved = {}                     # contract_id -> (direction, amount)，配對進行中
+        self._touched = None                    # 重新同步期間有寫入的合約 id (以增量結果為準)
+        self._snapshot = None
+        self._body = None
+        self._etag = None
+        self._loaded = False
+        self._changed = asyncio.Event()
+        self._synced_at = 0
+        self._manager = None
+        self._load_rows = None
+        self._load_totals = None
+        self._load_row = None
+        self._task = None
+
+    def _add(self, entry, sign):
+        status, direction, matched, amount = entry
+        totals = self._totals[(status, direction, matched)]
+        totals[0] += sign
+        totals[1] += sign * amount
+        if not totals[0]:
+            del self._totals[(status, direction, matched)]
+
+    def _set(self, contract_id, entry, old=None):
+        """ 以 entry 取代合約目前的計入值 (old: 未追蹤合約的原計入值，例如刪除已結束的合約) """
+        old = self._rows.pop(contract_id, old)
+        if old is not None:
+            self._add(old, -1)
+        if entry is not None:
+            self._add(entry, 1)
+            if entry[0] in TRACKED_STATUSES:
+                self._rows[contract_id] = entry
+        if self._touched is not None:
+            self._touched.add(contract_id)
+        if old != entry:
+            self.version += 1
+            self._changed.set()
+
+    def put(self, row):
+        """ 建立或條件式更新後的完整資料列 """
+        entry = _entry(row)
+        if row['id'] not in self._rows and entry[0] not in TRACKED_STATUSES:
+            # 未追蹤且已結束: 已於轉移時 (或載入彙總時) 計入
+            return
+        self._set(row['id'], entry)
+
+    def update(self, contract_id, update_data):
+        old = self._rows.get(contract_id)
+        if old is None:
+            return
+        status, direction, matched, amount = old
+        if 'matched_at' in update_data:
+            matched = update_data['matched_at'] is not None
+        self._set(contract_id, (update_data.get('status', status), direction, matched, amount))
+
+    def remove(self, contract_id, row=None):
+        """ 刪除合約 (row: 刪除前的資料列，用於扣除未追蹤的已結束合約) """
+        if contract_id in self._rows:
+            self._set(contract_id, None)
+        elif row is not None:
+            self._set(contract_id, None, _entry(row))
+
+    def _sum(self, statuses=OPEN_STATUSES, direction=None, matched=None):
+        count = sats = 0
+        for (s, d, m), (c, a) in self._totals.items():
+            if s in statuses and (direction is None or d == direction) and (matched is None or m == matched):
+                count += c
+                sats += a
+        return count, sats
+
+    def matched_sats(self, direction=None):
+        """ 未結算且已配對合約的金額 (含配對進行中的保留額度) """
+        sats = self._sum(direction=direction, matched=True)[1]
+        return sats + sum(a for d, a in self._reserved.values() if direction is None or d == direction)
+
+    def net_sats(self):
+        """ 用戶 LONG - SHORT 淨額，House 持有相反部位 """
+        return self.matched_sats('LONG') - self.matched_sats('SHORT')
+
+    def reserve(self, contract):
+        """ 配對前風控: 通過時保留額度並回傳 None，否則回傳拒絕原因 """
+        if contract['id'] in self._reserved:
+            return "Match already in progress"
+        amount = contract['amount']
+        direction = contract['direction']
+        if self.max_matched_sats and self.matched_sats() + amount > self.max_matched_sats:
+            return f"Matched exposure limit reached ({self.max_matched_sats} sats)"
+        net = self.net_sats()
+        after = net + (amount if direction == 'LONG' else -amount)
+        # 降低淨額的配對一律允許
+        if self.max_net_sats and abs(after) > self.max_net_sats and abs(after) > abs(net):
+            return f"Net exposure limit reached ({self.max_net_sats} sats)"
+        self._reserved[contract['id']] = (direction, amount)
+        return None
+
+    def release(self, contract_id):
+        self._reserved.pop(contract_id, None)
+
+    def snapshot(self):
+        """ 快照依版本快取，查詢只做記憶體讀取 """
+        if self._snapshot is not None and self._snapshot['version'] == self.version:
+            return self._snapshot
+
+        by_status = {}
+        for (status, _, _), (count, sats) in self._totals.items():
+            item = by_status.setdefault(status, {"count": 0, "sats": 0})
+            item['count'] += count
+            item['sats'] += sats
+
+        open_ = {}
+        for direction in DIRECTIONS:
+            count, sats = self._sum(direction=direction)
+            matched_count, matched = self._sum(direction=direction, matched=True)
+            open_[direction] = {
+                "count": count,
+                "sats": sats,
+                "matched_count": matched_count,
+                "matched_sats": matched,
+                "unmatched_sats": sats - matched,
+            }
+
+        matched = open_['LONG']['matched_sats'] + open_['SHORT']['matched_sats']
+        self._snapshot = {
+            "open": open_,
+            "matched_sats": matched,
+            "unmatched_sats": open_['LONG']['unmatched_sats'] + open_['SHORT']['unmatched_sats'],
+            "net_sats": open_['LONG']['matched_sats'] - open_['SHORT']['matched_sats'],
+            "by_status": by_status,
+            "limits": {"max_net_sats": self.max_net_sats, "max_matched_sats": self.max_matched_sats},
+            "version": self.version,
+        }
+        self._body = json.dumps(self._snapshot).encode()
+        self._etag = '"' + hashlib.sha1(self._body).hexdigest() + '"'
+        return self._snapshot
+
+    @property
+    def body(self):
+        self.snapshot()
+        return self._body
+
+    @property
+    def etag(self):
+        self.snapshot()
+        return self._etag
+
+    async def load(self):
+        """ 啟動時載入 (在其他會寫入合約的背景服務啟動前): 追蹤中狀態的合約 (分頁) + 其餘狀態的彙總 """
+        self._touched = set()
+        try:
+            rows = await self._load_rows(TRACKED_STATUSES)
+            totals = await self._load_totals(TRACKED_STATUSES)
+        finally:
+            touched, self._touched = self._touched, None
+        for row in rows:
+            if row['id'] not in touched:
+                self._set(row['id'], _entry(row))
+        for item in totals:
+            key = (item['status'], item['direction'], bool(item['matched']))
+            self._totals[key] = [item['count'], item['sats'] or 0]
+        self._loaded = True
+        self._synced_at = time.monotonic()
+        self.version += 1
+        self._changed.set()
+
+    async def resync(self):
+        """
+        只重新讀取追蹤中的合約並逐筆比對 (其他 worker 的寫入)；讀取期間本進程寫入的合約以增量結果為準，
+        不在結果中的合約 (已被他人結束或刪除) 逐筆重新讀取
+        """
+        self._touched = set()
+        try:
+            rows = {row['id']: row for row in await self._load_rows(TRACKED_STATUSES)}
+            missing = [i for i in self._rows if i not in rows]
+            latest = await asyncio.gather(*[self._load_row(i) for i in missing])
+        finally:
+            touched, self._touched = self._touched, None
+        for contract_id, row in rows.items():
+            if contract_id not in touched and self._rows.get(contract_id) != _entry(row):
+                self._set(contract_id, _entry(row))
+        for contract_id, row in zip(missing, latest):
+            if contract_id in touched or contract_id not in self._rows:
+                continue
+            self._set(contract_id, _entry(row) if row else None)
+        self._synced_at = time.monotonic()
+
+    async def start(self, manager, load_rows, load_totals, load_row):
+        """ load_rows(statuses) / load_totals(exclude_statuses) / load_row(id): 資料庫讀取函數 """
+        self._manager = manager
+        self._load_rows = load_rows
+        self._load_totals = load_totals
+        self._load_row = load_row
+        try:
+            await self.load()
+        except Exception:
+            # 載入失敗時由背景迴圈重試
+            print(traceback.format_exc())
+        self._task = asyncio.ensure_future(self._run())
+        print(f"Exposure book loaded ({len(self._rows)} tracked contracts)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _resync_due(self):
+        return self.resync_seconds > 0 and time.monotonic() - self._synced_at > self.resync_seconds
+
+    async def _run(self):
+        pushed = self.version
+        while True:
+            if self.version == pushed and self._loaded:
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.resync_seconds or None)
+                except asyncio.TimeoutError:
+                    pass
+            # 合併短時間內的多次變動 (例如批次結算) 為一次推送
+            await asyncio.sleep(self.push_seconds)
+            try:
+                if not self._loaded:
+                    await self.load()
+                elif self._resync_due():
+                    await self.resync()
+                if self.version != pushed:
+                    pushed = self.version
+                    await self._manager.broadcast({"type": "EXPOSURE", **self.snapshot()})
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+
+exposure_book = ExposureBook()
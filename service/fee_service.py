@@ -0,0 +1,93 @@
+import os
+import math
+import time
+import asyncio
+from bitcoinutils.transactions import Transaction, TxWitnessInput
+from dotenv import load_dotenv
+from .chain_backend import chain
+
+load_dotenv()
+
+# 費率配置 (sat/vB): 目標檔位 (fastestFee | halfHourFee | hourFee | economyFee | minimumFee)、
+# 上下限、尚未取得報價時的預設值，與背景更新間隔 (秒)
+FEE_TARGET = os.getenv("FEE_TARGET", "halfHourFee")
+FEE_RATE_FLOOR = float(os.getenv("FEE_RATE_FLOOR", "1"))
+FEE_RATE_CEILING = float(os.getenv("FEE_RATE_CEILING", "200"))
+FEE_RATE_DEFAULT = float(os.getenv("FEE_RATE_DEFAULT", "2"))
+FEE_REFRESH_SECONDS = float(os.getenv("FEE_REFRESH_SECONDS", "60"))
+
+# 估算 vsize 用的 dummy 簽名 (Schnorr 64 bytes；DER + sighash 最長 72 bytes) 與壓縮公鑰
+DUMMY_SCHNORR_SIG = "00" * 64
+DUMMY_ECDSA_SIG = "00" * 72
+DUMMY_PUBKEY = "00" * 33
+
+def tx_vsize(tx, witness_stacks):
+    """
+    以 dummy 見證計算交易的實際 vsize (BIP141: ceil(weight / 4))
+    witness_stacks: 每個輸入的見證元素 (hex)，簽名位置以 dummy 簽名填入
+    """
+    signed = Transaction(tx.inputs, tx.outputs, locktime=tx.locktime, version=tx.version,
+                         has_segwit=True, witnesses=[TxWitnessInput(w) for w in witness_stacks])
+    base = len(signed.to_bytes(False))
+    total = len(signed.to_bytes(True))
+    return math.ceil((base * 3 + total) / 4)
+
+def script_path_witness(n_sigs, script_hex, cb_hex):
+    """ Taproot script path 見證: n 個簽名 + 葉腳本 + 控制區塊 """
+    return [DUMMY_SCHNORR_SIG] * n_sigs + [script_hex, cb_hex]
+
+def p2wpkh_witness():
+    return [DUMMY_ECDSA_SIG, DUMMY_PUBKEY]
+
+def fee_for(vsize, fee_rate):
+    return math.ceil(vsize * fee_rate)
+
+class FeeRateProvider:
+    """
+    建議費率提供者
+    - 背景定期由鏈上後端取得建議費率並快取，交易構建時同步讀取不需等待網路
+    - 回傳值限制在 [FEE_RATE_FLOOR, FEE_RATE_CEILING]；取得失敗時沿用上次報價
+    """
+
+    def __init__(self, target=FEE_TARGET, floor=FEE_RATE_FLOOR, ceiling=FEE_RATE_CEILING,
+                 default=FEE_RATE_DEFAULT, refresh_seconds=FEE_REFRESH_SECONDS):
+        self.target = target
+        self.floor = floor
+        self.ceiling = ceiling
+        self.default = default
+        self.refresh_seconds = refresh_seconds
+        self.rates = {}
+        self.updated_at = 0
+        self._task = None
+
+    async def refresh(self):
+        try:
+            self.rates = await chain.get_fee_rates()
+            self.updated_at = time.time()
+        except Exception as e:
+            print(f"Error fetching fee rates: {e}")
+
+    def current(self, target=None):
+        """ 目前費率 (sat/vB) """
+        rate = self.rates.get(target or self.target, self.default)
+        return min(max(float(rate), self.floor), self.ceiling)
+
+    async def start(self):
+        await self.refresh()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await self.refresh()
+
+fee_rates = FeeRateProvider()
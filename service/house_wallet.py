@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+from bitcoinutils.transactions import Transaction
+from dotenv import load_dotenv
+from .bitcoin_service import HOUSE_PUB_KEY, chain, add_broadcast_hook
+from .fee_service import fee_rates
+
+load_dotenv()
+
+# House UTXO 帳本配置 (秒)
+HOUSE_RESERVATION_SECONDS = float(os.getenv("HOUSE_RESERVATION_SECONDS", "60"))
+HOUSE_LEDGER_REFRESH_SECONDS = float(os.getenv("HOUSE_LEDGER_REFRESH_SECONDS", "30"))
+HOUSE_SELECT_WAIT_SECONDS = float(os.getenv("HOUSE_SELECT_WAIT_SECONDS", "10"))
+
+# 選幣用的 P2WPKH 交易大小估計 (vbytes)；實際手續費由 fee_service 依構建後的 vsize 計算
+INPUT_VBYTES = 68
+PAYMENT_OUTPUT_VBYTES = 43
+CHANGE_OUTPUT_VBYTES = 31
+TX_OVERHEAD_VBYTES = 11
+DUST_LIMIT = 546
+BNB_MAX_TRIES = 100000
+BNB_MAX_POOL = 200
+
+def branch_and_bound(pool, target, cost_of_change, max_tries=BNB_MAX_TRIES):
+    """
+    尋找總有效金額落在 [target, target + cost_of_change] 的組合 (免找零)
+    pool: [(effective_value, utxo)] 依有效金額遞減排序；找不到回傳 None
+    """
+    best = None
+    chosen = []
+    tries = 0
+
+    def search(i, total, remaining):
+        nonlocal best, tries
+        tries += 1
+        if tries > max_tries or (best and best[0] == 0):
+            return
+        if total > target + cost_of_change:
+            return
+        if total >= target:
+            if best is None or total - target < best[0]:
+                best = (total - target, list(chosen))
+            return
+        if i == len(pool) or total + remaining < target:
+            return
+        value, utxo = pool[i]
+        chosen.append(utxo)
+        search(i + 1, total + value, remaining - value)
+        chosen.pop()
+        search(i + 1, total, remaining - value)
+
+    search(0, 0, sum(value for value, _ in pool))
+    return best[1] if best else None
+
+def largest_first(pool, target):
+    """ 由大到小累加直到足額 (含找零輸出成本)；不足回傳 None """
+    chosen, total = [], 0
+    for value, utxo in pool:
+        chosen.append(utxo)
+        total += value
+        if total >= target:
+            return chosen
+    return None
+
+class HouseWallet:
+    """
+    House 錢包的進程內 UTXO 帳本
+    - 啟動時由鏈上後端載入，之後依自身廣播的交易更新
+    - 選幣: branch-and-bound (免找零)，失敗時改用 largest-first
+    - 選出的 UTXO 在有效期間內被保留，並發交易不會重複花費
+    """
+
+    def __init__(self, reservation_seconds=HOUSE_RESERVATION_SECONDS,
+                 refresh_seconds=HOUSE_LEDGER_REFRESH_SECONDS):
+        self.reservation_seconds = reservation_seconds
+        self.refresh_seconds = refresh_seconds
+        self.script_hex = HOUSE_PUB_KEY.get_segwit_address().to_script_pub_key().to_hex()
+        self._utxos = {}        # (txid, vout) -> utxo
+        self._reserved = {}     # (txid, vout) -> expires_at
+        self._spent = {}        # 已由我方花費但鏈上可能尚未反映的 outpoint -> spent_at
+        self._created = {}      # 我方廣播產生的 House 輸出 outpoint -> created_at
+        self._synced_at = 0
+        self._released = asyncio.Event()
+
+    async def refresh(self):
+        """ 由鏈上後端重新載入，保留我方已花費的 outpoint 排除紀錄 """
+        address = HOUSE_PUB_KEY.get_segwit_address().to_string()
+        try:
+            chain_utxos = await chain.get_utxos(address)
+        except Exception as e:
+            print(f"Error refreshing house ledger: {e}")
+            return
+        now = time.monotonic()
+        on_chain = {(u['txid'], u['vout']): u for u in chain_utxos}
+
+        # 本地新建但後端尚未回報的找零，在寬限期內保留
+        self._created = {op: t for op, t in self._created.items() if now - t < self.refresh_seconds}
+        local = {op: u for op, u in self._utxos.items() if op not in on_chain and op in self._created}
+        self._spent = {op: t for op, t in self._spent.items()
+                       if op in on_chain or now - t < self.refresh_seconds}
+        self._utxos = {op: u for op, u in on_chain.items() if op not in self._spent}
+        self._utxos.update(local)
+        self._synced_at = now
+
+    async def refresh_if_stale(self):
+        """ 距上次載入超過 refresh_seconds 時才重新載入 (限制對鏈上後端的查詢頻率) """
+        if not self._synced_at or time.monotonic() - self._synced_at > self.refresh_seconds:
+            await self.refresh()
+
+    def _available(self):
+        now = time.monotonic()
+        self._reserved = {op: exp for op, exp in self._reserved.items() if exp > now}
+        return [u for op, u in self._utxos.items() if op not in self._reserved]
+
+    def _try_select(self, total_out, n_payments, fee_rate):
+        input_fee = INPUT_VBYTES * fee_rate
+        base_fee = (n_payments * PAYMENT_OUTPUT_VBYTES + TX_OVERHEAD_VBYTES) * fee_rate
+        change_fee = CHANGE_OUTPUT_VBYTES * fee_rate
+
+        pool = [(u['value'] - input_fee, u) for u in self._available()]
+        pool = sorted([p for p in pool if p[0] > 0], key=lambda p: p[0], reverse=True)
+
+        target = total_out + base_fee
+        selected = branch_and_bound(pool[:BNB_MAX_POOL], target, change_fee + DUST_LIMIT)
+        if selected is None:
+            selected = largest_first(pool, target + change_fee)
+        if selected is None:
+            return None
+
+        expires_at = time.monotonic() + self.reservation_seconds
+        for u in selected:
+            self._reserved[(u['txid'], u['vout'])] = expires_at
+        return selected
+
+    async def select(self, total_out, n_payments=1, fee_rate=None):
+        """ 選出並保留足以支付 total_out 與手續費的 UTXO """
+        fee_rate = fee_rate or fee_rates.current()
+        await self.refresh_if_stale()
+
+        deadline = time.monotonic() + HOUSE_SELECT_WAIT_SECONDS
+        refreshed = False
+        while True:
+            selected = self._try_select(total_out, n_payments, fee_rate)
+            if selected is not None:
+                return selected
+            if not refreshed:
+                await self.refresh()
+                refreshed = True
+                continue
+            # 其他交易保留中的 UTXO 可能被釋放或產生找零，等待後重試
+            remaining = deadline - time.monotonic()
+            if not self._reserved or remaining <= 0:
+                break
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        total = sum(u['value'] for u in self._utxos.values())
+        raise ValueError(f"House insufficient funds. Has {total}, needs {total_out}+fee")
+
+    def release(self, utxos):
+        for u in utxos:
+            self._reserved.pop((u['txid'], u['vout']), None)
+        self._released.set()
+
+    def release_tx(self, tx_hex):
+        """ 交易未能廣播時釋放其輸入的保留 """
+        tx = Transaction.from_raw(tx_hex)
+        for txin in tx.inputs:
+            self._reserved.pop((txin.txid, txin.txout_index), None)
+        self._released.set()
+
+    def apply_tx(self, tx_hex, txid):
+        """ 廣播成功後: 移除已花費的 House UTXO，加入支付給 House 的輸出 """
+        tx = Transaction.from_raw(tx_hex)
+        now = time.monotonic()
+        for txin in tx.inputs:
+            op = (txin.txid, txin.txout_index)
+            if self._utxos.pop(op, None) is not None or op in self._reserved:
+                self._spent[op] = now
+            self._reserved.pop(op, None)
+        for vout, txout in enumerate(tx.outputs):
+            if txout.script_pubkey.to_hex() == self.script_hex:
+                self._utxos[(txid, vout)] = {
+                    "txid": txid,
+                    "vout": vout,
+                    "value": txout.amount,
+                    "status": {"confirmed": False},
+                }
+                self._created[(txid, vout)] = now
+        self._released.set()
+
+    def balance(self):
+        confirmed = sum(u['value'] for u in self._utxos.values() if u['status'].get('confirmed'))
+        total = sum(u['value'] for u in self._utxos.values())
+        return {"confirmed": confirmed, "unconfirmed": total - confirmed, "utxo_count": len(self._utxos)}
+
+house_wallet = HouseWallet()
+add_broadcast_hook(house_wallet.apply_tx)
@@ -0,0 +1,233 @@
+import os
+import time
+import socket
+import random
+import asyncio
+import secrets
+import traceback
+from collections import Counter
+from dotenv import load_dotenv
+from .database import (
+    db_enqueue_job, db_claim_job, db_extend_job, db_complete_job, db_fail_job, db_release_job,
+    db_get_contract, db_get_pending_contracts, db_reap_expired_leases
+)
+from .settlement_service import execute_settlement, settle_contracts
+from .match_service import execute_match
+from .refund_service import execute_refund
+from .stats_service import stats_service
+
+load_dotenv()
+
+# 工作佇列配置: worker 數、無工作時的輪詢間隔 (秒)、單次執行的租約 (秒，逾期視為 worker 中斷並重新執行)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+# 重試: 最大嘗試次數與指數退避的起始 / 上限 (秒)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "2"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+# 關閉時等待執行中工作完成的時間 (秒)，逾時的工作歸還佇列
+JOB_SHUTDOWN_SECONDS = float(os.getenv("JOB_SHUTDOWN_SECONDS", "10"))
+
+class JobError(Exception):
+    """ 可重試的工作失敗 (retry_after: 最早重試的時間點，Unix 秒) """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class JobAttentionError(Exception):
+    """ 不可重試的工作失敗: 交易已廣播但後續步驟失敗，重新執行可能作用於已花費的資金，需人工確認 """
+
+def _broadcasted(result):
+    txid = result.get('txid')
+    return isinstance(txid, str) and len(txid) == 64
+
+def _check(result):
+    """ 動作回傳錯誤結果時視為失敗 (例如廣播失敗)，交由重試處理；已廣播 (帶 txid) 的失敗不重試 """
+    failed = result.get('result') == 'ERROR' or result.get('status') == 'error'
+    if _broadcasted(result) and (failed or result.get('db_error')):
+        raise JobAttentionError(
+            f"Needs attention: broadcast {result['txid']} succeeded but "
+            f"{result.get('db_error') or result.get('error') or result.get('message')}"
+        )
+    if failed:
+        raise JobError(str(result.get('error') or result.get('details') or result.get('message') or result))
+    return result
+
+async def _contract(job):
+    contract = await db_get_contract(job['contract_id'])
+    if not contract:
+        raise LookupError("Contract not found")
+    return contract
+
+def _difficulty(payload):
+    """ 未指定 current_difficulty 時於執行當下取用背景更新的網路難度 """
+    difficulty = payload.get('current_difficulty')
+    if difficulty is None:
+        difficulty = stats_service.difficulty
+    if difficulty is None:
+        raise JobError("Network difficulty unavailable")
+    return difficulty
+
+async def _run_settle(job, manager):
+    """ 合約仍由他人 (或中斷前的本工作) 持有結算租約時重試，租約到期後由 execute_settlement 還原並結算 """
+    contract = await _contract(job)
+    result = _check(await execute_settlement(contract, _difficulty(job['payload']), manager))
+    if result.get('result') == 'CONFLICT':
+        latest = await _contract(job)
+        if latest['status'] == 'SETTLING':
+            raise JobError("Contract is being settled", latest.get('settle_lease_until'))
+    return result
+
+async def _run_settle_all(job, manager):
+    """ 重新執行 (中斷後) 時已結算的合約不再是 PENDING，只會處理剩餘部分 """
+    payload = job['payload']
+    difficulty = _difficulty(payload)
+    await db_reap_expired_leases()
+    contracts = await db_get_pending_contracts()
+    results = {}
+    async for item in settle_contracts(
+        contracts, difficulty, manager,
+        payload.get('concurrency'), payload.get('timeout'), payload.get('batch_losses')
+    ):
+        results[item['id']] = item['result'].get('result')
+    await manager.broadcast({"type": "SETTLE_ALL_DONE", "count": len(results)})
+    return {"count": len(results), "by_result": dict(Counter(results.values())), "results": results}
+
+async def _run_match(job, manager):
+    return _check(await execute_match(await _contract(job), manager))
+
+async def _run_refund(job, manager):
+    return _check(await execute_refund(await _contract(job)))
+
+JOB_HANDLERS = {
+    'settle': _run_settle,
+    'settle_all': _run_settle_all,
+    'match': _run_match,
+    'refund': _run_refund,
+}
+
+class JobQueue:
+    """
+    資料表持久化的工作佇列 + async worker pool
+    - 同一合約 + 動作同時只有一筆進行中的工作 (idempotency key)
+    - worker 以條件式更新取得工作並持有租約；進程中斷後租約過期，其他 worker (或重啟後) 重新執行
+    - 失敗以指數退避重試，用盡次數後標記為 failed
+    - 合約狀態本身以 CAS / 結算租約保護，重複執行同一工作不會重複簽名或廣播
+    """
+
+    def __init__(self, workers=JOB_WORKERS, poll_seconds=JOB_POLL_SECONDS, lease_seconds=JOB_LEASE_SECONDS,
+                 max_attempts=JOB_MAX_ATTEMPTS, handlers=None):
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.handlers = handlers or JOB_HANDLERS
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.manager = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._tasks = []
+
+    async def enqueue(self, action, contract_id=None, payload=None):
+        """ 回傳 (job, created) """
+        if action not in self.handlers:
+            raise ValueError(f"Unknown job action: {action}")
+        job, created = await db_enqueue_job(action, contract_id, payload, self.max_attempts)
+        self._wake.set()
+        return job, created
+
+    def retry_delay(self, attempts):
+        delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def start(self, manager):
+        if self._tasks:
+            return
+        self.manager = manager
+        self._stopping = False
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        print(f"Job queue started ({self.workers} workers, {self.worker_id})")
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wake.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=JOB_SHUTDOWN_SECONDS)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while not self._stopping:
+            job = await db_claim_job(self.worker_id, self.lease_seconds)
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._execute(job)
+            except asyncio.CancelledError:
+                await db_release_job(job, self.worker_id)
+                raise
+
+    async def _heartbeat(self, job):
+        """ 執行期間定期延長租約，長時間的工作 (例如 settle_all) 不會被其他 worker 重複取得 """
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if await db_extend_job(job, self.worker_id, self.lease_seconds) is None:
+                    print(f"Job {job['id']} lease lost while running")
+                    return
+            except Exception as e:
+                print(f"Error extending job {job['id']} lease: {e}")
+
+    async def _run_handler(self, job):
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            return await self.handlers[job['action']](job, self.manager)
+        finally:
+            heartbeat.cancel()
+
+    async def _execute(self, job):
+        try:
+            result = await self._run_handler(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, (JobError, JobAttentionError, LookupError)):
+                print(traceback.format_exc())
+            if isinstance(e, JobAttentionError):
+                print(f"Job {job['id']} {e}")
+            # 找不到合約 / 已廣播後的失敗不重試；其他失敗 (含外部服務暫時錯誤) 以退避重試
+            delay = None if isinstance(e, (LookupError, JobAttentionError)) else self.retry_delay(job['attempts'])
+            if getattr(e, 'retry_after', None):
+                delay = max(delay, e.retry_after - time.time())
+            updated = await db_fail_job(job, self.worker_id, str(e), delay)
+            if updated is not None and updated['status'] == 'failed':
+                await self._notify(updated)
+            return
+
+        updated = await db_complete_job(job, self.worker_id, result)
+        if updated is None:
+            print(f"Job {job['id']} lease lost before completion")
+            return
+        await self._notify(updated)
+
+    async def _notify(self, job):
+        await self.manager.broadcast({
+            "type": "JOB_DONE" if job['status'] == 'succeeded' else "JOB_FAILED",
+            "job_id": job['id'],
+            "action": job['action'],
+            "contract_id": job['contract_id'],
+            "status": job['status'],
+            "error": job.get('error')
+        })
+
+job_queue = JobQueue()
@@ -0,0 +1,78 @@
+import os
+import asyncio
+import traceback
+from dotenv import load_dotenv
+from .transaction_service import send_funds_from_house_batch
+from .bitcoin_service import broadcast_tx
+from .house_wallet import house_wallet
+
+load_dotenv()
+
+# 配對批次配置: 收集視窗 (毫秒) 與單筆交易最大輸出數
+MATCH_BATCH_WINDOW_MS = float(os.getenv("MATCH_BATCH_WINDOW_MS", "0"))
+MATCH_BATCH_MAX_OUTPUTS = int(os.getenv("MATCH_BATCH_MAX_OUTPUTS", "100"))
+
+class MatchBatcher:
+    """
+    House 配對批次佇列
+    - 在視窗期間累積配對請求，以一筆多輸出交易一次注資
+    - 同一合約在結果回傳前 (收集中或建構 / 廣播中) 只注資一次，共用結果
+    - 各批次由 House 帳本選幣並保留 UTXO，可並行建構與廣播
+    """
+
+    def __init__(self, window_ms=MATCH_BATCH_WINDOW_MS, max_outputs=MATCH_BATCH_MAX_OUTPUTS):
+        self.window = window_ms / 1000
+        self.max_outputs = max_outputs
+        self._pending = {}      # key -> (address_obj, amount, future)
+        self._inflight = {}     # key -> future，直到批次廣播完成
+        self._timer = None
+        self._flushes = set()
+
+    async def submit(self, key, to_address_obj, amount_sats):
+        """ 加入批次並等待廣播結果 (txid，或廣播失敗的錯誤訊息) """
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = (to_address_obj, amount_sats, future)
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        if len(self._pending) >= self.max_outputs:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_now)
+
+        return await asyncio.shield(future)
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = list(self._pending.values()), {}
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try:
+            tx_hex = await send_funds_from_house_batch([(addr, amount) for addr, amount, _ in batch])
+            txid = await broadcast_tx(tx_hex)
+            if len(txid) != 64:
+                house_wallet.release_tx(tx_hex)
+            for _, _, future in batch:
+                if not future.done(): future.set_result(txid)
+        except Exception as e:
+            print(traceback.format_exc())
+            for _, _, future in batch:
+                if not future.done(): future.set_exception(e)
+
+    async def close(self):
+        """ 關閉前送出尚在等待的批次 """
+        self._flush_now()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+match_batcher = MatchBatcher()
@@ -0,0 +1,59 @@
+from .bitcoin_service import get_utxos, get_spend_context
+from .match_batcher import match_batcher
+from .database import db_mark_matched, db_claim_match, db_release_match
+from .exposure_book import exposure_book
+
+async def execute_match(contract, manager):
+    """ 執行單一合約配對: 偵測用戶入金後由 House 1:1 注資 """
+    utxos = await get_utxos(contract['deposit_address'])
+    current_balance = sum(u['value'] for u in utxos)
+    
+    if current_balance < contract['amount']:
+        return {"status": "waiting_for_user", "message": "User deposit not detected yet."}
+        
+    if current_balance >= contract['amount'] * 2:
+        if contract.get('matched_at') is None:
+            await db_mark_matched(contract['id'])
+        return {"status": "already_matched", "message": "Contract is already fully funded."}
+
+    # 風控: 以曝險帳本檢查配對後的部位 (不掃描資料表)
+    reason = exposure_book.reserve(contract)
+    if reason:
+        return {"status": "rejected", "error": reason, "exposure": exposure_book.snapshot()}
+
+    # 於資料庫認領後才注資 (認領即計入帳本，釋放保留額度)，其他 worker 的配對不會重複注資
+    try:
+        claimed = await db_claim_match(contract['id'])
+    finally:
+        exposure_book.release(contract['id'])
+    if claimed is None:
+        return {"status": "in_progress", "message": "Contract is being matched or is no longer PENDING."}
+
+    try:
+        multisig_addr = get_spend_context(contract['user_pubkey'], contract['nonce']).address
+        
+        match_amount = contract['amount'] 
+        
+        txid = await match_batcher.submit(contract['id'], multisig_addr, match_amount)
+    except Exception:
+        await db_release_match(contract['id'], claimed['matched_at'])
+        raise
+        
+    if len(txid) != 64:
+         await db_release_match(contract['id'], claimed['matched_at'])
+         return {"status": "error", "error": "Broadcast failed", "details": txid}
+    await db_mark_matched(contract['id'], txid)
+
+    await manager.broadcast({
+        "type": "MATCHED",
+        "contract_id": contract['id'],
+        "user_pubkey": contract['user_pubkey'],
+        "txid": txid,
+        "message": f"House matched {match_amount} sats."
+    })
+
+    return {
+        "status": "matched", 
+        "txid": txid, 
+        "message": f"House matched {match_amount} sats (1:1 Odds). Contract is now live!"
+    }
@@ -0,0 +1,156 @@
+import os
+import time
+import heapq
+import asyncio
+import traceback
+from dotenv import load_dotenv
+from .database import db_get_contract, db_get_maturing_contracts, db_reap_expired_leases
+from .chain_backend import chain
+from .settlement_service import settle_contracts
+from .stats_service import stats_service
+
+load_dotenv()
+
+# 到期自動結算 (1 啟用)、有區塊高度到期的合約時查詢鏈上高度的間隔 (秒)、結算失敗後重試的延遲 (秒)
+MATURITY_SCHEDULER_ENABLED = os.getenv("MATURITY_SCHEDULER_ENABLED", "1") == "1"
+MATURITY_HEIGHT_POLL_SECONDS = float(os.getenv("MATURITY_HEIGHT_POLL_SECONDS", "30"))
+MATURITY_RETRY_SECONDS = float(os.getenv("MATURITY_RETRY_SECONDS", "60"))
+
+# 與 nLockTime 相同: 小於此值為區塊高度，否則為 Unix 時間 (秒)
+LOCKTIME_THRESHOLD = 500_000_000
+
+# 需要重試的結算結果 (CONFLICT: 他人結算中，若其中斷則租約到期後由重試接手；SKIPPED / ALREADY_SETTLED 不再排程)
+RETRY_RESULTS = ('ERROR', 'TIMEOUT', 'CONFLICT')
+# 到期時仍需結算的狀態 (SETTLING 交由結算流程還原過期租約或回報 CONFLICT)
+DUE_STATUSES = ('PENDING', 'SETTLING')
+
+def is_height(maturity):
+    return maturity < LOCKTIME_THRESHOLD
+
+class MaturityScheduler:
+    """
+    合約到期自動結算
+    - 啟動時載入一次設有到期的 PENDING 合約，之後由建立 / 取消時增減
+    - 時間到期與高度到期各以 min-heap 保存，只在最早一筆到期時喚醒 (高度到期時定期查詢鏈上高度)
+    - 到期的一組合約取用最新的網路難度後一次結算，成本只與實際到期的數量相關
+    - 取消時只移除索引 (lazy deletion)，heap 中的舊項目在取出時略過
+    """
+
+    def __init__(self, height_poll_seconds=MATURITY_HEIGHT_POLL_SECONDS, retry_seconds=MATURITY_RETRY_SECONDS):
+        self.height_poll_seconds = height_poll_seconds
+        self.retry_seconds = retry_seconds
+        self.height = None
+        self.manager = None
+        self._times = []        # (unix_time, contract_id)
+        self._heights = []      # (block_height, contract_id)
+        self._scheduled = {}    # contract_id -> 目前有效的到期值
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def schedule(self, contract):
+        maturity = contract.get('maturity')
+        if maturity is None:
+            return
+        self._push(contract['id'], maturity)
+
+    def _push(self, contract_id, maturity):
+        self._scheduled[contract_id] = maturity
+        heapq.heappush(self._heights if is_height(maturity) else self._times, (maturity, contract_id))
+        self._wake.set()
+
+    def unschedule(self, contract_id):
+        self._scheduled.pop(contract_id, None)
+
+    def _peek(self, heap):
+        while heap and self._scheduled.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def _pop_due(self, heap, now):
+        due = []
+        while self._peek(heap) is not None and heap[0][0] <= now:
+            _, contract_id = heapq.heappop(heap)
+            del self._scheduled[contract_id]
+            due.append(contract_id)
+        return due
+
+    def pending(self):
+        return len(self._scheduled)
+
+    async def sync(self):
+        self._times.clear()
+        self._heights.clear()
+        self._scheduled.clear()
+        for contract in await db_get_maturing_contracts():
+            self.schedule(contract)
+
+    async def start(self, manager):
+        self.manager = manager
+        await self.sync()
+        self._task = asyncio.ensure_future(self._run())
+        print(f"Maturity scheduler started ({self.pending()} contracts scheduled)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                due = self._pop_due(self._times, time.time())
+                if self._peek(self._heights) is not None:
+                    self.height = await chain.get_tip_height()
+                    due += self._pop_due(self._heights, self.height)
+                if due:
+                    await self.settle_due(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+            await self._sleep()
+
+    async def _sleep(self):
+        self._wake.clear()
+        timeout = None
+        next_time = self._peek(self._times)
+        if next_time is not None:
+            timeout = max(0, next_time - time.time())
+        if self._peek(self._heights) is not None:
+            timeout = self.height_poll_seconds if timeout is None else min(timeout, self.height_poll_seconds)
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _retry(self, contract_ids):
+        retry_at = int(time.time() + self.retry_seconds)
+        for contract_id in contract_ids:
+            self._push(contract_id, max(retry_at, LOCKTIME_THRESHOLD))
+
+    async def settle_due(self, contract_ids):
+        """ 以最新的網路難度一次結算到期的合約，回傳 [{"id", "result"}] """
+        await db_reap_expired_leases()
+        contracts = await asyncio.gather(*[db_get_contract(i) for i in contract_ids])
+        contracts = [c for c in contracts if c and c['status'] in DUE_STATUSES]
+        if not contracts:
+            return []
+
+        await stats_service.refresh()
+        difficulty = stats_service.difficulty
+        if difficulty is None:
+            print("Maturity settlement postponed: network difficulty unavailable")
+            self._retry([c['id'] for c in contracts])
+            return []
+
+        results = [item async for item in settle_contracts(contracts, difficulty, self.manager)]
+        self._retry([item['id'] for item in results if item['result'].get('result') in RETRY_RESULTS])
+        await self.manager.broadcast({"type": "MATURITY_SETTLE_DONE", "count": len(results), "difficulty": difficulty})
+        print(f"Settled {len(results)} matured contracts at difficulty {difficulty}")
+        return results
+
+maturity_scheduler = MaturityScheduler()
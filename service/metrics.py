@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+import contextvars
+from collections import defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 每個請求結束時輸出一行 JSON 計時紀錄 (含各外部依賴耗時) (1 啟用)
+METRICS_LOG_REQUESTS = os.getenv("METRICS_LOG_REQUESTS", "0") == "1"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._counts = {}       # labels -> 各 bucket 計數 (非累積，最後一格為 +Inf)
+        self._sums = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] += value
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                total = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    total += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {total}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {self._sums[key]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {total}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Prometheus text exposition format 0.0.4 """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",)
+))
+dependency_duration = registry.register(Histogram(
+    "dependency_duration_seconds", "External dependency call latency", ("dependency", "operation")
+))
+dependency_errors = registry.register(Counter(
+    "dependency_errors_total", "External dependency calls that raised", ("dependency", "operation")
+))
+
+# 目前請求內的依賴呼叫紀錄 [(dependency, operation, seconds)]，供結構化請求日誌使用
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def record_dependency(dependency, operation, seconds, error=False):
+    dependency_duration.observe(seconds, dependency=dependency, operation=operation)
+    if error:
+        dependency_errors.inc(dependency=dependency, operation=operation)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((dependency, operation, seconds))
+
+def timed(dependency, operation=None):
+    """ 記錄 async 函數耗時的裝飾器 (dependency_duration_seconds / dependency_errors_total) """
+    def decorator(fn):
+        op = operation or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                record_dependency(dependency, op, time.perf_counter() - start, error)
+        return wrapper
+    return decorator
+
+class MetricsMiddleware:
+    """
+    ASGI 中介層: 記錄各路由 (路徑樣板) 的延遲直方圖與進行中請求數
+    METRICS_LOG_REQUESTS=1 時每個請求輸出一行 JSON，包含該請求內各依賴呼叫的耗時
+    """
+
+    def __init__(self, app, log_requests=METRICS_LOG_REQUESTS):
+        self.app = app
+        self.log_requests = log_requests
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        timings = []
+        token = _request_timings.set(timings)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec(method=method)
+            _request_timings.reset(token)
+            # 未匹配的路徑統一標記，避免標籤數量無限增長
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(elapsed, method=method, route=route, status=str(status))
+            if self.log_requests:
+                print(json.dumps({
+                    "method": method,
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "dependencies": [
+                        {"dependency": d, "operation": o, "ms": round(s * 1000, 2)} for d, o, s in timings
+                    ],
+                }))
@@ -0,0 +1,148 @@
+import os
+import sys
+import hmac
+import time
+import asyncio
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 取樣分析配置: 啟用旗標、管理者 token (X-Profile-Token)、取樣間隔 (毫秒)、輸出目錄、時間窗上限 (秒)
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# 未設定管理者 token 時不啟用 (避免分析端點對外開放)
+if PROFILE_ENABLED and not PROFILE_ADMIN_TOKEN:
+    print("PROFILE_ENABLED=1 requires PROFILE_ADMIN_TOKEN, profiling disabled")
+    PROFILE_ENABLED = False
+
+# 進行中的分析 (簽名 worker 回傳的堆疊會併入所有進行中的分析)
+active_sessions = []
+
+def _frame_name(frame):
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])})"
+
+def collapse(frame):
+    """ 由根到葉以 ; 串接的堆疊 (collapsed stack 格式) """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """ 背景執行緒定期取樣指定執行緒的堆疊，累計為 collapsed stacks """
+
+    def __init__(self, thread_id=None, interval_ms=PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+class ProfileSession:
+    """
+    一次分析: 取樣事件迴圈執行緒，並合併簽名進程池 worker 回傳的堆疊
+    事件迴圈上同時處理的其他請求也會出現在結果中
+    """
+
+    def __init__(self, label, interval_ms=PROFILE_INTERVAL_MS):
+        self.sampler = StackSampler(interval_ms=interval_ms)
+        self.started_at = time.time()
+        self.duration = 0
+        # 檔名於開始時決定，請求模式可先在回應標頭中回傳
+        stamp = datetime.fromtimestamp(self.started_at, timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        label = "".join(c if c.isalnum() else "_" for c in label).strip("_")
+        self.name = f"{stamp}-{label}.collapsed"
+
+    def __enter__(self):
+        self.started_at = time.time()
+        active_sessions.append(self)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.sampler.stop()
+        active_sessions.remove(self)
+        self.duration = time.time() - self.started_at
+
+    def add_stacks(self, stacks, prefix):
+        for stack, count in stacks.items():
+            self.sampler.stacks[f"{prefix};{stack}"] += count
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.sampler.stacks.most_common())
+
+    def save(self, directory=PROFILE_DIR):
+        """ 寫入 <directory>/<時間>-<label>.collapsed，回傳檔名 (可用 flamegraph.pl / speedscope 開啟) """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, self.name), "w") as f:
+            f.write(self.collapsed())
+        return self.name
+
+def record_worker_stacks(stacks):
+    """ 簽名 worker 回傳的堆疊併入進行中的分析 """
+    for session in active_sessions:
+        session.add_stacks(stacks, "signing-worker")
+
+def authorized(headers):
+    token = headers.get("x-profile-token") or ""
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+class ProfilingMiddleware:
+    """
+    帶有 X-Profile: 1 (與 X-Profile-Token) 的請求會以取樣分析執行，
+    結果存入 PROFILE_DIR，檔名回傳於 X-Profile-Id 標頭
+    僅在 PROFILE_ENABLED=1 (且設定 PROFILE_ADMIN_TOKEN) 時註冊，未啟用時沒有額外開銷
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+        if headers.get("x-profile") != "1" or not authorized(headers):
+            return await self.app(scope, receive, send)
+
+        session = ProfileSession(f"{scope['method']}-{scope['path']}")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", session.name.encode())]
+            await send(message)
+
+        try:
+            with session:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            await asyncio.to_thread(session.save)
+            print(f"Profile saved: {session.name} ({session.sampler.samples} samples, {session.duration:.2f}s)")
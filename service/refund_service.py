@@ -0,0 +1,23 @@
+from .database import db_get_contract, db_transition
+from .transaction_service import build_refund_tx
+from .deposit_watcher import deposit_watcher
+
+async def execute_refund(contract):
+    """ 建構退款交易 (User + House 路徑)，等待用戶簽名 """
+    if contract['status'] != 'PENDING':
+        return {"result": "ALREADY_SETTLED", "message": f"Contract is {contract['status']}"}
+
+    tx_hex, msg = await build_refund_tx(contract)
+
+    status = "WAITING_USER_SIG_REFUND"
+    if not await db_transition(contract['id'], 'PENDING', status, tx_hex):
+        # 建構期間合約已被結算或變更
+        latest = await db_get_contract(contract['id'])
+        return {"result": "ALREADY_SETTLED", "message": f"Contract is {latest['status'] if latest else 'deleted'}"}
+    deposit_watcher.untrack(contract['id'])
+
+    return {
+        "status": "waiting_user_sig",
+        "tx_hex": tx_hex,
+        "message": msg + ". Waiting for User signature."
+    }
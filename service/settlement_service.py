@@ -1,18 +1,88 @@
+import os
+import socket
+import asyncio
+import secrets
 import traceback
 from bitcoinutils.keys import PublicKey
-from .database import db_update_status
-from .transaction_service import build_win_path_partial_tx, build_multisig_spend
-from .bitcoin_service import broadcast_tx, HOUSE_PRIV_KEY
+from dotenv import load_dotenv
+from .database import db_update_status, db_transition, db_claim_settlement, db_reap_expired_lease
+from .transaction_service import (
+    build_win_path_partial_tx, build_multisig_spend, build_batch_multisig_spend, LOSS_INPUT_VBYTES
+)
+from .bitcoin_service import broadcast_tx, get_utxos, HOUSE_PUB_KEY
+
+load_dotenv()
+
+# 批次結算配置
+SETTLE_CONCURRENCY = int(os.getenv("SETTLE_CONCURRENCY", "16"))
+SETTLE_TIMEOUT_SECONDS = float(os.getenv("SETTLE_TIMEOUT_SECONDS", "30"))
+
+# LOSS 路徑合併結算配置
+SETTLE_BATCH_LOSSES = os.getenv("SETTLE_BATCH_LOSSES", "0") == "1"
+SETTLE_BATCH_MAX_INPUTS = int(os.getenv("SETTLE_BATCH_MAX_INPUTS", "100"))
+SETTLE_BATCH_MAX_WEIGHT = int(os.getenv("SETTLE_BATCH_MAX_WEIGHT", "200000"))
+
+SETTLEABLE_STATUSES = ['PENDING', 'WAITING_USER_SIG']
+# SETTLING: 結算中 (租約到期時還原後可重新結算)
+CLAIMABLE_STATUSES = SETTLEABLE_STATUSES + ['SETTLING']
+
+# 本進程的結算租約持有者 id (多個 worker / 主機可同時結算，各自只處理取得租約的合約)
+SETTLE_OWNER = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+def is_winning(contract, current_difficulty):
+    """ 判定輸贏 """
+    if contract['direction'] == 'LONG' and current_difficulty > 0.05: return True
+    if contract['direction'] == 'SHORT' and current_difficulty <= 0.05: return True
+    return False
+
+CONFLICT_RESULT = {"result": "CONFLICT", "message": "Contract is being settled or was changed concurrently"}
+
+async def _claim(contract):
+    """
+    以合約目前所見的狀態取得結算租約 (PENDING / WAITING_USER_SIG -> SETTLING)；
+    失敗時若前一持有者已中斷 (租約到期)，還原後再取得一次
+    """
+    claimed = None
+    if contract['status'] in SETTLEABLE_STATUSES:
+        claimed = await db_claim_settlement(contract['id'], contract['status'], SETTLE_OWNER)
+    if claimed is None:
+        restored = await db_reap_expired_lease(contract['id'])
+        if restored is not None:
+            claimed = await db_claim_settlement(restored['id'], restored['status'], SETTLE_OWNER)
+    return claimed
+
+async def _release(contract):
+    """ 未完成結算: 還原為取得租約前的狀態 """
+    try:
+        await db_transition(contract['id'], 'SETTLING', contract['settle_prev_status'], owner=SETTLE_OWNER)
+    except Exception:
+        print(traceback.format_exc())
+
+async def _finish(contract, status, tx_hex, broadcasted):
+    """
+    結算完成: SETTLING -> status，租約已失效時回傳 False
+    已廣播的交易以鏈上結果為準，即使租約失效也直接寫入狀態
+    """
+    if await db_transition(contract['id'], 'SETTLING', status, tx_hex, owner=SETTLE_OWNER):
+        return True
+    print(f"Settlement lease of contract {contract['id']} lost before completion")
+    if broadcasted:
+        await db_update_status(contract['id'], status, tx_hex)
+        return True
+    return False
 
 async def execute_settlement(contract, current_difficulty, manager):
-    """ 執行單一合約結算邏輯 """
-    if contract['status'] not in ['PENDING', 'WAITING_USER_SIG']: 
+    """ 執行單一合約結算邏輯 (先取得租約，同一合約不會被並發結算；結算中回傳 CONFLICT) """
+    if contract['status'] not in CLAIMABLE_STATUSES: 
         return {"result": "ALREADY_SETTLED", "message": f"Contract is {contract['status']}"}
 
-    # 判定輸贏
-    is_win = False
-    if contract['direction'] == 'LONG' and current_difficulty > 0.05: is_win = True
-    elif contract['direction'] == 'SHORT' and current_difficulty <= 0.05: is_win = True
+    claimed = await _claim(contract)
+    if claimed is None:
+        return dict(CONFLICT_RESULT)
+    contract = claimed
+    finished = False
+
+    is_win = is_winning(contract, current_difficulty)
     
     try:
         tx_hex = ""
@@ -24,11 +94,14 @@ async def execute_settlement(contract, current_difficulty, manager):
             status = "WAITING_USER_SIG"
             msg = "Oracle signed. Transaction saved. Waiting for User signature."
             
-            db_update_status(contract['id'], status, tx_hex)
+            finished = await _finish(contract, status, tx_hex, broadcasted=False)
+            if not finished:
+                return dict(CONFLICT_RESULT)
             
             await manager.broadcast({
                 "type": "ACTION_REQUIRED",
                 "contract_id": contract['id'],
+                "user_pubkey": contract['user_pubkey'],
                 "status": status,
                 "tx_hex": tx_hex,
                 "message": msg
@@ -41,7 +114,7 @@ async def execute_settlement(contract, current_difficulty, manager):
             }
 
         else:
-            house_addr_obj = HOUSE_PRIV_KEY.get_public_key().get_segwit_address()
+            house_addr_obj = HOUSE_PUB_KEY.get_segwit_address()
             tx_hex = await build_multisig_spend(contract, house_addr_obj)
             status = "SETTLED_LOSS"
             msg = "Oracle & House signed. Funds sent to House."
@@ -51,21 +124,31 @@ async def execute_settlement(contract, current_difficulty, manager):
             if len(txid) != 64:
                  return {"result": "ERROR", "message": "Broadcast failed", "details": txid}
 
-            db_update_status(contract['id'], status, tx_hex)
-            
-            await manager.broadcast({
-                "type": "SETTLED",
-                "contract_id": contract['id'],
-                "result": status,
-                "txid": txid
-            })
-
-            return {
+            # 已廣播: 不再還原租約，之後的狀態寫入 / 推送失敗只記錄，不改變結算結果
+            finished = True
+            result = {
                 "result": status, 
                 "txid": txid, 
                 "tx_hex": tx_hex,
                 "message": msg
             }
+            try:
+                await _finish(contract, status, tx_hex, broadcasted=True)
+            except Exception as e:
+                print(f"Contract {contract['id']} settled on chain ({txid}) but status update failed: {e}")
+                result['db_error'] = str(e)
+            try:
+                await manager.broadcast({
+                    "type": "SETTLED",
+                    "contract_id": contract['id'],
+                    "user_pubkey": contract['user_pubkey'],
+                    "result": status,
+                    "txid": txid
+                })
+            except Exception:
+                print(traceback.format_exc())
+
+            return result
             
     except ValueError as ve:
         if "no funds" in str(ve):
@@ -78,3 +161,156 @@ async def execute_settlement(contract, current_difficulty, manager):
     except Exception as e:
         print(traceback.format_exc())
         return {"result": "ERROR", "error": str(e), "traceback": traceback.format_exc(), "message": "Settlement failed"}
+
+    finally:
+        if not finished:
+            await _release(contract)
+
+
+def _chunk_loss_entries(entries, max_inputs, max_weight):
+    """ 依輸入數與估計 weight 切分批次，同一合約的 UTXO 必定落在同一批 """
+    chunks, current, inputs = [], [], 0
+    for contract, utxos in entries:
+        n = len(utxos)
+        weight = (inputs + n) * LOSS_INPUT_VBYTES * 4
+        if current and (inputs + n > max_inputs or weight > max_weight):
+            chunks.append(current)
+            current, inputs = [], 0
+        current.append((contract, utxos))
+        inputs += n
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def _settle_loss_chunk(chunk, manager):
+    """ chunk 內的合約皆已取得租約，未完成時全部還原 """
+    ids = [contract['id'] for contract, _ in chunk]
+    finished = False
+    try:
+        house_addr_obj = HOUSE_PUB_KEY.get_segwit_address()
+        tx_hex = await build_batch_multisig_spend(chunk, house_addr_obj)
+        txid = await broadcast_tx(tx_hex)
+
+        if len(txid) != 64:
+            return [{"id": i, "result": {"result": "ERROR", "message": "Broadcast failed", "details": txid}} for i in ids]
+
+        # 已廣播: 之後的狀態寫入 / 推送失敗只記錄於該合約，不改變結算結果
+        finished = True
+        results = []
+        for contract, _ in chunk:
+            contract_id = contract['id']
+            result = {
+                "result": "SETTLED_LOSS",
+                "txid": txid,
+                "batch_size": len(ids),
+                "message": "Oracle & House signed. Funds sent to House (batched)."
+            }
+            try:
+                await _finish(contract, "SETTLED_LOSS", tx_hex, broadcasted=True)
+            except Exception as e:
+                print(f"Contract {contract_id} settled on chain ({txid}) but status update failed: {e}")
+                result['db_error'] = str(e)
+            try:
+                await manager.broadcast({
+                    "type": "SETTLED",
+                    "contract_id": contract_id,
+                    "user_pubkey": contract['user_pubkey'],
+                    "result": "SETTLED_LOSS",
+                    "txid": txid
+                })
+            except Exception:
+                print(traceback.format_exc())
+            results.append({"id": contract_id, "result": result})
+        return results
+    except Exception as e:
+        print(traceback.format_exc())
+        return [{"id": i, "result": {"result": "ERROR", "error": str(e), "message": "Batch settlement failed"}} for i in ids]
+    finally:
+        if not finished:
+            await asyncio.gather(*[_release(contract) for contract, _ in chunk])
+
+async def settle_losses_batched(contracts, manager, max_inputs=None, max_weight=None):
+    """ 將落敗合約合併為多輸入交易送往 House，回傳 [{"id", "result"}] """
+    max_inputs = max_inputs or SETTLE_BATCH_MAX_INPUTS
+    max_weight = max_weight or SETTLE_BATCH_MAX_WEIGHT
+
+    results = []
+    settleable = []
+    for contract in contracts:
+        if contract['status'] not in CLAIMABLE_STATUSES:
+            results.append({"id": contract['id'], "result": {"result": "ALREADY_SETTLED", "message": f"Contract is {contract['status']}"}})
+        else:
+            settleable.append(contract)
+
+    claimed = []
+    for contract, row in zip(settleable, await asyncio.gather(*[_claim(c) for c in settleable])):
+        if row is None:
+            results.append({"id": contract['id'], "result": dict(CONFLICT_RESULT)})
+        else:
+            claimed.append(row)
+
+    try:
+        all_utxos = await asyncio.gather(*[get_utxos(c['deposit_address']) for c in claimed])
+    except Exception:
+        await asyncio.gather(*[_release(c) for c in claimed])
+        raise
+    entries = []
+    for contract, utxos in zip(claimed, all_utxos):
+        if not utxos:
+            print(f"Skipping contract {contract['id']}: No funds.")
+            await _release(contract)
+            results.append({"id": contract['id'], "result": {"result": "SKIPPED", "message": "No funds in contract address."}})
+        else:
+            entries.append((contract, utxos))
+
+    chunks = _chunk_loss_entries(entries, max_inputs, max_weight)
+    for chunk_results in await asyncio.gather(*[_settle_loss_chunk(chunk, manager) for chunk in chunks]):
+        results.extend(chunk_results)
+    return results
+
+async def settle_contracts(contracts, current_difficulty, manager, concurrency=None, timeout=None, batch_losses=None):
+    """
+    以有限並發結算多筆合約，依完成順序逐筆產出 {"id", "result"}
+    逾時只放棄等待，不中斷進行中的廣播 (避免已廣播但未更新狀態)，
+    該合約仍佔用並發名額直到實際完成
+    batch_losses 時落敗合約改由 settle_losses_batched 合併結算 (不受單筆逾時限制)
+    """
+    concurrency = concurrency or SETTLE_CONCURRENCY
+    timeout = timeout or SETTLE_TIMEOUT_SECONDS
+    batch_losses = SETTLE_BATCH_LOSSES if batch_losses is None else batch_losses
+    sem = asyncio.Semaphore(concurrency)
+    total = len(contracts)
+
+    async def run(contract):
+        await sem.acquire()
+        work = asyncio.ensure_future(execute_settlement(contract, current_difficulty, manager))
+        work.add_done_callback(lambda _: sem.release())
+        try:
+            res = await asyncio.wait_for(asyncio.shield(work), timeout)
+        except asyncio.TimeoutError:
+            res = {"result": "TIMEOUT", "message": f"Settlement still running after {timeout}s"}
+        except Exception as e:
+            res = {"result": "ERROR", "error": str(e)}
+        return [{"id": contract['id'], "result": res}]
+
+    losses = []
+    if batch_losses:
+        losses = [c for c in contracts if not is_winning(c, current_difficulty)]
+        contracts = [c for c in contracts if is_winning(c, current_difficulty)]
+
+    tasks = [asyncio.ensure_future(run(c)) for c in contracts]
+    if losses:
+        tasks.append(asyncio.ensure_future(settle_losses_batched(losses, manager)))
+
+    done = 0
+    for next_results in asyncio.as_completed(tasks):
+        for item in await next_results:
+            done += 1
+            await manager.broadcast({
+                "type": "SETTLE_PROGRESS",
+                "contract_id": item['id'],
+                "result": item['result'].get('result'),
+                "done": done,
+                "total": total
+            })
+            yield item
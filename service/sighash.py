@@ -0,0 +1,59 @@
+import hashlib
+import struct
+from functools import lru_cache
+from bitcoinutils.constants import LEAF_VERSION_TAPSCRIPT, TAPROOT_SIGHASH_ALL
+from bitcoinutils.utils import tagged_hash, prepend_compact_size, h_to_b
+
+# 每個葉腳本的 tapleaf hash 快取容量 (每個合約三個葉)
+TAPLEAF_HASH_CACHE_SIZE = 3 * 4096
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+@lru_cache(maxsize=TAPLEAF_HASH_CACHE_SIZE)
+def _tapleaf_hash(script_bytes):
+    return tagged_hash(bytes([LEAF_VERSION_TAPSCRIPT]) + prepend_compact_size(script_bytes), "TapLeaf")
+
+def tapleaf_hash(script):
+    """ 葉腳本的 BIP341 tapleaf hash (依腳本內容快取) """
+    return _tapleaf_hash(script.to_bytes())
+
+class TaprootSighash:
+    """
+    BIP341 簽名摘要 (SIGHASH_DEFAULT)
+    - 交易層的 sha_prevouts / sha_amounts / sha_scriptpubkeys / sha_sequences / sha_outputs
+      在建立時計算一次，之後每個輸入、每個簽名者只需附加輸入資料後做一次 tagged hash
+    - 結果與 bitcoinutils Transaction.get_transaction_taproot_digest 相同
+    """
+
+    def __init__(self, tx, script_pubkeys, amounts):
+        if len(script_pubkeys) != len(tx.inputs) or len(amounts) != len(tx.inputs):
+            raise ValueError("Taproot sighash requires scriptPubKey and amount for every input")
+
+        sha_prevouts = _sha256(b"".join(
+            h_to_b(txin.txid)[::-1] + struct.pack("<I", txin.txout_index) for txin in tx.inputs
+        ))
+        sha_amounts = _sha256(b"".join(a.to_bytes(8, "little") for a in amounts))
+        sha_script_pubkeys = _sha256(b"".join(
+            prepend_compact_size(s.to_bytes()) for s in script_pubkeys
+        ))
+        sha_sequences = _sha256(b"".join(txin.sequence for txin in tx.inputs))
+        sha_outputs = _sha256(b"".join(txout.to_bytes() for txout in tx.outputs))
+
+        # epoch + hash_type + nVersion + nLockTime + 交易層雜湊
+        self._prefix = (
+            bytes([0, TAPROOT_SIGHASH_ALL]) + tx.version + tx.locktime
+            + sha_prevouts + sha_amounts + sha_script_pubkeys + sha_sequences + sha_outputs
+        )
+
+    def key_path(self, index):
+        """ key path 花費的摘要 """
+        return tagged_hash(self._prefix + bytes([0]) + index.to_bytes(4, "little"), "TapSighash")
+
+    def script_path(self, index, tapleaf_script):
+        """ script path 花費的摘要 (BIP342: 附加 tapleaf hash、key version 與 codesep 位置) """
+        return tagged_hash(
+            self._prefix + bytes([2]) + index.to_bytes(4, "little")
+            + tapleaf_hash(tapleaf_script) + bytes([0]) + b"\xff\xff\xff\xff",
+            "TapSighash"
+        )
@@ -0,0 +1,168 @@
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from bitcoinutils.setup import setup, get_network
+from bitcoinutils.keys import PrivateKey
+from bitcoinutils.script import Script
+from bitcoinutils.transactions import Transaction, TxInput, TxOutput
+from bitcoinutils.constants import SIGHASH_ALL, TAPROOT_SIGHASH_ALL
+from dotenv import load_dotenv
+from .metrics import timed
+from .sighash import TaprootSighash
+from .profiler import StackSampler, active_sessions, record_worker_stacks, PROFILE_INTERVAL_MS
+
+load_dotenv()
+
+# 簽名進程池配置: worker 數 (0 表示在事件迴圈內直接簽名) 與每次提交給單一 worker 的最大簽名數
+SIGNING_WORKERS = int(os.getenv("SIGNING_WORKERS", str(os.cpu_count() or 1)))
+SIGNING_CHUNK_SIZE = int(os.getenv("SIGNING_CHUNK_SIZE", "16"))
+
+# worker 內的私鑰 (key_name -> PrivateKey)
+_keys = {}
+
+def _load_keys():
+    global _keys
+    _keys = {
+        'house': PrivateKey(secret_exponent=int(os.getenv("HOUSE_KEY_SECRET"))),
+        'oracle': PrivateKey(secret_exponent=int(os.getenv("ORACLE_KEY_SECRET"))),
+    }
+
+def _init_worker(network):
+    """ worker 啟動時設定網路並載入一次私鑰 """
+    setup(network)
+    _load_keys()
+
+def schnorr_job(key_name, digest):
+    """ Taproot 輸入的簽名請求 (digest 由 TaprootSighash 計算) """
+    return ('schnorr', key_name, digest)
+
+def ecdsa_job(key_name, digest):
+    """ segwit v0 輸入的簽名請求 (SIGHASH_ALL) """
+    return ('ecdsa', key_name, digest)
+
+def sign_jobs(jobs):
+    """ 對已計算好的摘要簽名，回傳與 jobs 同序的簽名 """
+    if not _keys:
+        _load_keys()
+    sigs = []
+    for kind, key_name, digest in jobs:
+        key = _keys[key_name]
+        if kind == 'schnorr':
+            sigs.append(key._sign_taproot_input(digest, TAPROOT_SIGHASH_ALL, tweak=False))
+        else:
+            sigs.append(key._sign_input(digest, SIGHASH_ALL))
+    return sigs
+
+def verify_signing_backend():
+    """
+    sign_jobs 使用 bitcoinutils 的 _sign_taproot_input / _sign_input (對預先計算的摘要簽名，非公開 API)，
+    啟動時以測試金鑰確認: TaprootSighash 與 get_transaction_taproot_digest 一致，
+    且簽名結果與公開的 sign_taproot_input / sign_segwit_input 相同；不一致時拒絕啟動
+    """
+    key = PrivateKey(secret_exponent=1)
+    pub = key.get_public_key()
+    leaf = Script([pub.to_x_only_hex(), 'OP_CHECKSIG'])
+    script_pubkey = pub.get_taproot_address([[leaf]]).to_script_pub_key()
+    tx = Transaction([TxInput('00' * 32, 0)], [TxOutput(1000, script_pubkey)], has_segwit=True)
+
+    digest = TaprootSighash(tx, [script_pubkey], [2000]).script_path(0, leaf)
+    expected = tx.get_transaction_taproot_digest(0, [script_pubkey], [2000], 1, script=leaf, sighash=TAPROOT_SIGHASH_ALL)
+    if digest != expected:
+        raise RuntimeError("TaprootSighash does not match bitcoinutils get_transaction_taproot_digest")
+    schnorr = key.sign_taproot_input(tx, 0, [script_pubkey], [2000], script_path=True, tapleaf_script=leaf, tweak=False)
+    if key._sign_taproot_input(digest, TAPROOT_SIGHASH_ALL, tweak=False) != schnorr:
+        raise RuntimeError("bitcoinutils _sign_taproot_input is incompatible with sign_taproot_input")
+
+    p2pkh = pub.get_address().to_script_pub_key()
+    digest = tx.get_transaction_segwit_digest(0, p2pkh, 2000)
+    if key._sign_input(digest, SIGHASH_ALL) != key.sign_segwit_input(tx, 0, p2pkh, 2000):
+        raise RuntimeError("bitcoinutils _sign_input is incompatible with sign_segwit_input")
+
+def sign_jobs_profiled(jobs, interval_ms):
+    """ 分析進行中時使用: 在 worker 內取樣簽名過程，連同簽名回傳 collapsed stacks """
+    sampler = StackSampler(interval_ms=interval_ms).start()
+    try:
+        sigs = sign_jobs(jobs)
+    finally:
+        stacks = sampler.stop()
+    return sigs, dict(stacks)
+
+class SigningService:
+    """
+    簽名服務: 在進程池中執行 Schnorr/ECDSA 運算，避免阻塞事件迴圈
+    - 摘要由呼叫端以 TaprootSighash 一次算好，只傳送 32 bytes 摘要給 worker
+    - 每次提交一筆交易的多個簽名請求，依數量分段平均分散到各 worker
+    - worker 啟動時載入一次私鑰
+    """
+
+    def __init__(self, workers=SIGNING_WORKERS, chunk_size=SIGNING_CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._pool = None
+        self._verified = False
+
+    def start(self):
+        """ 建立進程池並預先啟動 worker (應於其他執行緒建立前呼叫)，先確認簽名相容性 """
+        if not self._verified:
+            verify_signing_backend()
+            self._verified = True
+        if self.workers <= 0 or self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(get_network(),)
+        )
+        for _ in range(self.workers):
+            self._pool.submit(int)
+
+    def _chunks(self, items):
+        size = min(self.chunk_size, -(-len(items) // self.workers))
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    async def map(self, fn, items):
+        """
+        在進程池中分段執行 fn(chunk) (fn 須為模組層級函數，回傳與 chunk 同序的 list)，
+        供簽名以外的 CPU 密集工作 (例如批次推導合約地址) 使用
+        """
+        if not items:
+            return []
+        if self.workers <= 0:
+            return fn(items)
+        self.start()
+
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self._pool, fn, chunk) for chunk in self._chunks(items)
+        ])
+        return [item for chunk in results for item in chunk]
+
+    @timed("signing")
+    async def sign(self, jobs):
+        """ 簽名 jobs 中的所有摘要，回傳與 jobs 同序的簽名 """
+        if not jobs:
+            return []
+        if self.workers <= 0:
+            return sign_jobs(jobs)
+        self.start()
+
+        chunks = self._chunks(jobs)
+        loop = asyncio.get_running_loop()
+        if active_sessions:
+            profiled = await asyncio.gather(*[
+                loop.run_in_executor(self._pool, sign_jobs_profiled, chunk, PROFILE_INTERVAL_MS)
+                for chunk in chunks
+            ])
+            for _, stacks in profiled:
+                record_worker_stacks(stacks)
+            results = [sigs for sigs, _ in profiled]
+        else:
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self._pool, sign_jobs, chunk) for chunk in chunks
+            ])
+        return [sig for sigs in results for sig in sigs]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+signer = SigningService()
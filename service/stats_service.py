@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import deque
+from dotenv import load_dotenv
+from .chain_backend import chain
+from .bitcoin_service import get_house_address
+from .house_wallet import house_wallet
+
+load_dotenv()
+
+# 網路狀態背景更新間隔 (秒) 與歷史紀錄筆數 (預設 30 秒 x 2880 = 24 小時)
+STATS_REFRESH_SECONDS = float(os.getenv("STATS_REFRESH_SECONDS", "30"))
+STATS_HISTORY_SIZE = int(os.getenv("STATS_HISTORY_SIZE", "2880"))
+
+# hashprice 以 sats / (TH/s) / 日 表示，約 144 區塊
+HASHES_PER_TH = 1e12
+
+def compute_hashprice(reward_sats_144, hashrate):
+    """ 每 TH/s 每日的預期收益 (sats) """
+    if not hashrate:
+        return None
+    return round(reward_sats_144 * HASHES_PER_TH / hashrate, 2)
+
+class StatsService:
+    """
+    網路狀態快照
+    - 背景定期由鏈上後端更新難度 / 下次調整估計 / hashprice，並更新 House 帳本餘額
+    - 快照預先編碼為 JSON 並計算 ETag，/api/stats 只做記憶體讀取
+    - 每次更新附加一筆精簡紀錄到環狀緩衝區
+    """
+
+    def __init__(self, refresh_seconds=STATS_REFRESH_SECONDS, history_size=STATS_HISTORY_SIZE):
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = {}
+        self.body = b"{}"
+        self.etag = '"0"'
+        self.history = deque(maxlen=history_size)
+        self._network = {}
+        self._house_address = None
+        self._task = None
+
+    @property
+    def difficulty(self):
+        return self.snapshot.get('difficulty')
+
+    async def refresh(self):
+        if self._house_address is None:
+            self._house_address = get_house_address()
+        try:
+            self._network = await chain.get_network_stats()
+        except Exception as e:
+            print(f"Error refreshing network stats: {e}")
+        # House 帳本平時只在選幣時更新，這裡一併更新 (超過 HOUSE_LEDGER_REFRESH_SECONDS 才查詢)
+        await house_wallet.refresh_if_stale()
+
+        network = self._network
+        snapshot = {
+            "difficulty": network.get('difficulty'),
+            "hashrate": network.get('hashrate'),
+            "hashprice_sats": compute_hashprice(network.get('reward_sats_144', 0), network.get('hashrate')),
+            "next_adjustment": network.get('adjustment'),
+            "house_address": self._house_address,
+            "house_balance": house_wallet.balance(),
+            "updated_at": int(time.time()),
+        }
+        self.snapshot = snapshot
+        self.body = json.dumps(snapshot).encode()
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.history.append({
+            "t": snapshot['updated_at'],
+            "difficulty": snapshot['difficulty'],
+            "hashprice_sats": snapshot['hashprice_sats'],
+            "house_balance": snapshot['house_balance']['confirmed'] + snapshot['house_balance']['unconfirmed'],
+        })
+
+    def recent(self, limit=None):
+        """ 最近的歷史紀錄 (舊到新) """
+        items = list(self.history)
+        return items[-limit:] if limit else items
+
+    async def start(self):
+        await self.refresh()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await self.refresh()
+
+stats_service = StatsService()
@@ -1,28 +1,21 @@
-from bitcoinutils.keys import PublicKey, P2trAddress
+from bitcoinutils.keys import PublicKey
 from bitcoinutils.transactions import Transaction, TxInput, TxOutput, TxWitnessInput
-from bitcoinutils.utils import tweak_taproot_pubkey, ControlBlock, get_tag_hashed_merkle_root
 from .bitcoin_service import (
-    HOUSE_PRIV_KEY, ORACLE_PRIV_KEY, NUMS_PUBKEY_HEX,
-    to_x_only, create_contract_tree, get_utxos
+    HOUSE_PUB_KEY, HOUSE_X_ONLY, ORACLE_X_ONLY, get_spend_context, get_utxos
 )
 
+from .house_wallet import house_wallet, DUST_LIMIT
+from .signing_service import signer, schnorr_job, ecdsa_job
+from .sighash import TaprootSighash
+from .fee_service import fee_rates, tx_vsize, script_path_witness, p2wpkh_witness, fee_for
+
+# Script path 輸入的估計大小上限 (vbytes)，供批次分組估算；實際手續費依構建後的 vsize 計算
+LOSS_INPUT_VBYTES = 150
+
 async def build_win_path_partial_tx(contract, to_address):
     """ 構建 User Win 的部分簽名交易 (Oracle 簽名, User 留空) """
-    tree, script_win, _, _ = create_contract_tree(
-        contract['user_pubkey'], 
-        HOUSE_PRIV_KEY.get_public_key().to_hex(), 
-        ORACLE_PRIV_KEY.get_public_key().to_hex(), 
-        contract['nonce']
-    )
-    
-    internal_pub = PublicKey(NUMS_PUBKEY_HEX)
-    internal_pub_bytes = internal_pub.to_bytes()
-    
-    root_hash = get_tag_hashed_merkle_root(tree)
-    tweak = int.from_bytes(root_hash, 'big')
-    _, parity = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    
-    cb = ControlBlock(internal_pub, tree, 0, is_odd=(parity == 1))
+    ctx = get_spend_context(contract['user_pubkey'], contract['nonce'])
+    script_win, script_win_hex, cb_hex = ctx.leaf('win')
     
     utxos = await get_utxos(contract['deposit_address'])
     if not utxos:
@@ -31,37 +24,36 @@ async def build_win_path_partial_tx(contract, to_address):
     tx_inputs = []
     total_in = 0
     
-    tweaked_pubkey, _ = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    tr_addr = P2trAddress(witness_program=tweaked_pubkey[:32].hex())
-    utxo_script_pubkey = tr_addr.to_script_pub_key()
+    utxo_script_pubkey = ctx.script_pubkey
     
     for utxo in utxos:
         tx_inputs.append(TxInput(utxo['txid'], utxo['vout']))
         total_in += utxo['value']
 
-    est_vbytes = (len(tx_inputs) * 150) + (1 * 31) + 11 
-    fee_rate = 2.0
-    fee = int(est_vbytes * fee_rate)
+    dest_script = to_address.to_script_pub_key()
+    tx_output = TxOutput(0, dest_script)
+    tx = Transaction(tx_inputs, [tx_output], has_segwit=True)
+
+    # 以 dummy 簽名 (User + Oracle) 計算實際 vsize
+    vsize = tx_vsize(tx, [script_path_witness(2, script_win_hex, cb_hex)] * len(utxos))
+    fee = fee_for(vsize, fee_rates.current())
     
     send_amount = total_in - fee
     if send_amount <= 0: raise ValueError(f"Insufficient funds for fee")
+    tx_output.amount = send_amount
 
-    dest_script = to_address.to_script_pub_key()
-    tx_output = TxOutput(send_amount, dest_script)
-    tx = Transaction(tx_inputs, [tx_output], has_segwit=True)
-
-    user_x = to_x_only(contract['user_pubkey'])
-    oracle_x = to_x_only(ORACLE_PRIV_KEY.get_public_key().to_hex())
+    user_x = ctx.user_x
+    oracle_x = ORACLE_X_ONLY
     
     pubkeys = sorted([user_x, oracle_x])
     
+    sighash = TaprootSighash(tx, [utxo_script_pubkey] * len(utxos), [u['value'] for u in utxos])
+    sigs = await signer.sign([
+        schnorr_job('oracle', sighash.script_path(i, script_win)) for i in range(len(utxos))
+    ])
+    
     for i, utxo in enumerate(utxos):
-        amount = utxo['value']
-        
-        sig_oracle = ORACLE_PRIV_KEY.sign_taproot_input(
-            tx, i, [utxo_script_pubkey], [amount],
-            script_path=True, tapleaf_script=script_win, tweak=False
-        )
+        sig_oracle = sigs[i]
         
         sigs_map = {
             oracle_x: sig_oracle
@@ -74,28 +66,15 @@ async def build_win_path_partial_tx(contract, to_address):
             else:
                 witness_stack.append("")
         
-        witness_elements = witness_stack + [script_win.to_hex(), cb.to_hex()]
+        witness_elements = witness_stack + [script_win_hex, cb_hex]
         tx.witnesses.append(TxWitnessInput(witness_elements))
 
     return tx.serialize()
 
 async def build_multisig_spend(contract, to_address):
     """ 構建 Taproot Script Path 花費交易 (House + Oracle 簽名 -> LOSS Branch) """
-    tree, _, script_loss, _ = create_contract_tree(
-        contract['user_pubkey'], 
-        HOUSE_PRIV_KEY.get_public_key().to_hex(),
-        ORACLE_PRIV_KEY.get_public_key().to_hex(), 
-        contract['nonce']
-    )
-    
-    internal_pub = PublicKey(NUMS_PUBKEY_HEX)
-    internal_pub_bytes = internal_pub.to_bytes()
-    
-    root_hash = get_tag_hashed_merkle_root(tree)
-    tweak = int.from_bytes(root_hash, 'big')
-    _, parity = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    
-    cb = ControlBlock(internal_pub, tree, 1, is_odd=(parity == 1))
+    ctx = get_spend_context(contract['user_pubkey'], contract['nonce'])
+    script_loss, script_loss_hex, cb_hex = ctx.leaf('loss')
     
     utxos = await get_utxos(contract['deposit_address'])
     if not utxos:
@@ -104,44 +83,38 @@ async def build_multisig_spend(contract, to_address):
     tx_inputs = []
     total_in = 0
     
-    tweaked_pubkey, _ = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    tr_addr = P2trAddress(witness_program=tweaked_pubkey[:32].hex())
-    utxo_script_pubkey = tr_addr.to_script_pub_key()
+    utxo_script_pubkey = ctx.script_pubkey
     
     for utxo in utxos:
         tx_inputs.append(TxInput(utxo['txid'], utxo['vout']))
         total_in += utxo['value']
 
-    est_vbytes = (len(tx_inputs) * 150) + (1 * 31) + 11 
-    fee_rate = 2.0
-    fee = int(est_vbytes * fee_rate)
-    
-    print(f"Estimated vBytes: {est_vbytes}, Fee: {fee} sats")
+    dest_script = to_address.to_script_pub_key()
+    tx_output = TxOutput(0, dest_script)
+    tx = Transaction(tx_inputs, [tx_output], has_segwit=True)
+
+    vsize = tx_vsize(tx, [script_path_witness(2, script_loss_hex, cb_hex)] * len(utxos))
+    fee = fee_for(vsize, fee_rates.current())
 
     send_amount = total_in - fee
     if send_amount <= 0: raise ValueError(f"Insufficient funds for fee (Need {fee}, Has {total_in})")
+    tx_output.amount = send_amount
 
-    dest_script = to_address.to_script_pub_key()
-    tx_output = TxOutput(send_amount, dest_script)
-    tx = Transaction(tx_inputs, [tx_output], has_segwit=True)
-
-    house_x = to_x_only(HOUSE_PRIV_KEY.get_public_key().to_hex())
-    oracle_x = to_x_only(ORACLE_PRIV_KEY.get_public_key().to_hex())
+    house_x = HOUSE_X_ONLY
+    oracle_x = ORACLE_X_ONLY
     
     pubkeys = sorted([house_x, oracle_x])
     
+    sighash = TaprootSighash(tx, [utxo_script_pubkey] * len(utxos), [u['value'] for u in utxos])
+    jobs = []
+    for i in range(len(utxos)):
+        digest = sighash.script_path(i, script_loss)
+        jobs.append(schnorr_job('house', digest))
+        jobs.append(schnorr_job('oracle', digest))
+    sigs = await signer.sign(jobs)
+    
     for i, utxo in enumerate(utxos):
-        amount = utxo['value']
-        
-        sig_house = HOUSE_PRIV_KEY.sign_taproot_input(
-            tx, i, [utxo_script_pubkey], [amount],
-            script_path=True, tapleaf_script=script_loss, tweak=False
-        )
-        
-        sig_oracle = ORACLE_PRIV_KEY.sign_taproot_input(
-            tx, i, [utxo_script_pubkey], [amount],
-            script_path=True, tapleaf_script=script_loss, tweak=False
-        )
+        sig_house, sig_oracle = sigs[2 * i], sigs[2 * i + 1]
         
         sigs_map = {
             house_x: sig_house,
@@ -155,65 +128,127 @@ async def build_multisig_spend(contract, to_address):
             else:
                 witness_stack.append("") 
         
-        witness_elements = witness_stack + [script_loss.to_hex(), cb.to_hex()]
+        witness_elements = witness_stack + [script_loss_hex, cb_hex]
         tx.witnesses.append(TxWitnessInput(witness_elements))
 
     return tx.serialize()
 
+async def build_batch_multisig_spend(entries, to_address):
+    """
+    構建多合約 LOSS 路徑的合併花費交易 (House + Oracle 簽名)
+    entries: [(contract, utxos)]，每個輸入使用各自合約的葉腳本與控制區塊
+    """
+    tx_inputs = []
+    prevouts = []
+    total_in = 0
+
+    for contract, utxos in entries:
+        ctx = get_spend_context(contract['user_pubkey'], contract['nonce'])
+        for utxo in utxos:
+            tx_inputs.append(TxInput(utxo['txid'], utxo['vout']))
+            prevouts.append((ctx, utxo['value']))
+            total_in += utxo['value']
+
+    if not tx_inputs:
+        raise ValueError("Contract addresses have no funds")
+
+    tx_output = TxOutput(0, to_address.to_script_pub_key())
+    tx = Transaction(tx_inputs, [tx_output], has_segwit=True)
+
+    vsize = tx_vsize(tx, [script_path_witness(2, *ctx.leaf('loss')[1:]) for ctx, _ in prevouts])
+    fee = fee_for(vsize, fee_rates.current())
+
+    send_amount = total_in - fee
+    if send_amount <= 0: raise ValueError(f"Insufficient funds for fee (Need {fee}, Has {total_in})")
+    tx_output.amount = send_amount
+
+    # BIP341: 每個輸入的簽名都需涵蓋全部輸入的 scriptPubKey 與金額 (交易層雜湊只算一次)
+    sighash = TaprootSighash(tx, [ctx.script_pubkey for ctx, _ in prevouts], [amount for _, amount in prevouts])
+    pubkeys = sorted([HOUSE_X_ONLY, ORACLE_X_ONLY])
+
+    jobs = []
+    for i, (ctx, _) in enumerate(prevouts):
+        digest = sighash.script_path(i, ctx.leaf('loss')[0])
+        jobs.append(schnorr_job('house', digest))
+        jobs.append(schnorr_job('oracle', digest))
+    sigs = await signer.sign(jobs)
+
+    for i, (ctx, _) in enumerate(prevouts):
+        _, script_loss_hex, cb_hex = ctx.leaf('loss')
+
+        sigs_map = {
+            HOUSE_X_ONLY: sigs[2 * i],
+            ORACLE_X_ONLY: sigs[2 * i + 1]
+        }
+
+        witness_stack = [sigs_map[pk] for pk in reversed(pubkeys)]
+        tx.witnesses.append(TxWitnessInput(witness_stack + [script_loss_hex, cb_hex]))
+
+    return tx.serialize()
+
 async def send_funds_from_house(to_address_obj, amount_sats):
     """ 從 House 發送資金 """
-    house_pub = HOUSE_PRIV_KEY.get_public_key()
+    return await send_funds_from_house_batch([(to_address_obj, amount_sats)])
+
+async def send_funds_from_house_batch(payments):
+    """
+    從 House 以單筆交易發送多筆資金，payments: [(address_obj, amount_sats)]
+    由 House 帳本選幣並保留 UTXO；廣播成功後帳本自動更新，失敗時呼叫 house_wallet.release_tx
+    """
+    house_pub = HOUSE_PUB_KEY
     house_addr = house_pub.get_segwit_address()
-    utxos = await get_utxos(house_addr.to_string())
-    
-    if not utxos:
-        raise ValueError("House wallet has no funds! Please fund the House address first.")
+    total_out = sum(amount for _, amount in payments)
+    fee_rate = fee_rates.current()
+    utxos = await house_wallet.select(total_out, len(payments), fee_rate)
+    try:
+        return await _sign_house_tx(house_pub, house_addr, utxos, payments, fee_rate)
+    except Exception:
+        house_wallet.release(utxos)
+        raise
 
+async def _sign_house_tx(house_pub, house_addr, utxos, payments, fee_rate):
     tx_inputs = []
     total_in = 0
     for utxo in utxos:
         tx_inputs.append(TxInput(utxo['txid'], utxo['vout']))
         total_in += utxo['value']
 
-    est_vbytes = (len(tx_inputs) * 68) + 43 + 31 + 11
-    fee = int(est_vbytes * 2.0)
-    change = total_in - amount_sats - fee
-    
-    if change < 0:
-         raise ValueError(f"House insufficient funds. Has {total_in}, needs {amount_sats+fee}")
+    total_out = sum(amount for _, amount in payments)
 
     outputs = []
-    outputs.append(TxOutput(amount_sats, to_address_obj.to_script_pub_key()))
-    
-    if change > 546:
-        outputs.append(TxOutput(change, house_addr.to_script_pub_key()))
+    for to_address_obj, amount_sats in payments:
+        outputs.append(TxOutput(amount_sats, to_address_obj.to_script_pub_key()))
 
-    tx = Transaction(tx_inputs, outputs, has_segwit=True)
+    witnesses = [p2wpkh_witness()] * len(utxos)
+    change_output = TxOutput(0, house_addr.to_script_pub_key())
+    tx = Transaction(tx_inputs, outputs + [change_output], has_segwit=True)
+    fee = fee_for(tx_vsize(tx, witnesses), fee_rate)
+    change = total_in - total_out - fee
+    
+    if change > DUST_LIMIT:
+        change_output.amount = change
+    else:
+        # 選幣可能選出免找零的組合: 此時以不含找零輸出的大小計費，餘額併入手續費
+        tx = Transaction(tx_inputs, outputs, has_segwit=True)
+        fee = fee_for(tx_vsize(tx, witnesses), fee_rate)
+        if total_in - total_out < fee:
+            raise ValueError(f"House insufficient funds. Has {total_in}, needs {total_out+fee}")
 
     p2pkh_script = house_pub.get_address().to_script_pub_key()
 
-    for i, utxo in enumerate(utxos):
-        sig = HOUSE_PRIV_KEY.sign_segwit_input(tx, i, p2pkh_script, utxo['value'])
+    sigs = await signer.sign([
+        ecdsa_job('house', tx.get_transaction_segwit_digest(i, p2pkh_script, utxo['value']))
+        for i, utxo in enumerate(utxos)
+    ])
+    for sig in sigs:
         tx.witnesses.append(TxWitnessInput([sig, house_pub.to_hex()]))
         
     return tx.serialize()
 
 async def build_refund_tx(contract):
     """ 構建 Taproot 退款交易 (User + House 簽名 -> Refund Branch) """
-    tree, _, _, script_refund = create_contract_tree(
-        contract['user_pubkey'], 
-        HOUSE_PRIV_KEY.get_public_key().to_hex(),
-        ORACLE_PRIV_KEY.get_public_key().to_hex(), 
-        contract['nonce']
-    )
-    
-    internal_pub = PublicKey(NUMS_PUBKEY_HEX)
-    internal_pub_bytes = internal_pub.to_bytes()
-    root_hash = get_tag_hashed_merkle_root(tree)
-    tweak = int.from_bytes(root_hash, 'big')
-    _, parity = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    
-    cb = ControlBlock(internal_pub, tree, 2, is_odd=(parity == 1))
+    ctx = get_spend_context(contract['user_pubkey'], contract['nonce'])
+    script_refund, script_refund_hex, cb_hex = ctx.leaf('refund')
     
     utxos = await get_utxos(contract['deposit_address'])
     if not utxos:
@@ -222,49 +257,51 @@ async def build_refund_tx(contract):
     tx_inputs = []
     total_in = 0
     
-    tweaked_pubkey, _ = tweak_taproot_pubkey(internal_pub_bytes, tweak)
-    tr_addr = P2trAddress(witness_program=tweaked_pubkey[:32].hex())
-    utxo_script_pubkey = tr_addr.to_script_pub_key()
+    utxo_script_pubkey = ctx.script_pubkey
     
     for utxo in utxos:
         tx_inputs.append(TxInput(utxo['txid'], utxo['vout']))
         total_in += utxo['value']
 
     amount = contract['amount']
-    est_vbytes = (len(tx_inputs) * 150) + (2 * 31) + 11
-    fee = int(est_vbytes * 2.0)
     
     outputs = []
     msg = ""
     
     if total_in >= amount * 2:
-        refund_amount = (total_in - fee) // 2
         user_addr = PublicKey(contract['user_pubkey']).get_segwit_address()
-        house_addr = HOUSE_PRIV_KEY.get_public_key().get_segwit_address()
+        house_addr = HOUSE_PUB_KEY.get_segwit_address()
         
-        outputs.append(TxOutput(refund_amount, user_addr.to_script_pub_key()))
-        outputs.append(TxOutput(refund_amount, house_addr.to_script_pub_key()))
+        outputs.append(TxOutput(0, user_addr.to_script_pub_key()))
+        outputs.append(TxOutput(0, house_addr.to_script_pub_key()))
         msg = "Refunded 50/50 to User and House (Partial TX)"
     else:
-        refund_amount = total_in - fee
         user_addr = PublicKey(contract['user_pubkey']).get_segwit_address()
-        outputs.append(TxOutput(refund_amount, user_addr.to_script_pub_key()))
+        outputs.append(TxOutput(0, user_addr.to_script_pub_key()))
         msg = "Refunded all to User (Partial TX)"
 
     tx = Transaction(tx_inputs, outputs, has_segwit=True)
 
-    user_x = to_x_only(contract['user_pubkey'])
-    house_x = to_x_only(HOUSE_PRIV_KEY.get_public_key().to_hex())
+    # 以 dummy 簽名 (User + House) 計算實際 vsize，手續費由各輸出平均分攤
+    vsize = tx_vsize(tx, [script_path_witness(2, script_refund_hex, cb_hex)] * len(utxos))
+    fee = fee_for(vsize, fee_rates.current())
+    refund_amount = (total_in - fee) // len(outputs)
+    if refund_amount <= 0: raise ValueError(f"Insufficient funds for fee")
+    for output in outputs:
+        output.amount = refund_amount
+
+    user_x = ctx.user_x
+    house_x = HOUSE_X_ONLY
     
     pubkeys = sorted([user_x, house_x])
     
+    sighash = TaprootSighash(tx, [utxo_script_pubkey] * len(utxos), [u['value'] for u in utxos])
+    sigs = await signer.sign([
+        schnorr_job('house', sighash.script_path(i, script_refund)) for i in range(len(utxos))
+    ])
+    
     for i, utxo in enumerate(utxos):
-        amount_sats = utxo['value']
-        
-        sig_house = HOUSE_PRIV_KEY.sign_taproot_input(
-            tx, i, [utxo_script_pubkey], [amount_sats],
-            script_path=True, tapleaf_script=script_refund, tweak=False
-        )
+        sig_house = sigs[i]
         
         sigs_map = {
             house_x: sig_house
@@ -277,7 +314,7 @@ async def build_refund_tx(contract):
             else:
                 witness_stack.append("")
         
-        witness_elements = witness_stack + [script_refund.to_hex(), cb.to_hex()]
+        witness_elements = witness_stack + [script_refund_hex, cb_hex]
         tx.witnesses.append(TxWitnessInput(witness_elements))
 
     return tx.serialize(), msg
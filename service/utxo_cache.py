@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from bitcoinutils.transactions import Transaction
+from dotenv import load_dotenv
+from .chain_backend import address_to_script_hex
+
+load_dotenv()
+
+# UTXO 快取配置 (秒)
+UTXO_CACHE_TTL = float(os.getenv("UTXO_CACHE_TTL", "10"))
+UTXO_CACHE_NEGATIVE_TTL = float(os.getenv("UTXO_CACHE_NEGATIVE_TTL", "3"))
+UTXO_CACHE_MAX_ENTRIES = int(os.getenv("UTXO_CACHE_MAX_ENTRIES", "10000"))
+
+class UtxoCache:
+    """
+    以地址為鍵的 UTXO TTL 快取
+    - 同一地址的並發查詢合併為一次上游請求 (single-flight)
+    - 空地址使用較短的 negative TTL
+    - 廣播成功後依交易的輸入 / 輸出失效相關地址
+    """
+
+    def __init__(self, fetch, ttl=UTXO_CACHE_TTL, negative_ttl=UTXO_CACHE_NEGATIVE_TTL,
+                 max_entries=UTXO_CACHE_MAX_ENTRIES):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # address -> (expires_at, utxos, script_hex)
+        self._inflight = {}             # address -> Future
+        self._generation = {}           # address -> 查詢期間的失效次數，防止寫回過期結果
+        self._outpoints = {}            # (txid, vout) -> address
+        self._scripts = {}              # scriptPubKey hex -> address
+
+    async def get(self, address):
+        entry = self._entries.get(address)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(address)
+            return list(entry[1])
+
+        future = self._inflight.get(address)
+        if future is None:
+            future = asyncio.ensure_future(self._load(address))
+            self._inflight[address] = future
+            future.add_done_callback(lambda _: self._inflight.pop(address, None))
+        return list(await asyncio.shield(future))
+
+    async def _load(self, address):
+        generation = self._generation.get(address, 0)
+        try:
+            utxos = await self._fetch(address)
+        finally:
+            stale = self._generation.pop(address, 0) != generation
+        if not stale:
+            self._store(address, utxos)
+        return utxos
+
+    def _store(self, address, utxos):
+        ttl = self.ttl if utxos else self.negative_ttl
+        if ttl <= 0:
+            return
+        self._drop(address)
+        try:
+            script_hex = address_to_script_hex(address)
+        except Exception:
+            script_hex = None
+        self._entries[address] = (time.monotonic() + ttl, utxos, script_hex)
+        for u in utxos:
+            self._outpoints[(u['txid'], u['vout'])] = address
+        if script_hex:
+            self._scripts[script_hex] = address
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, address):
+        entry = self._entries.pop(address, None)
+        if entry:
+            for u in entry[1]:
+                self._outpoints.pop((u['txid'], u['vout']), None)
+            self._scripts.pop(entry[2], None)
+
+    def invalidate(self, *addresses):
+        for address in addresses:
+            if address in self._inflight:
+                self._generation[address] = self._generation.get(address, 0) + 1
+            self._drop(address)
+
+    def invalidate_tx(self, tx_hex):
+        """ 失效被交易花費的輸入地址與收款輸出地址 """
+        tx = Transaction.from_raw(tx_hex)
+        affected = set()
+        for txin in tx.inputs:
+            address = self._outpoints.get((txin.txid, txin.txout_index))
+            if address: affected.add(address)
+        for txout in tx.outputs:
+            address = self._scripts.get(txout.script_pubkey.to_hex())
+            if address: affected.add(address)
+        self.invalidate(*affected)
+        return affected
+
+    def clear(self):
+        self.invalidate(*list(self._entries), *list(self._inflight))
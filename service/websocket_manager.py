@@ -1,22 +1,148 @@
+import os
+import json
+import asyncio
+from collections import defaultdict
 from fastapi import WebSocket
-from typing import List
+from typing import Dict, Iterable, Set
+from dotenv import load_dotenv
+from service.event_bus import event_bus
+
+load_dotenv()
+
+# 每條連線的待送佇列長度與單次送出逾時 (秒)，超過即視為慢速客戶端並斷線
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# 沒有 contract_id / user_pubkey 的事件 (例如 SETTLE_ALL_DONE、EXPOSURE) 屬於此主題，一律送給所有連線
+GLOBAL_TOPIC = "global"
+
+def message_topics(message: dict):
+    """ 事件所屬的訂閱主題 """
+    topics = []
+    if message.get('contract_id') is not None:
+        topics.append(f"contract:{message['contract_id']}")
+    if message.get('user_pubkey'):
+        topics.append(f"user:{message['user_pubkey']}")
+    return topics or [GLOBAL_TOPIC]
+
+class ClientConnection:
+    """ 單一 WebSocket 連線: 有界待送佇列 + 專屬寫出 task """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.writer = asyncio.ensure_future(self._write_loop())
+
+    async def _write_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                async with asyncio.timeout(WS_SEND_TIMEOUT):
+                    await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.manager.evict(self.websocket)
+
+    def enqueue(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
 
 class ConnectionManager:
+    """
+    WebSocket 事件分發
+    - 事件只編碼一次，放入各連線的待送佇列，由各自的 task 寫出；慢速連線不影響其他連線
+    - 佇列已滿或送出失敗的連線會被移除
+    - 未訂閱任何主題的連線接收所有事件；訂閱後只接收 contract:<id> / user:<pubkey> 事件與所有 global 事件
+    - 事件同時經 event_bus 送往其他 worker，由其 deliver() 分發給各自的連線
+    """
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self._wildcard: Set[ClientConnection] = set()
+        self._topics: Dict[str, Set[ClientConnection]] = defaultdict(set)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = ()):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        conn = ClientConnection(websocket, self)
+        self.active_connections[websocket] = conn
+        self._wildcard.add(conn)
+        self.subscribe(websocket, topics)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        conn = self.active_connections.pop(websocket, None)
+        if conn is None:
+            return
+        conn.writer.cancel()
+        self._wildcard.discard(conn)
+        for topic in conn.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(conn)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def evict(self, websocket: WebSocket):
+        """ 移除慢速或已失效的連線並嘗試關閉 """
+        if websocket not in self.active_connections:
+            return
+        self.disconnect(websocket)
+        asyncio.ensure_future(self._close(websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        conn = self.active_connections.get(websocket)
+        if conn is None:
+            return
+        for topic in topics:
+            conn.topics.add(topic)
+            self._topics[topic].add(conn)
+        if conn.topics:
+            self._wildcard.discard(conn)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        conn = self.active_connections.get(websocket)
+        if conn is None:
+            return
+        for topic in topics:
+            conn.topics.discard(topic)
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(conn)
+                if not subscribers:
+                    del self._topics[topic]
+        if not conn.topics:
+            self._wildcard.add(conn)
+
+    def _fan_out(self, message: dict, text: str):
+        topics = message_topics(message)
+        if topics == [GLOBAL_TOPIC]:
+            targets = list(self.active_connections.values())
+        else:
+            targets = set(self._wildcard)
+            for topic in topics:
+                targets.update(self._topics.get(topic, ()))
+        for conn in targets:
+            if not conn.enqueue(text):
+                self.evict(conn.websocket)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+        text = json.dumps(message)
+        self._fan_out(message, text)
+        await event_bus.publish(text)
+
+    def deliver(self, text: str):
+        """ 其他 worker 發出的事件 (不再轉送) """
+        self._fan_out(json.loads(text), text)
 
 manager = ConnectionManager()